@@ -0,0 +1,235 @@
+"""
+asyncio counterparts of the Joplin stores and Boost Note collections.
+
+Every method runs the blocking work off the event loop. File access runs on a
+thread pool, along with parsing Joplin items, which is cheap next to shipping
+them to another process. Parsing CSON is slow enough to run on a process pool,
+where it doesn't hold the GIL the event loop needs. Both pools are shared by
+every instance in the process, so a service can keep many vaults open and
+serve requests for all of them at once. Each instance also caps how many of
+its own operations run concurrently on either pool, so that one large vault
+can't monopolise them.
+"""
+import asyncio
+import collections
+import os
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import AsyncIterator, Awaitable, Callable, Iterable, List, Optional
+
+import cson
+
+from . import boostnote, joplin
+
+# Operations an instance runs concurrently, unless told otherwise
+DEFAULT_CONCURRENCY = 16
+
+_executors_lock = threading.Lock()
+_thread_executor: Optional[ThreadPoolExecutor] = None
+_process_executor: Optional[ProcessPoolExecutor] = None
+
+
+def get_thread_executor() -> ThreadPoolExecutor:
+    """Get the thread pool shared by every async store, creating it if needed"""
+    global _thread_executor
+    with _executors_lock:
+        if _thread_executor is None:
+            _thread_executor = ThreadPoolExecutor(thread_name_prefix="sovereign-io")
+        return _thread_executor
+
+
+def get_process_executor() -> ProcessPoolExecutor:
+    """Get the process pool shared by every async store, creating it if needed"""
+    global _process_executor
+    with _executors_lock:
+        if _process_executor is None:
+            _process_executor = ProcessPoolExecutor()
+        return _process_executor
+
+
+def shutdown_executors(wait: bool = True):
+    """Shut down the shared pools. They are recreated if used again."""
+    global _thread_executor, _process_executor
+    with _executors_lock:
+        executors = [_thread_executor, _process_executor]
+        _thread_executor = _process_executor = None
+    for executor in executors:
+        if executor is not None:
+            executor.shutdown(wait=wait)
+
+
+def _parse_boostnote_entity(note_id: str, text: str) -> boostnote.BoostnoteEntity:
+    # Runs in a worker process
+    return boostnote.BoostnoteCollection._marshal_entity(note_id, cson.loads(text))
+
+
+class _AsyncWrapper:
+    def __init__(
+        self,
+        max_concurrency: int = DEFAULT_CONCURRENCY,
+        executor: Optional[Executor] = None,
+        process_executor: Optional[Executor] = None,
+    ):
+        self.max_concurrency = max_concurrency
+        self._executor = executor
+        self._process_executor = process_executor
+        # Created on first use, so that it belongs to the running event loop
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    def _limit(self) -> asyncio.Semaphore:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    async def _run(self, fn: Callable, *args):
+        """Run blocking IO on the thread pool"""
+        executor = self._executor or get_thread_executor()
+        async with self._limit():
+            return await asyncio.get_running_loop().run_in_executor(executor, fn, *args)
+
+    async def _parse(self, fn: Callable, *args):
+        """Run CPU-bound parsing on the process pool"""
+        executor = self._process_executor or get_process_executor()
+        async with self._limit():
+            return await asyncio.get_running_loop().run_in_executor(executor, fn, *args)
+
+    async def _ordered_map(
+        self, fn: Callable[..., Awaitable], items: Iterable
+    ) -> AsyncIterator:
+        """
+        Await fn(item) for each item with up to max_concurrency in flight,
+        yielding the results in the order of items
+        """
+        pending: collections.deque = collections.deque()
+        try:
+            for item in items:
+                pending.append(asyncio.ensure_future(fn(item)))
+                if len(pending) >= self.max_concurrency:
+                    yield await pending.popleft()
+            while pending:
+                yield await pending.popleft()
+        finally:
+            # The consumer stopped early or something failed
+            for future in pending:
+                future.cancel()
+
+
+class AsyncStore(_AsyncWrapper):
+    """
+    Wrap a joplin.Store for use from asyncio.
+
+    Reads may run concurrently, so wrap a store that supports that, such as
+    IndexedJoplinTarStore or JoplinRawStore. Writes are serialized, since
+    appending to a tar archive can't be done from several threads at once.
+    """
+
+    def __init__(self, store: joplin.Store, **kwargs):
+        super().__init__(**kwargs)
+        self.store = store
+        self._write_lock: Optional[asyncio.Lock] = None
+
+    def _writing(self) -> asyncio.Lock:
+        if self._write_lock is None:
+            self._write_lock = asyncio.Lock()
+        return self._write_lock
+
+    async def list(self, relative_path: str = "") -> List[str]:
+        return list(await self._run(self.store.list, relative_path))
+
+    async def read_bin(self, relative_path: str) -> bytes:
+        return await self._run(self.store.read_bin, relative_path)
+
+    async def read(self, relative_path: str) -> str:
+        return await self._run(self.store.read, relative_path)
+
+    async def write(self, relative_path: str, contents: str):
+        async with self._writing():
+            await self._run(self.store.write, relative_path, contents)
+
+    async def write_bin(self, relative_path: str, contents: bytes):
+        async with self._writing():
+            await self._run(self.store.write_bin, relative_path, contents)
+
+    async def read_resource_bin(self, resource: joplin.JoplinResource) -> bytes:
+        return await self.read_bin(self.store.resource_path(resource))
+
+    async def get_note_by_id(self, joplin_id: str) -> joplin.ParsedJoplinNote:
+        return await self._run(_read_joplin_item, self.store, f"{joplin_id}.md")
+
+    async def _read_entity(self, relative_path: str):
+        try:
+            return await self._run(_read_joplin_item, self.store, relative_path)
+        except Exception:
+            print(f"Could not parse {relative_path}")
+            return None
+
+    async def get_entities(self) -> AsyncIterator[joplin.ParsedJoplinNote]:
+        """
+        Get every item (notes, folders, tags, resources, ...) in the store,
+        skipping any that can't be parsed
+        """
+        paths = [p for p in await self.list() if p.endswith(".md")]
+        async for item in self._ordered_map(self._read_entity, paths):
+            if item is not None:
+                yield item
+
+
+class AsyncBoostnoteCollection(_AsyncWrapper):
+    """Wrap a BoostnoteCollection for use from asyncio"""
+
+    def __init__(self, col: boostnote.BoostnoteCollection, **kwargs):
+        super().__init__(**kwargs)
+        self.col = col
+
+    @classmethod
+    async def from_dir(cls, dir_path: str, **kwargs) -> "AsyncBoostnoteCollection":
+        self = cls(None, **kwargs)
+        self.col = await self._run(boostnote.BoostnoteCollection.from_dir, dir_path)
+        return self
+
+    async def get_entity_paths(self) -> List[str]:
+        return await self._run(self.col.get_entity_paths)
+
+    async def read_entity(self, note_path: str) -> boostnote.BoostnoteEntity:
+        """Read a single entity from its path within the notes directory"""
+        note_id = os.path.basename(note_path).rsplit(".", 1)[0]
+        text = await self._run(_read_text, note_path)
+        return await self._parse(_parse_boostnote_entity, note_id, text)
+
+    async def _read_entity_or_none(self, note_path: str):
+        try:
+            return await self.read_entity(note_path)
+        except cson.ParseError:
+            print(f"CSON parsing failed for note: {note_path}")
+        except Exception as exc:
+            print(exc)
+            print(f"Bad note: {note_path}")
+        return None
+
+    async def get_entities(self) -> AsyncIterator[boostnote.BoostnoteEntity]:
+        """
+        Get all entities (ie. notes and code snippets) for this collection,
+        skipping any that can't be parsed
+        """
+        paths = await self.get_entity_paths()
+        async for entity in self._ordered_map(self._read_entity_or_none, paths):
+            if entity is not None:
+                yield entity
+
+    async def add_entity(self, entity: boostnote.BoostnoteEntity):
+        await self._run(self.col.add_entity, entity)
+
+    async def read_attachment(self, a: boostnote.BoostnoteAttachment) -> bytes:
+        return await self._run(self.col.read_attachment, a)
+
+    async def add_attachment(self, relpath: str, data: bytes):
+        await self._run(self.col.add_attachment, relpath, data)
+
+
+def _read_joplin_item(store: joplin.Store, relative_path: str):
+    return joplin.parse_joplin_note(store.read(relative_path))
+
+
+def _read_text(path: str) -> str:
+    with open(path) as fh:
+        return fh.read()
@@ -0,0 +1,274 @@
+"""
+Distributions of the sizes, links, folders, tags and dates of a vault's items.
+
+A single pass over the vault (see ir.read) extracts a few numbers per note and
+attachment into columns: typed arrays of machine integers, which take a few
+bytes per item however large the items are. Aggregations then work on whole
+columns at once. With NumPy installed the columns are viewed as NumPy arrays
+without copying and the aggregations are vectorized; without it, the same
+aggregations fall back to plain Python over the arrays.
+"""
+import csv
+import datetime
+import json
+from array import array
+from collections import Counter
+from typing import IO, Dict, Iterable, List, Optional, Sequence
+
+from . import ir
+from .convert_jex_to_boostnote import JOPLIN_LINK_PROG
+from .options import ID_MAP_SPILL_THRESHOLD
+from .util import to_utc
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+PERCENTILES = (50, 90, 99)
+
+# Columns of the per-note CSV export
+CSV_FIELDS = ("id", "folder", "size", "links", "tags", "created_at", "updated_at")
+
+
+class VaultMetrics:
+    """
+    Per-item metrics of a vault, one array per metric. Folders are stored as
+    indexes into folder_ids, and dates as seconds since the epoch.
+    """
+
+    def __init__(self):
+        self.note_sizes = array("q")
+        self.note_links = array("q")
+        self.note_tags = array("q")
+        self.note_folders = array("q")
+        self.note_created = array("q")
+        self.note_updated = array("q")
+        self.attachment_sizes = array("q")
+        self.folder_ids: List[str] = []
+        self.folder_names: Dict[str, str] = {}
+        self.tag_names: Dict[str, str] = {}
+        # Notes per tag ID. There are few enough tags to count them directly.
+        self.tag_counts = Counter()
+        self._folder_indexes: Dict[str, int] = {}
+
+    def folder_index(self, folder_id: str) -> int:
+        index = self._folder_indexes.get(folder_id)
+        if index is None:
+            index = self._folder_indexes[folder_id] = len(self.folder_ids)
+            self.folder_ids.append(folder_id)
+        return index
+
+
+def extract(
+    records: Iterable[ir.Record], notes_csv: Optional[IO[str]] = None
+) -> VaultMetrics:
+    """
+    Extract the metrics of a stream of records, optionally writing each note's
+    metrics to notes_csv as they are found
+    """
+    metrics = VaultMetrics()
+    writer = None
+    if notes_csv is not None:
+        writer = csv.writer(notes_csv)
+        writer.writerow(CSV_FIELDS)
+    for record in records:
+        if isinstance(record, ir.Folder):
+            metrics.folder_names[record.id] = record.name
+            metrics.folder_index(record.id)
+        elif isinstance(record, ir.Tag):
+            metrics.tag_names[record.id] = record.name
+        elif isinstance(record, ir.Resource):
+            if record.location is not None:
+                size = record.location[2]
+            else:
+                size = len(record.data)
+            metrics.attachment_sizes.append(size)
+        else:
+            size = len(record.body.encode("utf-8"))
+            links = sum(1 for _ in JOPLIN_LINK_PROG.finditer(record.body))
+            created_at = to_utc(record.created_at)
+            updated_at = to_utc(record.updated_at)
+            metrics.note_sizes.append(size)
+            metrics.note_links.append(links)
+            metrics.note_tags.append(len(record.tags))
+            metrics.note_folders.append(metrics.folder_index(record.folder_id))
+            metrics.note_created.append(int(created_at.timestamp()))
+            metrics.note_updated.append(int(updated_at.timestamp()))
+            metrics.tag_counts.update(record.tags)
+            if writer is not None:
+                writer.writerow(
+                    (
+                        record.id,
+                        metrics.folder_names.get(record.folder_id, record.folder_id),
+                        size,
+                        links,
+                        len(record.tags),
+                        created_at.isoformat(),
+                        updated_at.isoformat(),
+                    )
+                )
+    return metrics
+
+
+#
+# Aggregations over a column, vectorized when NumPy is available
+#
+
+
+def _column(values: array):
+    """View a column as a NumPy array, without copying it"""
+    return numpy.frombuffer(values, dtype=values.typecode)
+
+
+def percentiles(values: array, qs: Sequence[float] = PERCENTILES) -> Dict[str, float]:
+    """Get percentiles, interpolating linearly between the nearest values"""
+    if not values:
+        return {}
+    if numpy is not None:
+        results = numpy.percentile(_column(values), qs)
+    else:
+        ordered = sorted(values)
+        results = []
+        for q in qs:
+            position = (len(ordered) - 1) * q / 100
+            lo = int(position)
+            hi = min(lo + 1, len(ordered) - 1)
+            results.append(ordered[lo] + (ordered[hi] - ordered[lo]) * (position - lo))
+    return {f"p{q:g}": float(result) for q, result in zip(qs, results)}
+
+
+def summarize(values: array) -> dict:
+    """Get the count, total, mean, minimum, maximum and percentiles of a column"""
+    if not values:
+        return {"count": 0, "total": 0}
+    if numpy is not None:
+        column = _column(values)
+        total, lowest, highest = column.sum(), column.min(), column.max()
+    else:
+        total, lowest, highest = sum(values), min(values), max(values)
+    return {
+        "count": len(values),
+        "total": int(total),
+        "mean": int(total) / len(values),
+        "min": int(lowest),
+        "max": int(highest),
+        **percentiles(values),
+    }
+
+
+def size_histogram(values: array) -> List[dict]:
+    """
+    Count the values in power-of-two buckets: [0, 1), [1, 2), [2, 4), [4, 8)
+    and so on. Empty buckets are left out.
+    """
+    if numpy is not None:
+        # The exponent frexp returns is the bit length of each value
+        counts = numpy.bincount(numpy.frexp(_column(values).astype("d"))[1]).tolist()
+    else:
+        by_length = Counter(v.bit_length() for v in values)
+        counts = [by_length[n] for n in range(max(by_length, default=-1) + 1)]
+    return [
+        {"min": 1 << (n - 1) if n else 0, "max": 1 << n, "count": c}
+        for n, c in enumerate(counts)
+        if c
+    ]
+
+
+def count_codes(codes: array, n: int) -> List[int]:
+    """Count how often each of the integers 0 to n - 1 occurs in a column"""
+    if numpy is not None:
+        return numpy.bincount(_column(codes), minlength=n).tolist()
+    counts = Counter(codes)
+    return [counts[i] for i in range(n)]
+
+
+def count_months(seconds: array) -> Dict[str, int]:
+    """Count the times in a column by month, as `YYYY-MM`"""
+    if numpy is not None:
+        months = _column(seconds).astype("datetime64[s]").astype("datetime64[M]")
+        unique, counts = numpy.unique(months, return_counts=True)
+        return {str(m): int(c) for m, c in zip(unique, counts)}
+    counts = Counter(
+        datetime.datetime.fromtimestamp(s, datetime.timezone.utc).strftime("%Y-%m")
+        for s in seconds
+    )
+    return dict(sorted(counts.items()))
+
+
+def report(metrics: VaultMetrics) -> dict:
+    """Aggregate a vault's metrics into a report that can be dumped as JSON"""
+    note_sizes = summarize(metrics.note_sizes)
+    links = summarize(metrics.note_links)
+    folder_counts = count_codes(metrics.note_folders, len(metrics.folder_ids))
+    if numpy is not None:
+        notes_without_links = int((_column(metrics.note_links) == 0).sum())
+    else:
+        notes_without_links = sum(1 for n in metrics.note_links if n == 0)
+    kilobytes = note_sizes["total"] / 1024
+    return {
+        "notes": {
+            "size": note_sizes,
+            "size_histogram": size_histogram(metrics.note_sizes),
+        },
+        "attachments": {
+            "size": summarize(metrics.attachment_sizes),
+            "size_histogram": size_histogram(metrics.attachment_sizes),
+        },
+        "folders": [
+            {
+                "id": folder_id,
+                "name": metrics.folder_names.get(folder_id, folder_id),
+                "notes": n,
+            }
+            for folder_id, n in zip(metrics.folder_ids, folder_counts)
+        ],
+        "tags": {
+            metrics.tag_names.get(tag_id, tag_id): n
+            for tag_id, n in metrics.tag_counts.most_common()
+        },
+        "tags_per_note": summarize(metrics.note_tags),
+        "links": {
+            "per_note": links,
+            "per_kilobyte": links["total"] / kilobytes if kilobytes else 0.0,
+            "notes_without_links": notes_without_links,
+        },
+        "created": count_months(metrics.note_created),
+        "updated": count_months(metrics.note_updated),
+    }
+
+
+def analyze(
+    path: str,
+    notes_csv: Optional[IO[str]] = None,
+    spill_threshold: Optional[int] = ID_MAP_SPILL_THRESHOLD,
+) -> dict:
+    """
+    Analyze a Boost Note directory, JEX file, extracted JEX directory or
+    Joplin profile directory in one pass
+    """
+    records = ir.read(path, resource_owners=False, spill_threshold=spill_threshold)
+    return report(extract(records, notes_csv))
+
+
+def main(
+    path: str,
+    json_path: Optional[str] = None,
+    csv_path: Optional[str] = None,
+    spill_threshold: Optional[int] = ID_MAP_SPILL_THRESHOLD,
+) -> dict:
+    """
+    Print the report of a vault as JSON, or write it to json_path, and write
+    the metrics of each note to csv_path if given
+    """
+    if csv_path is not None:
+        with open(csv_path, "w", newline="") as fh:
+            result = analyze(path, fh, spill_threshold)
+    else:
+        result = analyze(path, spill_threshold=spill_threshold)
+    if json_path is not None:
+        with open(json_path, "w") as fh:
+            json.dump(result, fh, indent=2)
+    else:
+        print(json.dumps(result, indent=2))
+    return result
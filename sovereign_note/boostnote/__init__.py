@@ -1,25 +1,38 @@
 import datetime
 import enum
+import errno
 import json
 import os
 import pathlib
+import re
+import secrets
+import shutil
+import threading
 import traceback
 from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import suppress
 from dataclasses import dataclass
-from typing import Iterator, List, Set
+from typing import Container, Iterable, Iterator, List, Optional, Set, Tuple
 
 import cson
 
-from ..util import get_child_paths
+from ..util import (
+    BulkWriteError,
+    copy_range,
+    get_child_paths,
+    link_or_copy,
+    to_utc,
+)
 
 BOOSTNOTE_DATE_FORMAT = "%Y-%m-%dT%H:%M:%S.%f%z"
 
-
-def to_utc(dt):
-    if not dt.tzinfo:
-        return dt.replace(tzinfo=datetime.timezone.utc)
-    return (dt - dt.utcoffset()).replace(tzinfo=datetime.timezone.utc)
+# A top-level key of a CSON note and the rest of its line. Boost Note writes
+# top-level keys at the start of a line and indents every line of multi-line
+# strings (ie. note content), so content can't be mistaken for a key.
+CSON_TOP_LEVEL_KEY_PROG = re.compile(r"^([A-Za-z_]\w*):[ \t]*(.*)$", re.MULTILINE)
+# A quoted string, or the end of an array
+CSON_ARRAY_TOKEN_PROG = re.compile(r'"(?:[^"\\]|\\.)*"|\'[^\']*\'|\]')
 
 
 def boostnote_format_date(dt):
@@ -28,6 +41,46 @@ def boostnote_format_date(dt):
     return to_utc(dt).strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
 
 
+def _cson_string(token: str) -> str:
+    if token.startswith('"'):
+        return json.loads(token)
+    return token[1:-1]
+
+
+def scan_entity_keys(text: str, keys: Container[str]) -> dict:
+    """
+    Get some top-level values of a serialized note without parsing the rest of
+    it, in particular its content.
+
+    Only single-line strings, booleans and arrays of strings are understood,
+    which covers every key Boost Note writes apart from content and snippets.
+    Other values are returned as the raw text following the key. Keys that
+    can't be found are left out, so callers can fall back to a full parse.
+    """
+    found = {}
+    for m in CSON_TOP_LEVEL_KEY_PROG.finditer(text):
+        key, raw = m.group(1), m.group(2).rstrip()
+        if key not in keys or key in found:
+            continue
+        if raw.startswith("["):
+            items = []
+            for token in CSON_ARRAY_TOKEN_PROG.finditer(text, m.start(2) + 1):
+                if token.group(0) == "]":
+                    break
+                items.append(_cson_string(token.group(0)))
+            found[key] = items
+        elif raw.startswith(("'''", '"""')):
+            # Multi-line string
+            found[key] = raw
+        elif raw[:1] in ("'", '"') and raw[-1:] == raw[:1] and len(raw) > 1:
+            found[key] = _cson_string(raw)
+        elif raw in ("true", "false"):
+            found[key] = raw == "true"
+        else:
+            found[key] = raw
+    return found
+
+
 class BoostnoteEntityType(enum.Enum):
     SNIPPET_NOTE = "SNIPPET_NOTE"
     MARKDOWN_NOTE = "MARKDOWN_NOTE"
@@ -198,17 +251,44 @@ class BoostnoteCollection:
         )
 
     def get_entity_paths(self) -> List[str]:
+        """Get the paths of every entity, sorted so that the order is stable"""
         notes_dir = os.path.join(self.dir_path, "notes")
-        return list(map(lambda f: os.path.join(notes_dir, f), os.listdir(notes_dir)))
+        return [os.path.join(notes_dir, f) for f in sorted(os.listdir(notes_dir))]
 
-    def get_entities(self) -> Iterator[BoostnoteEntity]:
-        """Get all entities (ie. notes and code snippets) for this collection"""
-        for note_path in self.get_entity_paths():
+    def read_entity(self, note_path: str) -> BoostnoteEntity:
+        """Read a single entity from its path within the notes directory"""
+        note_id = os.path.basename(note_path).rsplit(".", 1)[0]
+        with open(note_path) as fh:
+            dat = cson.load(fh)
+        return self._marshal_entity(note_id, dat)
+
+    def read_entity_keys(self, note_path: str, keys: Container[str]) -> dict:
+        """
+        Read some top-level values of an entity without parsing all of it. See
+        scan_entity_keys.
+        """
+        with open(note_path) as fh:
+            return scan_entity_keys(fh.read(), keys)
+
+    def get_entities(
+        self,
+        exclude_ids: Container[str] = (),
+        note_paths: Optional[Iterable[str]] = None,
+    ) -> Iterator[BoostnoteEntity]:
+        """
+        Get all entities (ie. notes and code snippets) for this collection,
+        skipping those in exclude_ids without opening their files
+
+        :param note_paths: read only these entities, rather than every one in
+            the notes directory
+        """
+        if note_paths is None:
+            note_paths = self.get_entity_paths()
+        for note_path in note_paths:
+            if os.path.basename(note_path).rsplit(".", 1)[0] in exclude_ids:
+                continue
             try:
-                note_id = os.path.basename(note_path).rsplit(".", 1)[0]
-                with open(note_path) as fh:
-                    dat = cson.load(fh)
-                    yield self._marshal_entity(note_id, dat)
+                yield self.read_entity(note_path)
             except cson.ParseError:
                 print(f"CSON parsing failed for note: {note_path}")
             except Exception as exc:
@@ -228,6 +308,10 @@ class BoostnoteCollection:
     def _attachments_path(self):
         return os.path.join(self.dir_path, "attachments")
 
+    def bulk_writer(self, max_workers: Optional[int] = None) -> "BoostnoteBulkWriter":
+        """Get a writer that populates this collection concurrently and atomically"""
+        return BoostnoteBulkWriter(self, max_workers)
+
     def add_attachment(self, relpath: str, data: bytes):
         """
         :param relpath: Path relative to the attachments directory
@@ -243,27 +327,322 @@ class BoostnoteCollection:
         for note_relpath in get_child_paths(attachments_path):
             yield BoostnoteAttachment(note_relpath)
 
+    def attachment_path(self, a: BoostnoteAttachment) -> str:
+        return os.path.join(self.dir_path, "attachments", a.relative_path)
+
+    def open_attachment(self, a: BoostnoteAttachment):
+        """Open an attachment for streaming binary reads"""
+        return open(self.attachment_path(a), "rb")
+
     def read_attachment(self, a: BoostnoteAttachment):
-        with open(
-            os.path.join(self.dir_path, "attachments", a.relative_path), "rb"
-        ) as fh:
+        with self.open_attachment(a) as fh:
             return fh.read()
 
     def list_tags(self) -> Set[str]:
+        """Get every tag used in the collection, without parsing note content"""
         tags = set()
-        for entity in self.get_entities():
-            tags.update(entity.tags)
+        for note_path in self.get_entity_paths():
+            try:
+                keys = self.read_entity_keys(note_path, ("tags",))
+                if "tags" not in keys:
+                    keys["tags"] = self.read_entity(note_path).tags
+            except Exception as exc:
+                print(exc)
+                print(f"Bad note: {note_path}")
+                continue
+            tags.update(keys["tags"])
         return tags
 
-    def stats(self):
+    # The keys stats counts by, as (type, isStarred, isTrashed)
+    STATS_KEYS = ("type", "isStarred", "isTrashed")
+
+    def _scan_stats_keys(self) -> Iterator[Tuple[str, bool, bool]]:
+        for note_path in self.get_entity_paths():
+            try:
+                keys = self.read_entity_keys(note_path, self.STATS_KEYS)
+                if len(keys) < len(self.STATS_KEYS):
+                    entity = self.read_entity(note_path)
+                    yield entity.type_, entity.is_starred, entity.is_trashed
+                else:
+                    yield keys["type"], keys["isStarred"], keys["isTrashed"]
+            except Exception as exc:
+                print(exc)
+                print(f"Bad note: {note_path}")
+
+    def stats(self, fast: bool = False):
+        """
+        Count the notes and snippets, and how many are starred and trashed
+
+        :param fast: scan each entity for just the keys counted (see
+            scan_entity_keys) rather than parsing all of it. Entities the scan
+            doesn't find every key in are still parsed in full.
+        """
+        if fast:
+            rows = self._scan_stats_keys()
+        else:
+            rows = (
+                (entity.type_, entity.is_starred, entity.is_trashed)
+                for entity in self.get_entities()
+            )
         counts = Counter()
-        for entity in self.get_entities():
+        for type_, is_starred, is_trashed in rows:
             counts.update(
                 {
-                    "notes": 1 if isinstance(entity, BoostnoteNote) else 0,
-                    "snippets": 1 if isinstance(entity, BoostnoteSnippet) else 0,
-                    "starred": 1 if entity.is_starred else 0,
-                    "trashed": 1 if entity.is_trashed else 0,
+                    "notes": 1
+                    if type_ == BoostnoteEntityType.MARKDOWN_NOTE.value
+                    else 0,
+                    "snippets": 1
+                    if type_ == BoostnoteEntityType.SNIPPET_NOTE.value
+                    else 0,
+                    "starred": 1 if is_starred else 0,
+                    "trashed": 1 if is_trashed else 0,
                 }
             )
         return counts
+
+
+# Everything a collection written by this tool holds at its top level
+COLLECTION_ENTRIES = {"boostnote.json", "notes", "attachments"}
+
+
+def check_replaceable(dir_path: str):
+    """
+    Raise FileExistsError unless dir_path is missing, empty, or a collection
+    holding nothing but what this tool writes, so that replacing it can't
+    delete anything else
+    """
+    try:
+        entries = set(os.listdir(dir_path))
+    except FileNotFoundError:
+        return
+    if not entries:
+        return
+    if "boostnote.json" not in entries or not entries <= COLLECTION_ENTRIES:
+        raise FileExistsError(
+            errno.EEXIST,
+            "Refusing to replace a directory that isn't a Boost Note collection",
+            dir_path,
+        )
+
+
+def _replaced_dir_path(dir_path: str) -> str:
+    """Where replace_dir keeps the old copy of dir_path while replacing it"""
+    parent, name = os.path.split(os.path.abspath(dir_path))
+    return os.path.join(parent, f".{name}-replaced")
+
+
+def recover_replaced_dir(dir_path: str):
+    """
+    Finish a replace_dir of dir_path that was interrupted: put the old copy
+    back if the new one never arrived, or remove it if the new one did
+    """
+    backup = _replaced_dir_path(dir_path)
+    if not os.path.isdir(backup):
+        return
+    if os.path.lexists(dir_path):
+        shutil.rmtree(backup)
+    else:
+        os.rename(backup, dir_path)
+
+
+def replace_dir(src: str, dst: str):
+    """
+    Move the directory src to dst, replacing whatever is at dst, which must
+    be replaceable (see check_replaceable).
+
+    If dst doesn't exist or is empty, this is a single atomic rename. Otherwise
+    the old directory is first renamed out of the way and removed once the new
+    one is in place. That takes two renames, so a crash between them leaves
+    nothing at dst; the old directory is then restored by recover_replaced_dir,
+    which the next replace_dir or BoostnoteBulkWriter for dst calls first.
+    """
+    recover_replaced_dir(dst)
+    check_replaceable(dst)
+    try:
+        os.replace(src, dst)
+        return
+    except OSError as exc:
+        if exc.errno not in (errno.ENOTEMPTY, errno.EEXIST):
+            raise
+    backup = _replaced_dir_path(dst)
+    os.rename(dst, backup)
+    os.rename(src, dst)
+    shutil.rmtree(backup)
+
+
+def _make_staging_dir(dir_path: str) -> str:
+    """
+    Create an empty directory next to dir_path to build its replacement in.
+    Unlike tempfile.mkdtemp, it gets the mode os.mkdir gives any directory
+    under the umask, which it keeps once it replaces dir_path.
+    """
+    parent, name = os.path.split(os.path.abspath(dir_path))
+    os.makedirs(parent, exist_ok=True)
+    while True:
+        path = os.path.join(parent, f".{name}-staging-{secrets.token_hex(4)}")
+        try:
+            os.mkdir(path, 0o777)
+        except FileExistsError:
+            continue
+        return path
+
+
+class BoostnoteBulkWriter:
+    """
+    Write a collection's notes and attachments from a thread pool into a
+    staging directory next to the collection, and then move the staging
+    directory into place.
+
+    Use it as a context manager. The collection, including `boostnote.json`,
+    is only published if the block exits without an exception and every write
+    succeeds; otherwise the staging directory is discarded. Failed writes are
+    reported together, in the order they were added, as a BulkWriteError.
+
+    An existing directory is only replaced if it is empty or a collection
+    holding nothing but what this tool writes; anything else raises
+    FileExistsError before a single file is written.
+    """
+
+    # How many pending writes may be queued per worker before add_* blocks.
+    # This keeps memory bounded when the caller produces data faster than the
+    # disk can absorb it.
+    PENDING_WRITES_PER_WORKER = 4
+
+    def __init__(self, col: BoostnoteCollection, max_workers: Optional[int] = None):
+        recover_replaced_dir(col.dir_path)
+        check_replaceable(col.dir_path)
+        self.col = col
+        # Same default as ThreadPoolExecutor: writes are I/O bound
+        max_workers = max_workers or min(32, (os.cpu_count() or 1) + 4)
+        self._executor = ThreadPoolExecutor(max_workers)
+        self._pending = threading.BoundedSemaphore(
+            max_workers * self.PENDING_WRITES_PER_WORKER
+        )
+        self._futures = []
+        self._dirs_lock = threading.Lock()
+        self._dirs: Set[str] = set()
+        self.staging_path = _make_staging_dir(col.dir_path)
+        self._makedirs(os.path.join(self.staging_path, "notes"))
+        self._makedirs(os.path.join(self.staging_path, "attachments"))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.abort()
+
+    def _makedirs(self, path: str):
+        """Create a directory at most once, however many files go into it"""
+        with self._dirs_lock:
+            if path in self._dirs:
+                return
+            os.makedirs(path, exist_ok=True)
+            self._dirs.add(path)
+
+    def _write(self, path: str, data: bytes):
+        self._makedirs(os.path.dirname(path))
+        with open(path, "wb") as fh:
+            fh.write(data)
+
+    def _submit(self, fn, path: str, *args):
+        self._pending.acquire()
+        future = self._executor.submit(fn, path, *args)
+        future.add_done_callback(lambda _: self._pending.release())
+        self._futures.append((os.path.relpath(path, self.staging_path), future))
+
+    def add_entity(self, entity: BoostnoteEntity):
+        payload = cson.dumps(BoostnoteCollection._serialize_entity(entity))
+        self._submit(
+            self._write,
+            os.path.join(self.staging_path, "notes", f"{entity.id}.cson"),
+            payload.encode("utf-8"),
+        )
+
+    def add_attachment(self, relpath: str, data: bytes):
+        """
+        :param relpath: Path relative to the attachments directory
+        :param data: Contents of the attachment
+        """
+        self._submit(
+            self._write, os.path.join(self.staging_path, "attachments", relpath), data
+        )
+
+    def _copy(
+        self,
+        path: str,
+        src_path: str,
+        offset: int,
+        size: Optional[int],
+        link: Optional[str],
+    ):
+        self._makedirs(os.path.dirname(path))
+        src_size = os.path.getsize(src_path)
+        if size is None:
+            size = src_size - offset
+        if offset == 0 and size == src_size:
+            link_or_copy(src_path, path, link)
+            return
+        src_fd = os.open(src_path, os.O_RDONLY)
+        try:
+            with open(path, "wb") as fh:
+                copy_range(src_fd, offset, size, fh.fileno(), 0)
+        finally:
+            os.close(src_fd)
+
+    def add_attachment_from(
+        self,
+        relpath: str,
+        src_path: str,
+        offset: int = 0,
+        size: Optional[int] = None,
+        link: Optional[str] = None,
+    ):
+        """
+        Copy an attachment out of another file without reading it into memory.
+
+        :param relpath: Path relative to the attachments directory
+        :param src_path: File containing the attachment's bytes
+        :param offset: Where the attachment starts within src_path
+        :param size: Length of the attachment (default: the rest of src_path)
+        :param link: LINK_HARDLINK or LINK_REFLINK to share src_path's data
+            instead of copying it, when the attachment is the whole file
+        """
+        self._submit(
+            self._copy,
+            os.path.join(self.staging_path, "attachments", relpath),
+            src_path,
+            offset,
+            size,
+            link,
+        )
+
+    def _wait(self):
+        futures, self._futures = self._futures, []
+        self._executor.shutdown(wait=True)
+        errors = [
+            (path, future.exception())
+            for path, future in futures
+            if future.exception() is not None
+        ]
+        if errors:
+            raise BulkWriteError(errors) from errors[0][1]
+
+    def commit(self):
+        """Wait for all writes to finish and publish the collection"""
+        try:
+            self._wait()
+            self.col.meta.write_to_file(
+                os.path.join(self.staging_path, "boostnote.json")
+            )
+            replace_dir(self.staging_path, self.col.dir_path)
+        except BaseException:
+            self.abort()
+            raise
+
+    def abort(self):
+        """Discard everything written so far"""
+        self._executor.shutdown(wait=True)
+        shutil.rmtree(self.staging_path, ignore_errors=True)
@@ -1,32 +1,308 @@
-import argparse
-import logging
+"""
+Command line interface.
 
-from . import convert_boostnote_to_jex as boost2jex
-from . import convert_jex_to_boostnote as jex2boost
-from .boostnote import BoostnoteCollection
-from .joplin import JoplinTarStore, store_get_stats
+The CLI is started many times over by batch jobs, so this module only imports
+argparse and the import-free options module at startup. Each subcommand
+imports what it needs when it runs; in particular cson is only loaded by the
+commands that read or write Boost Note collections. tests/test_cli.py holds
+the import-time budget.
+"""
+import argparse
 
-logger = logging.getLogger(__name__)
+from . import options
 
 
 def argparse_install_boostnote_stats(parser: argparse.ArgumentParser):
     parser.add_argument(
         "path", help="Path to the parent directory containing boostnote.json"
     )
+    parser.add_argument(
+        "--fast",
+        action="store_true",
+        help="Scan each note for the keys counted instead of parsing all of it",
+    )
 
 
 def argparse_install_jexstats(parser: argparse.ArgumentParser):
-    parser.add_argument("path", help="Path to the Joplin JEX file")
+    parser.add_argument(
+        "path",
+        help="Path to the Joplin JEX file, a directory it was extracted to, or a Joplin profile directory containing database.sqlite",
+    )
+    parser.add_argument(
+        "--fast",
+        action="store_true",
+        help="Count from metadata alone: item types from their headers and resource data from file sizes, without reading item bodies",
+    )
+
+
+def argparse_install_filters(parser: argparse.ArgumentParser):
+    group = parser.add_argument_group(
+        "filters",
+        "Convert only the notes matching every filter given, along with the folders, tags and attachments they use. Repeat a filter to match any of several values.",
+    )
+    group.add_argument(
+        "--folder",
+        action="append",
+        default=[],
+        metavar="FOLDER",
+        help="Folder ID or name",
+    )
+    group.add_argument(
+        "--tag", action="append", default=[], metavar="TAG", help="Tag name"
+    )
+    group.add_argument(
+        "--since",
+        metavar="DATE",
+        help="Only notes updated at or after this ISO 8601 date or time (UTC unless given)",
+    )
+    group.add_argument(
+        "--ids",
+        action="append",
+        default=[],
+        metavar="ID[,ID...]",
+        help="Note IDs, in Boost Note or Joplin form",
+    )
+
+
+def argparse_install_spill_threshold(parser: argparse.ArgumentParser):
+    parser.add_argument(
+        "--spill-threshold",
+        type=int,
+        default=options.ID_MAP_SPILL_THRESHOLD,
+        metavar="N",
+        help="Move ID maps to a temporary file on disk once they have more than N entries (default: %(default)s)",
+    )
+
+
+def note_filter_from_args(args: argparse.Namespace):
+    from .filters import NoteFilter, parse_since
+
+    return NoteFilter(
+        folders=set(args.folder),
+        tags=set(args.tag),
+        since=parse_since(args.since) if args.since else None,
+        ids={i for ids in args.ids for i in ids.split(",") if i},
+    )
 
 
 def argparse_install_boost2jex(parser: argparse.ArgumentParser):
     parser.add_argument(
         "path", help="Path to the parent directory containing boostnote.json"
     )
+    parser.add_argument(
+        "-o", "--output", help="Path to write the JEX file to (default: a temp file)"
+    )
+    sharding = parser.add_mutually_exclusive_group()
+    sharding.add_argument(
+        "--shards",
+        type=int,
+        help="Split the output by folder into this many JEX files",
+    )
+    sharding.add_argument(
+        "--shard-size",
+        type=int,
+        metavar="BYTES",
+        help="Split the output into JEX files of roughly at most this many bytes",
+    )
+    sharding.add_argument(
+        "--sync-target",
+        action="store_true",
+        help="Treat --output as a Joplin filesystem sync target directory, and write only the items that changed into it. Implies --reproducible.",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        help="Number of shards, or with --sync-target files, to write concurrently (default: one shard or a few files per CPU)",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Journal progress so that an interrupted conversion into --output can be continued from its last checkpoint by rerunning it with --resume",
+    )
+    parser.add_argument(
+        "--checkpoint-every",
+        type=int,
+        default=options.CHECKPOINT_EVERY,
+        metavar="N",
+        help="With --resume, flush the output and journal progress every N items (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--reproducible",
+        action="store_true",
+        help="Derive IDs from names instead of generating random ones, so the same input always gives a byte-identical JEX file. Use this if the output will be compared with diff.",
+    )
+    argparse_install_spill_threshold(parser)
+    argparse_install_filters(parser)
 
 
 def argparse_install_jex2boost(parser: argparse.ArgumentParser):
-    parser.add_argument("path", help="Path to the Joplin JEX file")
+    parser.add_argument(
+        "path",
+        help="Path to the Joplin JEX file, a directory it was extracted to, or a Joplin profile directory containing database.sqlite",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        help="Directory to write the Boost Note collection to (default: a temp directory)",
+    )
+    parser.add_argument(
+        "--link",
+        choices=[options.LINK_HARDLINK, options.LINK_REFLINK],
+        help="When reading an extracted JEX directory, share attachment data with it instead of copying",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        help="Number of notes and attachments to write concurrently (default: a few per CPU)",
+    )
+    argparse_install_spill_threshold(parser)
+    argparse_install_filters(parser)
+
+
+def argparse_install_merge(parser: argparse.ArgumentParser):
+    parser.add_argument(
+        "paths",
+        nargs="+",
+        metavar="path",
+        help="Boost Note directories, Joplin JEX files, directories JEX files were extracted to, or Joplin profile directories",
+    )
+    parser.add_argument("-o", "--output", required=True, help="Path to write to")
+    parser.add_argument(
+        "--to",
+        choices=[options.FORMAT_BOOSTNOTE, options.FORMAT_JEX],
+        help=f"Format to write (default: {options.FORMAT_JEX} if the output ends in .jex, otherwise {options.FORMAT_BOOSTNOTE})",
+    )
+    parser.add_argument(
+        "--reproducible",
+        action="store_true",
+        help="Derive new IDs from names instead of generating random ones",
+    )
+    parser.add_argument(
+        "--link",
+        choices=[options.LINK_HARDLINK, options.LINK_REFLINK],
+        help="When writing a Boost Note directory, share attachment data with the inputs instead of copying",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        help="Number of notes and attachments to write concurrently to a Boost Note directory",
+    )
+    argparse_install_spill_threshold(parser)
+
+
+def argparse_install_analyze(parser: argparse.ArgumentParser):
+    parser.add_argument(
+        "path",
+        help="Path to a Boost Note directory, a Joplin JEX file, a directory a JEX file was extracted to, or a Joplin profile directory",
+    )
+    parser.add_argument(
+        "--json", dest="json_path", help="Write the report to this file as JSON"
+    )
+    parser.add_argument(
+        "--csv",
+        dest="csv_path",
+        help="Write the size, link count, tag count, folder and dates of every note to this file as CSV",
+    )
+    argparse_install_spill_threshold(parser)
+
+
+def argparse_install_links(parser: argparse.ArgumentParser):
+    parser.add_argument(
+        "path",
+        help="Path to a Boost Note directory, a Joplin JEX file, a directory a JEX file was extracted to, or a Joplin profile directory",
+    )
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument(
+        "id",
+        nargs="?",
+        help="ID of a note, or of an attachment (its path within the attachments directory, for Boost Note)",
+    )
+    target.add_argument(
+        "--orphans", action="store_true", help="List the items nothing links to"
+    )
+    parser.add_argument(
+        "--refresh",
+        action="store_true",
+        help="Bring the index up to date with the vault first, re-reading only what changed",
+    )
+    parser.add_argument(
+        "--index", help="Path of the index (default: PATH.links.sqlite)"
+    )
+
+
+def argparse_install_diff(parser: argparse.ArgumentParser):
+    parser.add_argument(
+        "boost_path", help="Path to the parent directory containing boostnote.json"
+    )
+    parser.add_argument("jex_path", help="Path to the Joplin JEX file")
+
+
+def argparse_install_validate(parser: argparse.ArgumentParser):
+    parser.add_argument(
+        "path",
+        help="Path to a Boost Note directory containing boostnote.json, a Joplin JEX file, an extracted JEX directory or a Joplin profile directory",
+    )
+
+
+def argparse_install_verify(parser: argparse.ArgumentParser):
+    parser.add_argument(
+        "path",
+        help="Path to a Boost Note directory containing boostnote.json or a Joplin JEX file",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        help="Number of processes comparing items, or 1 to compare them in this process (default: one per CPU)",
+    )
+
+
+def argparse_install_watch(parser: argparse.ArgumentParser):
+    parser.add_argument(
+        "path", help="Path to the parent directory containing boostnote.json"
+    )
+    parser.add_argument("output", help="Path to the Joplin JEX file to keep updated")
+    parser.add_argument(
+        "--debounce",
+        type=float,
+        default=options.DEBOUNCE,
+        metavar="SECONDS",
+        help="Wait for changes to settle for this long before converting (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--poll",
+        action="store_true",
+        help="Poll for changes instead of using inotify",
+    )
+    parser.add_argument(
+        "--interval",
+        type=float,
+        default=options.POLL_INTERVAL,
+        metavar="SECONDS",
+        help="Seconds between scans when polling (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--reproducible",
+        action="store_true",
+        help="Derive IDs from names instead of generating random ones, as in boost2jex",
+    )
+
+
+def argparse_install_serve(parser: argparse.ArgumentParser):
+    parser.add_argument(
+        "--host", default=options.DEFAULT_HOST, help="Address to listen on"
+    )
+    parser.add_argument(
+        "--port", type=int, default=options.DEFAULT_PORT, help="Port to listen on"
+    )
+    parser.add_argument(
+        "--socket", help="Listen on this Unix socket instead of a TCP port"
+    )
+    parser.add_argument(
+        "--output-root",
+        default=".",
+        metavar="DIR",
+        help="Only write conversions inside this directory (default: the current directory)",
+    )
 
 
 def main():
@@ -53,18 +329,199 @@ def main():
     )
     argparse_install_jex2boost(jex2boost_parser)
 
+    merge_parser = subparsers.add_parser(
+        "merge",
+        help="Merge several vaults into one, giving colliding IDs new ones and merging folders and tags with the same names. Given a single vault, normalize it.",
+    )
+    argparse_install_merge(merge_parser)
+
+    analyze_parser = subparsers.add_parser(
+        "analyze",
+        help="Report the distributions of note and attachment sizes, notes per folder and tag, creation and update dates, and links",
+    )
+    argparse_install_analyze(analyze_parser)
+
+    links_parser = subparsers.add_parser(
+        "links",
+        help="Show what a note or attachment links to and what links to it, from an index built on first use",
+    )
+    argparse_install_links(links_parser)
+
+    diff_parser = subparsers.add_parser(
+        "diff",
+        help="List notes, folders and attachments that differ between a Boost Note directory and a Joplin JEX file",
+    )
+    argparse_install_diff(diff_parser)
+
+    validate_parser = subparsers.add_parser(
+        "validate",
+        help="Report dangling links, orphan resources and duplicate IDs as JSON. Exits with status 1 if any are found.",
+    )
+    argparse_install_validate(validate_parser)
+
+    verify_parser = subparsers.add_parser(
+        "verify",
+        help="Convert a vault to the other format and back in a temporary directory, and list any differences. Exits with status 1 if there are any.",
+    )
+    argparse_install_verify(verify_parser)
+
+    watch_parser = subparsers.add_parser(
+        "watch",
+        help="Convert a Boost Note directory to a Joplin JEX file, then keep converting changed notes and attachments until interrupted",
+    )
+    argparse_install_watch(watch_parser)
+
+    serve_parser = subparsers.add_parser(
+        "serve",
+        help="Serve stats, conversions and note lookups over HTTP, caching opened vaults between requests",
+    )
+    argparse_install_serve(serve_parser)
+
     args = parser.parse_args()
 
     if args.cmd == "booststats":
+        from .boostnote import BoostnoteCollection
+
         col = BoostnoteCollection.from_dir(args.path)
-        print(col.stats())
+        print(col.stats(fast=args.fast))
     elif args.cmd == "jexstats":
-        col = JoplinTarStore(args.path)
-        print(store_get_stats(col))
+        from .joplin import open_store, store_get_fast_stats, store_get_stats
+
+        store = open_store(args.path)
+        if args.fast:
+            stats = store_get_fast_stats(store)
+            print(stats.counts)
+            print(
+                f"{stats.resource_files} resource files, "
+                f"{stats.resource_bytes} bytes"
+            )
+        else:
+            print(store_get_stats(store))
     elif args.cmd == "boost2jex":
-        boost2jex.main(args.path)
+        note_filter = note_filter_from_args(args)
+        if args.shards or args.shard_size:
+            if not note_filter.is_empty():
+                parser.error("filters can't be combined with --shards or --shard-size")
+            # Shards are each converted in one go with the default ID maps
+            unsupported = [
+                option
+                for option, is_set in (
+                    ("--resume", args.resume),
+                    (
+                        "--checkpoint-every",
+                        args.checkpoint_every != options.CHECKPOINT_EVERY,
+                    ),
+                    (
+                        "--spill-threshold",
+                        args.spill_threshold != options.ID_MAP_SPILL_THRESHOLD,
+                    ),
+                    ("--sync-target", args.sync_target),
+                )
+                if is_set
+            ]
+            if unsupported:
+                parser.error(
+                    f"{', '.join(unsupported)} can't be combined with --shards or --shard-size"
+                )
+            from . import shard
+
+            shard.main(
+                args.path,
+                args.output,
+                shards=args.shards,
+                max_bytes=args.shard_size,
+                jobs=args.jobs,
+                reproducible=args.reproducible,
+            )
+        else:
+            if args.sync_target and not args.output:
+                parser.error("--sync-target requires --output")
+            from . import convert_boostnote_to_jex as boost2jex
+
+            boost2jex.main(
+                args.path,
+                args.output,
+                resume=args.resume,
+                checkpoint_every=args.checkpoint_every,
+                note_filter=note_filter,
+                spill_threshold=args.spill_threshold,
+                reproducible=args.reproducible,
+                sync_target=args.sync_target,
+                jobs=args.jobs,
+            )
     elif args.cmd == "jex2boost":
-        jex2boost.main(args.path)
+        from . import convert_jex_to_boostnote as jex2boost
+
+        jex2boost.main(
+            args.path,
+            args.output,
+            link=args.link,
+            note_filter=note_filter_from_args(args),
+            spill_threshold=args.spill_threshold,
+            jobs=args.jobs,
+        )
+    elif args.cmd == "merge":
+        from . import merge
+
+        merge.main(
+            args.paths,
+            args.output,
+            to=args.to,
+            reproducible=args.reproducible,
+            link=args.link,
+            jobs=args.jobs,
+            spill_threshold=args.spill_threshold,
+        )
+    elif args.cmd == "analyze":
+        from . import analyze
+
+        analyze.main(args.path, args.json_path, args.csv_path, args.spill_threshold)
+    elif args.cmd == "links":
+        from . import linkgraph
+
+        result = linkgraph.main(
+            args.path,
+            args.id,
+            orphans=args.orphans,
+            refresh=args.refresh,
+            index_path=args.index,
+        )
+        if result is None:
+            raise SystemExit(1)
+    elif args.cmd == "diff":
+        from . import diff
+
+        if not diff.main(args.boost_path, args.jex_path).is_empty():
+            raise SystemExit(1)
+    elif args.cmd == "validate":
+        from . import validate
+
+        if not validate.main(args.path).is_valid():
+            raise SystemExit(1)
+    elif args.cmd == "verify":
+        from . import verify
+
+        try:
+            report = verify.main(args.path, args.jobs)
+        except ValueError as exc:
+            parser.error(str(exc))
+        if not report.is_empty():
+            raise SystemExit(1)
+    elif args.cmd == "watch":
+        from . import watch
+
+        watch.main(
+            args.path,
+            args.output,
+            debounce=args.debounce,
+            poll=args.poll,
+            interval=args.interval,
+            reproducible=args.reproducible,
+        )
+    elif args.cmd == "serve":
+        from . import server
+
+        server.main(args.host, args.port, args.socket, args.output_root)
     else:
         parser.print_help()
 
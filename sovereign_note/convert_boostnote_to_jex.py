@@ -1,17 +1,48 @@
+import datetime
+import os
 import re
 import sys
 import tempfile
 import uuid
-from typing import Optional
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import List, Optional
 
 from . import boostnote, joplin
+from .filters import NoteFilter
+from .idmap import IdMap
+from .journal import ConversionJournal, NullJournal
+from .options import CHECKPOINT_EVERY, ID_MAP_SPILL_THRESHOLD
+from .util import hash_stream
+
+# Markdown links to other notes, e.g. `[text](:note:<boostnote id>)`
+BOOSTNOTE_NOTE_LINK_PROG = re.compile(r"\[([^\]]*)\]\(:note:([^\)]*)\)")
+# Markdown links to attachments, e.g. `[text](:storage/<relative path>)`
+BOOSTNOTE_STORAGE_LINK_PROG = re.compile(r"\[([^\]]*)\]\(:storage\/([^\)]*)\)")
+
+
+# Top-level keys of a note that filters are checked against
+FILTER_KEYS = ("folder", "tags", "updatedAt")
+
+# Namespace of the IDs that reproducible conversions derive from names
+REPRODUCIBLE_ID_NAMESPACE = uuid.UUID("39d08ee3-769c-42c4-9b7a-d17b8a2052dc")
 
 
 def joplin_uuid() -> str:
     return str(uuid.uuid4()).replace("-", "")
 
 
-def boostnote_to_joplin_id(boostnote_id: str):
+def new_uuid(reproducible: bool, *names: str) -> uuid.UUID:
+    """
+    Get a random UUID, or, if reproducible is set, one derived from names so
+    that converting the same input always gives the same IDs
+    """
+    if reproducible:
+        return uuid.uuid5(REPRODUCIBLE_ID_NAMESPACE, "/".join(names))
+    return uuid.uuid4()
+
+
+def boostnote_to_joplin_id(boostnote_id: str, reproducible: bool = False):
     # If the boostnote ID is already in the correct form, return it.
     if len(boostnote_id) == 32 and re.match(r"^[0-9a-fA-F]*$", boostnote_id):
         return boostnote_id
@@ -29,7 +60,7 @@ def boostnote_to_joplin_id(boostnote_id: str):
         return boostnote_id.replace("-", "")
     # Otherwise, the conversion is poorly defined. Generate a new ID.
     print(f"No direct conversion from boostnote ID {boostnote_id} to Joplin")
-    return joplin_uuid()
+    return new_uuid(reproducible, "note", boostnote_id).hex
 
 
 def replace_boostnote_links_with_joplin_links(
@@ -59,97 +90,402 @@ def replace_boostnote_links_with_joplin_links(
         return repl
 
     # first, replace links to other notes
-    prog = re.compile(r"\[([^\]]*)\]\(:note:([^\)]*)\)")
-    content = prog.sub(get_replacement, content)
+    content = BOOSTNOTE_NOTE_LINK_PROG.sub(get_replacement, content)
 
     # second, replace storage "links"
-    storage_prog = re.compile(r"\[([^\]]*)\]\(:storage\/([^\)]*)\)")
-    content = storage_prog.sub(get_storage_replacement, content)
+    content = BOOSTNOTE_STORAGE_LINK_PROG.sub(get_storage_replacement, content)
 
     return content
 
 
-def main(boost_dir_path: str, output_location: Optional[str] = None):
-    col = boostnote.BoostnoteCollection.from_dir(boost_dir_path)
-    if not output_location:
-        output_location = tempfile.mktemp(suffix=".jex")
-    store = joplin.JoplinTarStore(output_location)
-    for folder_id in col.meta.list_folder_ids():
-        folder_name = col.meta.get_folder_name(folder_id)
-        print(f"Writing folder {folder_name} to Joplin store")
-        joplin_entity = joplin.joplin_create_folder(folder_id, folder_name)
-        payload = joplin.unparse_joplin_note(joplin_entity)
-        store.write(f"{folder_id}.md", payload)
+def write_folder(store, folder_id: str, folder_name: str):
+    print(f"Writing folder {folder_name} to Joplin store")
+    joplin_entity = joplin.joplin_create_folder(folder_id, folder_name)
+    payload = joplin.unparse_joplin_note(joplin_entity)
+    store.write(f"{folder_id}.md", payload)
 
-    # create tags
-    tag_name_to_id = {}
-    for tag_name in col.list_tags():
-        print(f"Writing tag to Joplin store: {tag_name}")
-        tag_id = str(uuid.uuid4())
-        tag_name_to_id[tag_name] = tag_id
-        joplin_tag = joplin.joplin_create_tag(tag_id, tag_name)
-        payload = joplin.unparse_joplin_note(joplin_tag)
-        store.write(f"{tag_id}.md", payload)
 
-    # create resources
-    map_boostnote_attachment_to_joplin_id = {}
-    for attachment in col.get_attachments():
-        attachment_id = joplin_uuid()
-        map_boostnote_attachment_to_joplin_id[attachment] = attachment_id
-        print(f"Writing attachment meta to Joplin store: {attachment}")
-        joplin_resource = joplin.joplin_create_resource(
-            attachment_id, attachment.filename
+def write_tag(store, tag_id: str, tag_name: str):
+    print(f"Writing tag to Joplin store: {tag_name}")
+    joplin_tag = joplin.joplin_create_tag(tag_id, tag_name)
+    payload = joplin.unparse_joplin_note(joplin_tag)
+    store.write(f"{tag_id}.md", payload)
+
+
+def write_attachment(
+    store,
+    col: boostnote.BoostnoteCollection,
+    attachment: boostnote.BoostnoteAttachment,
+    attachment_id: str,
+):
+    print(f"Writing attachment meta to Joplin store: {attachment}")
+    src_path = col.attachment_path(attachment)
+    joplin_resource = joplin.joplin_create_resource(
+        attachment_id, attachment.filename, os.path.getsize(src_path)
+    )
+    payload = joplin.unparse_joplin_note(joplin_resource)
+    store.write(f"{attachment_id}.md", payload)
+
+    print(f"Writing attachment blob to Joplin store: {attachment}")
+    ext = attachment.filename.rsplit(".", 1)[-1]
+    store.write_file(f"resources/{attachment_id}.{ext}", src_path)
+
+
+def write_note(
+    store,
+    boostnote_entity: boostnote.BoostnoteNote,
+    map_boostnote_to_joplin: dict,
+    map_boostnote_attachment_to_joplin_id: dict,
+    tag_name_to_id: dict,
+    notetag_ids: Optional[dict] = None,
+    reproducible: bool = False,
+) -> dict:
+    """
+    Write a single note, and the NoteTags attaching it to its tags, to store.
+
+    The entity keeps its Boost Note ID; the Joplin ID is looked up in
+    map_boostnote_to_joplin. NoteTag IDs found in notetag_ids (by tag name) are
+    reused, and the NoteTag IDs that were written are returned by tag name.
+    New NoteTag IDs are derived from the note and tag if reproducible is set.
+    """
+    notetag_ids = notetag_ids or {}
+    joplin_id = map_boostnote_to_joplin[boostnote_entity.id]
+    print(f"Creating Joplin note for Boostnote note with ID {joplin_id}")
+    joplin_entity = joplin.joplin_create_note(
+        joplin_id,
+        boostnote_entity.title,
+        replace_boostnote_links_with_joplin_links(
+            boostnote_entity.content,
+            map_boostnote_to_joplin,
+            map_boostnote_attachment_to_joplin_id,
+        ),
+        boostnote_entity.folder_id,
+        boostnote_entity.created_at,
+        boostnote_entity.updated_at,
+    )
+    payload = joplin.unparse_joplin_note(joplin_entity)
+    store.write(f"{joplin_id}.md", payload)
+    # Create entities tagging notes
+    written = {}
+    for tag_name in boostnote_entity.tags:
+        notetag_id = notetag_ids.get(tag_name) or str(
+            new_uuid(reproducible, "notetag", joplin_id, tag_name)
         )
-        payload = joplin.unparse_joplin_note(joplin_resource)
-        store.write(f"{attachment_id}.md", payload)
+        tag_id = tag_name_to_id[tag_name]
+        joplin_notetag_entity = joplin.joplin_create_notetag(
+            notetag_id, joplin_id, tag_id
+        )
+        store.write(
+            f"{notetag_id}.md", joplin.unparse_joplin_note(joplin_notetag_entity)
+        )
+        print(f"Wrote NoteTag with ID {notetag_id}")
+        written[tag_name] = notetag_id
+    return written
+
+
+def attachment_blob_key(col: boostnote.BoostnoteCollection, attachment, size: int):
+    """Identify an attachment's contents, for finding copies of the same file"""
+    with col.open_attachment(attachment) as fh:
+        return f"{size}:{hash_stream(fh)}"
 
-        print(f"Writing attachment blob to Joplin store: {attachment}")
-        ext = attachment.filename.rsplit(".", 1)[-1]
-        store.write_bin(
-            f"resources/{attachment_id}.{ext}", col.read_attachment(attachment)
+
+@dataclass
+class BoostnoteSelection:
+    """The notes chosen by a NoteFilter, and everything they use"""
+
+    note_paths: List[str] = field(default_factory=list)
+    folder_ids: List[str] = field(default_factory=list)
+    tags: List[str] = field(default_factory=list)
+    attachments: List[boostnote.BoostnoteAttachment] = field(default_factory=list)
+
+
+def _read_filter_keys(col: boostnote.BoostnoteCollection, note_path: str):
+    """
+    Get a note's folder, tags, update time and raw text, without parsing its
+    content unless its top-level keys can't be scanned
+    """
+    with open(note_path) as fh:
+        text = fh.read()
+    keys = boostnote.scan_entity_keys(text, FILTER_KEYS)
+    if all(k in keys for k in FILTER_KEYS):
+        updated_at = datetime.datetime.strptime(
+            keys["updatedAt"], boostnote.BOOSTNOTE_DATE_FORMAT
         )
+        return keys["folder"], keys["tags"], updated_at, text
+    entity = col.read_entity(note_path)
+    return entity.folder_id, entity.tags, entity.updated_at, text
 
-    # create Joplin-accepted IDs for all boostnote notes
-    boostnote_entities = list(col.get_entities())
-    map_boostnote_to_joplin = {}
-    for e in boostnote_entities:
-        new_id = boostnote_to_joplin_id(e.id)
-        map_boostnote_to_joplin[e.id] = new_id
-        e.id = new_id
 
-    # create notes
-    for boostnote_entity in boostnote_entities:
-        if not isinstance(boostnote_entity, boostnote.BoostnoteNote):
+def select_notes(
+    col: boostnote.BoostnoteCollection, note_filter: NoteFilter
+) -> BoostnoteSelection:
+    """
+    Find the notes matching note_filter, along with the folders, tags and
+    attachments they use.
+
+    Notes are filtered by ID before they are opened, and by everything else on
+    a scan of their top-level keys, so no unselected note is parsed.
+    """
+    selection = BoostnoteSelection()
+    folder_names = {
+        folder_id: col.meta.get_folder_name(folder_id)
+        for folder_id in col.meta.list_folder_ids()
+    }
+    selected_folders = {
+        folder_id
+        for folder_id, name in folder_names.items()
+        if note_filter.folders and note_filter.match_folder(folder_id, name)
+    }
+    attachments = {os.path.normpath(a.relative_path): a for a in col.get_attachments()}
+    selected_attachments = set()
+    tags = set()
+
+    for note_path in col.get_entity_paths():
+        note_id = os.path.basename(note_path).rsplit(".", 1)[0]
+        if not note_filter.match_id(note_id):
             continue
+        try:
+            folder_id, note_tags, updated_at, text = _read_filter_keys(col, note_path)
+        except Exception:
+            print(f"Bad note: {note_path}")
+            continue
+        matches = (
+            note_filter.match_folder(folder_id, folder_names.get(folder_id)),
+            note_filter.match_tags(note_tags),
+            note_filter.match_updated(updated_at),
+        )
+        if not all(matches):
+            continue
+        selection.note_paths.append(note_path)
+        selected_folders.add(folder_id)
+        tags.update(note_tags)
+        # A note uses the attachments stored in its own directory, as well as
+        # any it links to from elsewhere
+        linked = {
+            os.path.normpath(m.group(2))
+            for m in BOOSTNOTE_STORAGE_LINK_PROG.finditer(text)
+        }
+        selected_attachments.update(
+            relpath
+            for relpath in attachments
+            if relpath in linked or relpath.split(os.sep, 1)[0] == note_id
+        )
+
+    selection.folder_ids = [f for f in folder_names if f in selected_folders]
+    selection.tags = sorted(tags)
+    selection.attachments = [
+        attachments[relpath] for relpath in sorted(selected_attachments)
+    ]
+    return selection
+
+
+def main(
+    boost_dir_path: str,
+    output_location: Optional[str] = None,
+    resume: bool = False,
+    checkpoint_every: int = CHECKPOINT_EVERY,
+    note_filter: Optional[NoteFilter] = None,
+    spill_threshold: Optional[int] = ID_MAP_SPILL_THRESHOLD,
+    reproducible: bool = False,
+    sync_target: bool = False,
+    jobs: Optional[int] = None,
+):
+    """
+    Convert a Boost Note directory to a JEX file.
+
+    Items are always written in a fixed order with fixed tar metadata. With
+    reproducible set, the IDs of tags, NoteTags and resources (and of notes
+    whose Boost Note IDs can't be converted) are derived from their names
+    rather than random, so converting the same input gives a byte-identical
+    archive, and a small change to the input a small change to the archive.
+
+    Attachments with identical contents, such as a screenshot pasted into
+    several notes, become a single resource that every copy links to. Only
+    attachments whose size is shared with another are hashed to find them.
+
+    The conversion makes two passes. The first records folders, tags,
+    attachments and note IDs, without parsing note content; the second streams
+    notes one at a time through link rewriting into the output. Memory use
+    therefore doesn't depend on the size of the notes, and the ID maps built
+    by the first pass move to disk once they have more than spill_threshold
+    entries.
+
+    If note_filter is given, only the notes it selects are converted, along
+    with the folders, tags and attachments those notes use.
+
+    With resume set, progress is journaled to `<output_location>.journal` and
+    the output is flushed every checkpoint_every items. If the conversion dies,
+    rerunning it with resume=True truncates the output back to the last
+    checkpoint and carries on from there. The journal is removed once the
+    output is complete. Without resume, nothing is journaled.
+
+    With sync_target set, output_location is instead a Joplin filesystem sync
+    target directory, into which only the items that changed are written, by
+    jobs threads (see joplin.JoplinSyncTargetWriter). IDs are then always
+    derived from names, as with reproducible, so that the same item keeps the
+    same ID from one run to the next.
+    """
+    col = boostnote.BoostnoteCollection.from_dir(boost_dir_path)
+    selection = None
+    if note_filter is not None and not note_filter.is_empty():
+        selection = select_notes(col, note_filter)
+        print(f"Selected {len(selection.note_paths)} notes")
+    if not output_location:
+        if resume:
+            raise ValueError("An output location is required to resume")
+        if sync_target:
+            raise ValueError("An output location is required for a sync target")
+        fd, output_location = tempfile.mkstemp(suffix=".jex")
+        os.close(fd)
+    if sync_target:
+        reproducible = True
+    journal_path = f"{output_location}.journal"
+    if resume and os.path.exists(journal_path):
+        journal = ConversionJournal.load(journal_path)
+        print(f"Resuming from checkpoint at offset {journal.state.offset}")
+    elif resume:
+        print(f"No journal found at {journal_path}; starting from scratch")
+        journal = ConversionJournal.create(journal_path)
+    else:
+        journal = NullJournal()
+    if sync_target:
+        store = joplin.JoplinSyncTargetWriter(output_location, max_workers=jobs)
+    else:
+        store = joplin.JoplinTarWriter(output_location, offset=journal.state.offset)
+
+    def checkpoint(*finished_phases):
+        journal.checkpoint(store.checkpoint(), finished_phases)
 
-        print(f"Creating Joplin note for Boostnote note with ID {boostnote_entity.id}")
-        joplin_entity = joplin.joplin_create_note(
-            boostnote_entity.id,
-            boostnote_entity.title,
-            replace_boostnote_links_with_joplin_links(
-                boostnote_entity.content,
+    def maybe_checkpoint():
+        if journal.pending >= checkpoint_every:
+            checkpoint()
+
+    if "folders" not in journal.state.phases:
+        done = journal.state.done("folders")
+        if selection is None:
+            folder_ids = col.meta.list_folder_ids()
+        else:
+            folder_ids = selection.folder_ids
+        for folder_id in folder_ids:
+            if folder_id in done:
+                continue
+            write_folder(store, folder_id, col.meta.get_folder_name(folder_id))
+            journal.record("folders", folder_id)
+            maybe_checkpoint()
+        checkpoint("folders")
+
+    # create tags
+    tag_name_to_id = IdMap(spill_threshold)
+    tag_name_to_id.update(journal.state.mapping("tags"))
+    if "tags" not in journal.state.phases:
+        tag_names = sorted(col.list_tags()) if selection is None else selection.tags
+        for tag_name in tag_names:
+            if tag_name in tag_name_to_id:
+                continue
+            tag_id = str(new_uuid(reproducible, "tag", tag_name))
+            tag_name_to_id[tag_name] = tag_id
+            write_tag(store, tag_id, tag_name)
+            journal.record("tags", tag_name, tag_id)
+            maybe_checkpoint()
+        checkpoint("tags")
+
+    # create resources
+    map_boostnote_attachment_to_joplin_id = IdMap(
+        spill_threshold,
+        encode_key=lambda attachment: attachment.relative_path,
+        decode_key=boostnote.BoostnoteAttachment,
+    )
+    for relpath, attachment_id in journal.state.mapping("attachments").items():
+        map_boostnote_attachment_to_joplin_id[
+            boostnote.BoostnoteAttachment(relpath)
+        ] = attachment_id
+    # resource IDs by attachment contents, for deduplication
+    blob_to_joplin_id = IdMap(spill_threshold)
+    blob_to_joplin_id.update(journal.state.mapping("attachment_blobs"))
+    if "attachments" not in journal.state.phases:
+        if selection is None:
+            attachments = list(col.get_attachments())
+        else:
+            attachments = selection.attachments
+        sizes = {a: os.path.getsize(col.attachment_path(a)) for a in attachments}
+        size_counts = Counter(sizes.values())
+        for attachment in attachments:
+            if attachment in map_boostnote_attachment_to_joplin_id:
+                continue
+            blob_key = None
+            if size_counts[sizes[attachment]] > 1:
+                blob_key = attachment_blob_key(col, attachment, sizes[attachment])
+            attachment_id = blob_to_joplin_id.get(blob_key)
+            if attachment_id is None:
+                attachment_id = new_uuid(
+                    reproducible,
+                    "attachment",
+                    os.path.normpath(attachment.relative_path),
+                ).hex
+                write_attachment(store, col, attachment, attachment_id)
+                if blob_key is not None:
+                    blob_to_joplin_id[blob_key] = attachment_id
+                    journal.record("attachment_blobs", blob_key, attachment_id)
+            else:
+                print(f"Attachment {attachment} is a copy of resource {attachment_id}")
+            map_boostnote_attachment_to_joplin_id[attachment] = attachment_id
+            journal.record("attachments", attachment.relative_path, attachment_id)
+            maybe_checkpoint()
+        checkpoint("attachments")
+
+    # create Joplin-accepted IDs for all boostnote notes. IDs that can't be
+    # converted directly are replaced by random ones, so the mapping is
+    # journaled to keep links stable across a resume.
+    map_boostnote_to_joplin = IdMap(spill_threshold)
+    map_boostnote_to_joplin.update(journal.state.mapping("note_ids"))
+    if "note_ids" not in journal.state.phases:
+        for note_path in col.get_entity_paths():
+            boostnote_id = os.path.basename(note_path).rsplit(".", 1)[0]
+            if boostnote_id in map_boostnote_to_joplin:
+                continue
+            map_boostnote_to_joplin[boostnote_id] = boostnote_to_joplin_id(
+                boostnote_id, reproducible
+            )
+            journal.record(
+                "note_ids", boostnote_id, map_boostnote_to_joplin[boostnote_id]
+            )
+            maybe_checkpoint()
+        checkpoint("note_ids")
+
+    # create notes
+    entities = col.get_entities(
+        exclude_ids=journal.state.done("notes"),
+        note_paths=None if selection is None else selection.note_paths,
+    )
+    for boostnote_entity in entities:
+        if isinstance(boostnote_entity, boostnote.BoostnoteNote):
+            write_note(
+                store,
+                boostnote_entity,
                 map_boostnote_to_joplin,
                 map_boostnote_attachment_to_joplin_id,
-            ),
-            boostnote_entity.folder_id,
-            boostnote_entity.created_at,
-            boostnote_entity.updated_at,
-        )
-        payload = joplin.unparse_joplin_note(joplin_entity)
-        store.write(f"{boostnote_entity.id}.md", payload)
-        # Create entities tagging notes
-        for tag_name in boostnote_entity.tags:
-            notetag_id = str(uuid.uuid4())
-            tag_id = tag_name_to_id[tag_name]
-            joplin_notetag_entity = joplin.joplin_create_notetag(
-                notetag_id, boostnote_entity.id, tag_id
-            )
-            store.write(
-                f"{notetag_id}.md", joplin.unparse_joplin_note(joplin_notetag_entity)
+                tag_name_to_id,
+                reproducible=reproducible,
             )
-            print(f"Wrote NoteTag with ID {notetag_id}")
+        journal.record("notes", boostnote_entity.id)
+        maybe_checkpoint()
 
-    print(f"Saved output to {output_location}")
+    store.close()
+    journal.remove()
+    for id_map in (
+        tag_name_to_id,
+        map_boostnote_attachment_to_joplin_id,
+        blob_to_joplin_id,
+        map_boostnote_to_joplin,
+    ):
+        id_map.close()
+    if sync_target:
+        print(
+            f"Synced {output_location}: {store.written} files written, "
+            f"{store.unchanged} unchanged, {store.kept} newer in the target kept"
+        )
+    else:
+        print(f"Saved output to {output_location}")
 
 
 if __name__ == "__main__":
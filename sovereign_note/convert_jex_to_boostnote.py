@@ -9,11 +9,17 @@ from collections import defaultdict
 from typing import Optional, Set
 
 from . import boostnote, joplin
+from .filters import NoteFilter
+from .idmap import IdMap
+from .options import ID_MAP_SPILL_THRESHOLD
 
 logger = logging.getLogger(__name__)
 
 UUID_CHARSET_WITHOUT_DASHES = "0123456789abcdefABCDEF"
 
+# Markdown links to other Joplin items, e.g. `[text](:/<joplin id>)`
+JOPLIN_LINK_PROG = re.compile(r"\[([^\]]*)\]\(:\/([^\)]*)\)")
+
 
 def convert_id_from_joplin_to_boostnote(joplin_id: str) -> str:
     """
@@ -28,140 +34,245 @@ def convert_id_from_joplin_to_boostnote(joplin_id: str) -> str:
     return joplin_id
 
 
+# Stands in for the owner of an attachment used by more than one note
+SHARED_ATTACHMENT = ""
+
+
+def _is_resource(store, joplin_id: str) -> bool:
+    headers = store.read_headers(f"{joplin_id}.md")
+    return (
+        joplin.JoplinModelType(int(headers["type_"])) == joplin.JoplinModelType.Resource
+    )
+
+
 def find_attachments(content: str, store) -> Set[str]:
     """Return a list of <Joplin IDs> referencing attachments"""
-    prog = re.compile(r"\[[^\]]*\]\(:\/([^\)]*)\)")
-    linked_joplin_ids = prog.findall(content)
-    # filter out non-attachments
-    result = set()
-    for joplin_id in linked_joplin_ids:
-        joplin_entity = store.get_note_by_id(joplin_id)
-        if isinstance(joplin_entity, joplin.JoplinResource):
-            result.add(joplin_id)
-    return result
+    linked_joplin_ids = [m.group(2) for m in JOPLIN_LINK_PROG.finditer(content)]
+    # filter out non-attachments, looking only at the headers of linked items
+    return {
+        joplin_id for joplin_id in linked_joplin_ids if _is_resource(store, joplin_id)
+    }
+
+
+def attachment_prefix(resource_id: str, attachment_owners) -> str:
+    """
+    Get the directory an attachment is stored in: that of the note using it if
+    there is exactly one such note, or one named after the resource otherwise.
+
+    :param attachment_owners: mapping from resource ID to the Joplin ID of the
+        note using it, or SHARED_ATTACHMENT if several notes do
+    """
+    owner = attachment_owners.get(resource_id, SHARED_ATTACHMENT)
+    if owner == SHARED_ATTACHMENT:
+        return resource_id
+    return convert_id_from_joplin_to_boostnote(owner)
 
 
 def replace_links(
     content: str,
     store,
-    map_attachment_to_notes,
+    attachment_owners,
 ) -> str:
     def get_replacement(m: re.Match) -> str:
         link_text = m.group(1)
         joplin_id = m.group(2)
 
         # handle resources
-        joplin_entity = store.get_note_by_id(joplin_id)
-        boostnote_entity_id = convert_id_from_joplin_to_boostnote(
-            joplin_entity.headers["id"]
-        )
-        if isinstance(joplin_entity, joplin.JoplinResource):
-            if len(map_attachment_to_notes[joplin_entity.id]) == 1:
-                prefix = convert_id_from_joplin_to_boostnote(
-                    next(iter(map_attachment_to_notes[joplin_entity.id]))
-                )
-            else:
-                prefix = joplin_entity.id
+        if _is_resource(store, joplin_id):
+            joplin_entity = store.get_note_by_id(joplin_id)
+            prefix = attachment_prefix(joplin_entity.id, attachment_owners)
             attachment_relpath = os.path.join(prefix, joplin_entity.basename)
             repl = f"[{link_text}](:storage/{attachment_relpath})"
             print(f"Replaced attachment: {repl}")
-        elif isinstance(joplin_entity, joplin.ParsedJoplinNote):
+        else:
+            boostnote_entity_id = convert_id_from_joplin_to_boostnote(joplin_id)
             repl = f"[{link_text}](:note:{boostnote_entity_id})"
             print(f"Replaced link: {repl}")
 
-        else:
-            raise Exception("Failed to process link")
-
         return repl
 
-    prog = re.compile(r"\[([^\]]*)\]\(:\/([^\)]*)\)")
-    content = prog.sub(get_replacement, content)
+    content = JOPLIN_LINK_PROG.sub(get_replacement, content)
 
     return content
 
 
-def main(jex_path: str, output_location: Optional[str] = None):
-    store = joplin.JoplinTarStore(jex_path)
+def main(
+    jex_path: str,
+    output_location: Optional[str] = None,
+    link: Optional[str] = None,
+    note_filter: Optional[NoteFilter] = None,
+    spill_threshold: Optional[int] = ID_MAP_SPILL_THRESHOLD,
+    jobs: Optional[int] = None,
+):
+    """
+    Convert a JEX file, extracted JEX directory or Joplin profile directory
+    to a Boost Note directory.
+
+    Notes are read twice, once to find which notes use each attachment and once
+    to convert them, and are never all held in memory at once. The map from
+    attachments to notes moves to disk once it has more than spill_threshold
+    entries.
+
+    If note_filter is given, only the notes it selects are converted, along
+    with their folders and the resources they link to. Notes are selected on
+    their headers alone, so the bodies of other notes are never read.
+
+    Attachments are copied without passing through Python where possible. With
+    link set to LINK_HARDLINK or LINK_REFLINK, attachments read from a
+    directory share their data with the source instead of being copied.
+
+    Notes and attachments are written by a pool of jobs threads, all reading
+    from the same store. If any writes fail, the output is left untouched and
+    a BulkWriteError lists every failure in the order the items were read.
+    """
+    store = joplin.open_store(jex_path)
     if not output_location:
         output_location = tempfile.mkdtemp()
 
     col = boostnote.BoostnoteCollection.create(output_location)
     print(f"Building boostnote collection at path: '{col.dir_path}'")
 
+    filtering = note_filter is not None and not note_filter.is_empty()
+
     #
-    # Create folders in boostnote metadata file
+    # Index every item by its headers. Stores that can read at an offset only
+    # read the end of each item, so note bodies aren't read here.
     #
-    print("Generating boostnote metadata file")
-    for p in store.list():
-        joplin_entity = joplin.parse_joplin_note(store.read(p))
-        if isinstance(joplin_entity, joplin.JoplinFolder):
-            print(f"Adding folder with id '{joplin_entity.headers['id']}'")
-            col.meta.add_folder(
-                joplin_entity.headers["id"], "#FFFFFF", joplin_entity.name
-            )
-    col.meta.write_to_file(os.path.join(col.dir_path, "boostnote.json"))
+    print("Indexing items")
+    folders = []
+    note_paths = []
+    resource_paths = []
+    tag_paths = {}
+    note_tag_ids = defaultdict(set)
+    for p, headers in store.iter_headers():
+        model_type = joplin.JoplinModelType(int(headers["type_"]))
+        if model_type == joplin.JoplinModelType.Folder:
+            folders.append(joplin.parse_joplin_note(store.read(p)))
+        elif model_type == joplin.JoplinModelType.Note:
+            note_paths.append(p)
+        elif model_type == joplin.JoplinModelType.Resource:
+            resource_paths.append(p)
+        elif model_type == joplin.JoplinModelType.Tag:
+            tag_paths[headers["id"]] = p
+        elif model_type == joplin.JoplinModelType.NoteTag:
+            note_tag_ids[headers["note_id"]].add(headers["tag_id"])
+
+    folder_names = {folder.id: folder.name for folder in folders}
+    tag_names = {
+        tag_id: joplin.parse_joplin_note(store.read(p)).body
+        for tag_id, p in tag_paths.items()
+    }
+
+    def is_selected(headers: dict) -> bool:
+        updated_at = datetime.datetime.strptime(
+            headers["updated_time"], joplin.JOPLIN_DATE_FORMAT
+        )
+        matches = (
+            note_filter.match_id(headers["id"]),
+            note_filter.match_folder(
+                headers["parent_id"], folder_names.get(headers["parent_id"])
+            ),
+            note_filter.match_tags(
+                tag_names.get(tag_id) for tag_id in note_tag_ids[headers["id"]]
+            ),
+            note_filter.match_updated(updated_at),
+        )
+        return all(matches)
+
+    if filtering:
+        note_paths = [p for p in note_paths if is_selected(store.read_headers(p))]
+        print(f"Selected {len(note_paths)} notes")
 
     #
-    # Copy all notes over
+    # First pass over the notes: record which notes use each attachment. Only
+    # IDs are kept, in a map that moves to disk if it grows too large, and each
+    # body is dropped once it has been searched.
     #
-    print("Copying notes")
-    note_queue = []
-    resource_queue = []
-    for p in store.list():
+    attachment_owners = IdMap(spill_threshold)
+    note_folder_ids = set()
+    for p in note_paths:
         joplin_entity = joplin.parse_joplin_note(store.read(p))
-        if joplin_entity.model_type == joplin.JoplinModelType.Note:
-            note_queue.append(joplin_entity)
-        elif isinstance(joplin_entity, joplin.JoplinResource):
-            resource_queue.append(joplin_entity)
-
-    # Build up a mapping from Joplin attachment ID to the notes that use the
-    # attachment.
-    map_attachment_to_notes = defaultdict(set)
-    for joplin_entity in note_queue:
         joplin_id = joplin_entity.headers["id"]
+        note_folder_ids.add(joplin_entity.headers["parent_id"])
         print(f"Searching note with joplin id '{joplin_id}' for attachments")
         content = joplin_entity.body.split("\n\n", 1)[-1]
-        for _attach_id in find_attachments(content, store):
-            map_attachment_to_notes[_attach_id].add(joplin_id)
-    print(map_attachment_to_notes)
+        for attachment_id in find_attachments(content, store):
+            owner = attachment_owners.get(attachment_id)
+            if owner is None:
+                attachment_owners[attachment_id] = joplin_id
+            elif owner != joplin_id:
+                attachment_owners[attachment_id] = SHARED_ATTACHMENT
 
-    for joplin_entity in note_queue:
-        boostnote_entity_id = convert_id_from_joplin_to_boostnote(
-            joplin_entity.headers["id"]
-        )
-        print(f"Adding note with id '{boostnote_entity_id}'")
-        boost_entity = boostnote.BoostnoteNote(
-            id=boostnote_entity_id,
-            created_at=datetime.datetime.strptime(
-                joplin_entity.headers["created_time"], joplin.JOPLIN_DATE_FORMAT
-            ),
-            updated_at=datetime.datetime.strptime(
-                joplin_entity.headers["updated_time"], joplin.JOPLIN_DATE_FORMAT
-            ),
-            title=joplin_entity.body.split("\n\n", 1)[0],
-            folder_id=joplin_entity.headers["parent_id"],
-            tags=[],
-            is_starred=False,
-            is_trashed=False,
-            content=replace_links(
-                joplin_entity.body.split("\n\n", 1)[-1], store, map_attachment_to_notes
-            ),
-        )
-        col.add_entity(boost_entity)
+    #
+    # Create folders in boostnote metadata file
+    #
+    print("Generating boostnote metadata file")
+    for folder in folders:
+        if filtering:
+            selected = folder.id in note_folder_ids or (
+                note_filter.folders and note_filter.match_folder(folder.id, folder.name)
+            )
+            if not selected:
+                continue
+        print(f"Adding folder with id '{folder.id}'")
+        col.meta.add_folder(folder.id, "#FFFFFF", folder.name)
 
-    for joplin_entity in resource_queue:
-        print(f"Adding resource with id '{joplin_entity.headers['id']}'")
-        if len(map_attachment_to_notes[joplin_entity.id]) == 1:
-            prefix = convert_id_from_joplin_to_boostnote(
-                next(iter(map_attachment_to_notes[joplin_entity.id]))
+    #
+    # Second pass: stream each note through link rewriting into the output
+    #
+    # Notes and attachments are written concurrently into a staging directory,
+    # which (along with boostnote.json) only replaces the output location once
+    # everything has been written.
+    print("Copying notes")
+    with col.bulk_writer(max_workers=jobs) as writer:
+        for p in note_paths:
+            joplin_entity = joplin.parse_joplin_note(store.read(p))
+            joplin_id = joplin_entity.headers["id"]
+            boostnote_entity_id = convert_id_from_joplin_to_boostnote(joplin_id)
+            print(f"Adding note with id '{boostnote_entity_id}'")
+            # Joplin has no stars; a trashed note has a deletion time
+            deleted_time = joplin_entity.headers.get("deleted_time", "0")
+            boost_entity = boostnote.BoostnoteNote(
+                id=boostnote_entity_id,
+                created_at=datetime.datetime.strptime(
+                    joplin_entity.headers["created_time"], joplin.JOPLIN_DATE_FORMAT
+                ),
+                updated_at=datetime.datetime.strptime(
+                    joplin_entity.headers["updated_time"], joplin.JOPLIN_DATE_FORMAT
+                ),
+                title=joplin_entity.body.split("\n\n", 1)[0],
+                folder_id=joplin_entity.headers["parent_id"],
+                tags=sorted(
+                    tag_names[tag_id]
+                    for tag_id in note_tag_ids[joplin_id]
+                    if tag_id in tag_names
+                ),
+                is_starred=False,
+                is_trashed=deleted_time not in ("", "0"),
+                content=replace_links(
+                    joplin_entity.body.split("\n\n", 1)[-1],
+                    store,
+                    attachment_owners,
+                ),
             )
-        else:
-            prefix = joplin_entity.id
-        col.add_attachment(
-            os.path.join(prefix, joplin_entity.basename),
-            store.read_resource_bin(joplin_entity),
-        )
+            writer.add_entity(boost_entity)
+
+        for p in resource_paths:
+            # A partial conversion only carries the resources its notes link to
+            if filtering and p.rsplit(".", 1)[0] not in attachment_owners:
+                continue
+            joplin_entity = joplin.parse_joplin_note(store.read(p))
+            print(f"Adding resource with id '{joplin_entity.headers['id']}'")
+            prefix = attachment_prefix(joplin_entity.id, attachment_owners)
+            relpath = os.path.join(prefix, joplin_entity.basename)
+            location = store.resource_location(joplin_entity)
+            if location is None:
+                writer.add_attachment(relpath, store.read_resource_bin(joplin_entity))
+            else:
+                src_path, offset, size = location
+                writer.add_attachment_from(relpath, src_path, offset, size, link)
 
+    attachment_owners.close()
     print(f"Finished building boostnote collection at path: '{col.dir_path}'")
 
 
@@ -0,0 +1,456 @@
+"""
+Compare a Boost Note directory against a Joplin JEX file.
+
+Both sides are streamed one item at a time and reduced to a small digest per
+folder, note and attachment, so memory use depends on the number of items
+rather than on the size of their bodies.
+"""
+import datetime
+import functools
+import hashlib
+import os
+import re
+from collections import Counter, defaultdict
+from concurrent.futures import Executor
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from . import boostnote, joplin
+from .convert_boostnote_to_jex import boostnote_to_joplin_id
+from .convert_jex_to_boostnote import JOPLIN_LINK_PROG
+from .util import HASH_CHUNK_SIZE, hash_stream, to_utc
+
+
+@dataclass
+class DiffEntry:
+    """
+    kind: one of "folder", "note" or "attachment"
+    key: the Joplin ID for folders and notes, the file name for attachments
+    label: a human readable name for the item
+    """
+
+    kind: str
+    key: str
+    label: str
+
+    def __str__(self):
+        return f"{self.kind} {self.key} ({self.label})"
+
+
+@dataclass
+class VaultDiff:
+    """
+    added: items in the Boost Note directory that are missing from the JEX
+    removed: items in the JEX that are missing from the Boost Note directory
+    modified: items present on both sides whose contents differ
+    metadata_changed: notes present on both sides with the same contents but
+        different tags, flags (starred or trashed) or timestamps
+    """
+
+    added: List[DiffEntry] = field(default_factory=list)
+    removed: List[DiffEntry] = field(default_factory=list)
+    modified: List[DiffEntry] = field(default_factory=list)
+    metadata_changed: List[DiffEntry] = field(default_factory=list)
+
+    def is_empty(self) -> bool:
+        return not (
+            self.added or self.removed or self.modified or self.metadata_changed
+        )
+
+    def format(self) -> str:
+        lines = []
+        for prefix, entries in (
+            ("+", self.added),
+            ("-", self.removed),
+            ("M", self.modified),
+            ("T", self.metadata_changed),
+        ):
+            lines.extend(f"{prefix} {entry}" for entry in entries)
+        return "\n".join(lines)
+
+
+class _NoteDigest:
+    """
+    Digest of a note whose link targets are resolved only once the whole vault
+    has been scanned.
+
+    Links are masked out of the text before hashing and their targets are kept
+    aside, so that the (possibly large) note body can be discarded immediately.
+    Tags are kept aside in the same way, since a JEX file names them in items
+    of their own.
+    """
+
+    def __init__(
+        self,
+        folder_id: str,
+        title: str,
+        content: str,
+        prog: re.Pattern,
+        tags: Iterable[str] = (),
+        flags: Tuple[bool, bool] = (False, False),
+        times: Tuple[datetime.datetime, datetime.datetime] = (),
+    ):
+        self.label = title
+        self.targets: List[str] = []
+        self.tags = list(tags)
+        # Starred and trashed, and creation and update times to the millisecond
+        self.flags = "".join("1" if flag else "0" for flag in flags)
+        self.times = "\0".join(
+            to_utc(t).strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] for t in times
+        )
+
+        def mask(m: re.Match) -> str:
+            self.targets.append(m.group(2))
+            return f"[{m.group(1)}]()"
+
+        masked = prog.sub(mask, content)
+        self.partial = hashlib.sha256(
+            "\0".join((folder_id, title, masked)).encode("utf-8")
+        ).hexdigest()
+
+    def digest(self, resolve: Callable[[str], str]) -> str:
+        targets = "\0".join(resolve(t) for t in self.targets)
+        return hashlib.sha256(f"{self.partial}\0{targets}".encode("utf-8")).hexdigest()
+
+    def metadata(self, tag_name: Callable[[str], str] = str) -> str:
+        tags = "\0".join(sorted(tag_name(t) for t in self.tags))
+        metadata = f"{tags}\0{self.flags}\0{self.times}"
+        return hashlib.sha256(metadata.encode("utf-8")).hexdigest()
+
+
+# Both kinds of Boost Note link; the target keeps its `note:` or `storage/`
+# prefix so that it can be told apart when resolved.
+_BOOSTNOTE_ANY_LINK_PROG = re.compile(r"\[([^\]]*)\]\(:((?:note:|storage\/)[^\)]*)\)")
+
+
+def _diff_keyed(kind, ours: Dict[str, tuple], theirs: Dict[str, tuple], result):
+    """
+    Diff two {key: (label, digest)} mappings into result. Values may also
+    carry a metadata digest, as (label, digest, metadata).
+    """
+    for key, (label, *digests) in ours.items():
+        if key not in theirs:
+            result.added.append(DiffEntry(kind, key, label))
+        elif theirs[key][1] != digests[0]:
+            result.modified.append(DiffEntry(kind, key, label))
+        elif theirs[key][2:] != tuple(digests[1:]):
+            result.metadata_changed.append(DiffEntry(kind, key, label))
+    for key, (label, *_) in theirs.items():
+        if key not in ours:
+            result.removed.append(DiffEntry(kind, key, label))
+
+
+def _diff_attachments(
+    ours: Dict[str, Counter], theirs: Dict[str, Counter], result: VaultDiff
+):
+    """
+    Attachments don't keep their IDs across a conversion, so they are matched
+    by file name and compared as multisets of content digests.
+    """
+    for filename in sorted(set(ours) | set(theirs)):
+        extra_ours = ours.get(filename, Counter()) - theirs.get(filename, Counter())
+        extra_theirs = theirs.get(filename, Counter()) - ours.get(filename, Counter())
+        n_ours = sum(extra_ours.values())
+        n_theirs = sum(extra_theirs.values())
+        for _ in range(min(n_ours, n_theirs)):
+            result.modified.append(DiffEntry("attachment", filename, filename))
+        for _ in range(n_ours - n_theirs):
+            result.added.append(DiffEntry("attachment", filename, filename))
+        for _ in range(n_theirs - n_ours):
+            result.removed.append(DiffEntry("attachment", filename, filename))
+
+
+# Items handed to each worker at a time when scanning with a process pool
+MAP_CHUNK_SIZE = 64
+
+
+def _map(fn, items: Iterable, executor: Optional[Executor]) -> Iterator:
+    """Map fn over items in order, on executor if given"""
+    if executor is None:
+        return map(fn, items)
+    return executor.map(fn, items, chunksize=MAP_CHUNK_SIZE)
+
+
+@functools.lru_cache(maxsize=None)
+def _open_collection(dir_path: str) -> boostnote.BoostnoteCollection:
+    # Cached, so that each process opens a vault once rather than per item
+    return boostnote.BoostnoteCollection.from_dir(dir_path)
+
+
+def _digest_boostnote_note(
+    dir_path: str, note_path: str
+) -> Optional[Tuple[str, _NoteDigest]]:
+    """Digest a note, or return None for a snippet or a note that can't be read"""
+    col = _open_collection(dir_path)
+    # Skipped entities are reported just as get_entities would
+    for entity in col.get_entities(note_paths=[note_path]):
+        if isinstance(entity, boostnote.BoostnoteNote):
+            return entity.id, _NoteDigest(
+                entity.folder_id,
+                entity.title,
+                entity.content,
+                _BOOSTNOTE_ANY_LINK_PROG,
+                entity.tags,
+                (entity.is_starred, entity.is_trashed),
+                (entity.created_at, entity.updated_at),
+            )
+    return None
+
+
+def _hash_file(path: str) -> str:
+    with open(path, "rb") as fh:
+        return hash_stream(fh)
+
+
+def _hash_range(path: str, offset: int, size: int) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as fh:
+        fh.seek(offset)
+        while size > 0:
+            chunk = fh.read(min(size, HASH_CHUNK_SIZE))
+            if not chunk:
+                break
+            digest.update(chunk)
+            size -= len(chunk)
+    return digest.hexdigest()
+
+
+def scan_boostnote(dir_path: str, executor: Optional[Executor] = None):
+    """
+    Digest every folder, note and attachment of a Boost Note directory,
+    parsing notes and hashing attachments on executor if given
+    """
+    col = boostnote.BoostnoteCollection.from_dir(dir_path)
+    folders = {
+        folder_id: (name, hashlib.sha256(name.encode("utf-8")).hexdigest())
+        for folder_id, name in (
+            (folder_id, col.meta.get_folder_name(folder_id))
+            for folder_id in col.meta.list_folder_ids()
+        )
+    }
+
+    # Note IDs come from the file names, so the ID map can be built without
+    # opening a single note. IDs that can't be converted directly are derived
+    # from their names, as boost2jex does with --reproducible.
+    note_paths = col.get_entity_paths()
+    map_boostnote_to_joplin = {
+        os.path.basename(p).rsplit(".", 1)[0]: None for p in note_paths
+    }
+    for boostnote_id in map_boostnote_to_joplin:
+        map_boostnote_to_joplin[boostnote_id] = boostnote_to_joplin_id(
+            boostnote_id, reproducible=True
+        )
+
+    notes: Dict[str, _NoteDigest] = {}
+    digest_note = functools.partial(_digest_boostnote_note, dir_path)
+    for result in _map(digest_note, note_paths, executor):
+        if result is not None:
+            boostnote_id, digest = result
+            notes[map_boostnote_to_joplin[boostnote_id]] = digest
+
+    # Copies of the same attachment become a single resource, named after the
+    # first copy
+    attachments: Dict[str, Counter] = defaultdict(Counter)
+    first_copies: Dict[str, str] = {}
+    resource_names: Dict[str, str] = {}
+    attachment_list = list(col.get_attachments())
+    attachment_paths = [col.attachment_path(a) for a in attachment_list]
+    for attachment, digest in zip(
+        attachment_list, _map(_hash_file, attachment_paths, executor)
+    ):
+        if digest not in first_copies:
+            first_copies[digest] = attachment.filename
+            attachments[attachment.filename][digest] += 1
+        relpath = os.path.normpath(attachment.relative_path)
+        resource_names[relpath] = first_copies[digest]
+
+    def resolve(target: str) -> str:
+        if target.startswith("note:"):
+            boostnote_id = target[len("note:") :]
+            return "note:" + map_boostnote_to_joplin.get(boostnote_id, boostnote_id)
+        relpath = os.path.normpath(target[len("storage/") :])
+        return "resource:" + resource_names.get(relpath, os.path.basename(relpath))
+
+    return (
+        folders,
+        {k: (n.label, n.digest(resolve), n.metadata()) for k, n in notes.items()},
+        attachments,
+    )
+
+
+def _digest_jex_item(name: str, data: bytes) -> Optional[tuple]:
+    """
+    Digest a serialized item, as ("folder", id, (name, digest)),
+    ("resource", id, basename), ("tag", id, name), ("notetag", note ID,
+    tag ID) or ("note", id, _NoteDigest). Returns None for any other item or
+    one that can't be parsed.
+    """
+    try:
+        item = joplin.parse_joplin_note(data.decode("utf-8"))
+    except Exception:
+        print(f"Could not parse {name}")
+        return None
+    if isinstance(item, joplin.JoplinFolder):
+        return (
+            "folder",
+            item.id,
+            (item.name, hashlib.sha256(item.name.encode("utf-8")).hexdigest()),
+        )
+    elif isinstance(item, joplin.JoplinResource):
+        return "resource", item.id, item.basename
+    elif item.model_type == joplin.JoplinModelType.Tag:
+        return "tag", item.id, item.body
+    elif item.model_type == joplin.JoplinModelType.NoteTag:
+        return "notetag", item.headers["note_id"], item.headers["tag_id"]
+    elif item.model_type == joplin.JoplinModelType.Note:
+        title, _, content = item.body.partition("\n\n")
+        # Joplin has no stars; a trashed note has a deletion time
+        is_trashed = item.headers.get("deleted_time", "0") not in ("", "0")
+        return (
+            "note",
+            item.id,
+            _NoteDigest(
+                item.headers.get("parent_id", ""),
+                title,
+                content,
+                JOPLIN_LINK_PROG,
+                flags=(False, is_trashed),
+                times=tuple(
+                    datetime.datetime.strptime(
+                        item.headers[key], joplin.JOPLIN_DATE_FORMAT
+                    )
+                    for key in ("created_time", "updated_time")
+                ),
+            ),
+        )
+    return None
+
+
+@functools.lru_cache(maxsize=None)
+def _open_jex(jex_path: str) -> joplin.IndexedJoplinTarStore:
+    # Cached, so that each process opens a vault once rather than per item
+    return joplin.IndexedJoplinTarStore(jex_path)
+
+
+def _digest_jex_member(jex_path: str, name: str) -> Optional[tuple]:
+    store = _open_jex(jex_path)
+    if name.startswith("resources/"):
+        info = store.member(name)
+        return "blob", name, _hash_range(jex_path, info.offset_data, info.size)
+    return _digest_jex_item(name, store.read_bin(name))
+
+
+def _iter_jex_digests(jex_path: str, executor: Optional[Executor]) -> Iterator:
+    if executor is None:
+        # A single sequential read of the archive
+        for info, fh in joplin.JoplinTarStore(jex_path).iter_members(latest_only=True):
+            if info.name.startswith("resources/"):
+                yield "blob", info.name, hash_stream(fh)
+            elif "/" not in info.name and info.name.endswith(".md"):
+                yield _digest_jex_item(info.name, fh.read())
+        return
+    # Each worker reads the members it's given at their offsets
+    with joplin.IndexedJoplinTarStore(jex_path) as store:
+        names = store.list("resources/")
+        names.extend(n for n in store.list() if n.endswith(".md"))
+    digest_member = functools.partial(_digest_jex_member, jex_path)
+    yield from _map(digest_member, names, executor)
+
+
+def scan_jex(jex_path: str, executor: Optional[Executor] = None):
+    """
+    Digest every folder, note and resource of a JEX file, parsing items and
+    hashing resources on executor if given
+    """
+    folders = {}
+    notes: Dict[str, _NoteDigest] = {}
+    resource_names: Dict[str, str] = {}
+    blob_digests: Dict[str, str] = {}
+    tag_names: Dict[str, str] = {}
+    note_tags: Dict[str, List[str]] = defaultdict(list)
+    for result in _iter_jex_digests(jex_path, executor):
+        if result is None:
+            continue
+        kind, key, value = result
+        if kind == "blob":
+            resource_id = os.path.basename(key).split(".", 1)[0]
+            blob_digests[resource_id] = value
+        elif kind == "folder":
+            folders[key] = value
+        elif kind == "resource":
+            resource_names[key] = value
+        elif kind == "tag":
+            tag_names[key] = value
+        elif kind == "notetag":
+            note_tags[key].append(value)
+        else:
+            notes[key] = value
+    for note_id, tag_ids in note_tags.items():
+        if note_id in notes:
+            notes[note_id].tags = tag_ids
+
+    def resolve(joplin_id: str) -> str:
+        if joplin_id in resource_names:
+            return "resource:" + resource_names[joplin_id]
+        return "note:" + joplin_id
+
+    attachments: Dict[str, Counter] = defaultdict(Counter)
+    for resource_id, basename in resource_names.items():
+        attachments[basename][blob_digests.get(resource_id)] += 1
+
+    def tag_name(tag_id: str) -> str:
+        return tag_names.get(tag_id, tag_id)
+
+    return (
+        folders,
+        {
+            k: (n.label, n.digest(resolve), n.metadata(tag_name))
+            for k, n in notes.items()
+        },
+        attachments,
+    )
+
+
+def compare(boost_scan: tuple, jex_scan: tuple) -> VaultDiff:
+    """
+    Compare the scans of a Boost Note directory and a JEX file, treating the
+    Boost Note directory as the source of truth
+    """
+    boost_folders, boost_notes, boost_attachments = boost_scan
+    jex_folders, jex_notes, jex_attachments = jex_scan
+
+    result = VaultDiff()
+    _diff_keyed("folder", boost_folders, jex_folders, result)
+    _diff_keyed("note", boost_notes, jex_notes, result)
+    _diff_attachments(boost_attachments, jex_attachments, result)
+    return result
+
+
+def diff(
+    boost_dir_path: str, jex_path: str, executor: Optional[Executor] = None
+) -> VaultDiff:
+    """
+    Compare a Boost Note directory with a JEX file, treating the Boost Note
+    directory as the source of truth.
+
+    Boost Note IDs are mapped into Joplin's ID space with the same rules that
+    boost2jex uses. Those rules invert convert_id_from_joplin_to_boostnote, so
+    a directory produced by jex2boost lines up with the JEX it came from. Notes
+    whose IDs aren't in a form Joplin accepts only line up with a JEX written
+    by boost2jex with reproducible set.
+
+    Notes are parsed and attachments hashed one at a time, or spread over the
+    worker processes of executor if given.
+    """
+    return compare(
+        scan_boostnote(boost_dir_path, executor), scan_jex(jex_path, executor)
+    )
+
+
+def main(boost_dir_path: str, jex_path: str) -> VaultDiff:
+    result = diff(boost_dir_path, jex_path)
+    if result.is_empty():
+        print("No differences found")
+    else:
+        print(result.format())
+    return result
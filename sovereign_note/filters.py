@@ -0,0 +1,67 @@
+"""
+Select which notes a conversion includes.
+
+Filters are checked against as little of each note as possible: IDs against
+file names, and folders, tags and update times against a note's headers (JEX)
+or a scan of its top-level keys (Boost Note), so that the bodies of notes that
+aren't selected are never parsed. The cost of a partial conversion therefore
+depends on the size of the selection rather than the size of the vault.
+"""
+import datetime
+from dataclasses import dataclass, field
+from typing import Iterable, Optional, Set
+
+from .util import to_utc
+
+
+def normalize_id(note_id: str) -> str:
+    """
+    Put an ID in a form shared by Boost Note and Joplin, so that either can be
+    used to select a note
+    """
+    return note_id.replace("-", "").lower()
+
+
+def parse_since(text: str) -> datetime.datetime:
+    """Parse an ISO 8601 date or time, treating times without a zone as UTC"""
+    if text.endswith("Z"):
+        text = text[:-1] + "+00:00"
+    return to_utc(datetime.datetime.fromisoformat(text))
+
+
+@dataclass
+class NoteFilter:
+    """
+    A note is selected if it matches every filter that is given. Within a
+    filter, matching any one of the values is enough.
+
+    folders: folder IDs or names
+    tags: tag names
+    since: select notes updated at or after this time
+    ids: note IDs, in either Boost Note or Joplin form
+    """
+
+    folders: Set[str] = field(default_factory=set)
+    tags: Set[str] = field(default_factory=set)
+    since: Optional[datetime.datetime] = None
+    ids: Set[str] = field(default_factory=set)
+
+    def __post_init__(self):
+        self.ids = {normalize_id(i) for i in self.ids}
+        if self.since is not None:
+            self.since = to_utc(self.since)
+
+    def is_empty(self) -> bool:
+        return not (self.folders or self.tags or self.ids or self.since)
+
+    def match_id(self, note_id: str) -> bool:
+        return not self.ids or normalize_id(note_id) in self.ids
+
+    def match_folder(self, folder_id: str, folder_name: Optional[str]) -> bool:
+        return not self.folders or bool({folder_id, folder_name} & self.folders)
+
+    def match_tags(self, tags: Iterable[str]) -> bool:
+        return not self.tags or any(tag in self.tags for tag in tags)
+
+    def match_updated(self, updated_at: datetime.datetime) -> bool:
+        return self.since is None or to_utc(updated_at) >= self.since
@@ -0,0 +1,110 @@
+"""
+ID mappings that move to disk when they grow too large for memory.
+"""
+import os
+import sqlite3
+import tempfile
+import weakref
+from typing import Callable, Iterator, MutableMapping, Optional
+
+from .options import ID_MAP_SPILL_THRESHOLD
+
+
+def _remove_database(conn: sqlite3.Connection, path: str):
+    conn.close()
+    os.remove(path)
+
+
+class IdMap(MutableMapping):
+    """
+    A mapping from IDs to IDs that is held in a dict until it has more than
+    spill_threshold entries, and in an SQLite database in a temporary file
+    after that.
+
+    Keys and values are stored as strings. Keys of another type can be used by
+    passing encode_key and decode_key to convert them to and from strings.
+    """
+
+    def __init__(
+        self,
+        spill_threshold: Optional[int] = ID_MAP_SPILL_THRESHOLD,
+        encode_key: Callable[[object], str] = str,
+        decode_key: Callable[[str], object] = str,
+    ):
+        self.spill_threshold = spill_threshold
+        self._encode_key = encode_key
+        self._decode_key = decode_key
+        self._dict = {}
+        self._db: Optional[sqlite3.Connection] = None
+
+    @property
+    def spilled(self) -> bool:
+        return self._db is not None
+
+    def _spill(self):
+        fd, path = tempfile.mkstemp(prefix="sovereign-idmap-", suffix=".sqlite")
+        os.close(fd)
+        self._db = sqlite3.connect(path)
+        # The database is scratch space that doesn't need to survive a crash
+        self._db.execute("PRAGMA journal_mode = OFF")
+        self._db.execute("PRAGMA synchronous = OFF")
+        self._db.execute("CREATE TABLE ids (key TEXT PRIMARY KEY, value TEXT)")
+        self._db.executemany("INSERT INTO ids VALUES (?, ?)", self._dict.items())
+        self._dict = {}
+        self._close = weakref.finalize(self, _remove_database, self._db, path)
+
+    def close(self):
+        """Remove the database, if the map was spilled to one"""
+        if self._db is not None:
+            self._close()
+
+    def __getitem__(self, key):
+        encoded = self._encode_key(key)
+        if self._db is None:
+            return self._dict[encoded]
+        row = self._db.execute(
+            "SELECT value FROM ids WHERE key = ?", (encoded,)
+        ).fetchone()
+        if row is None:
+            raise KeyError(key)
+        return row[0]
+
+    def __setitem__(self, key, value: str):
+        encoded = self._encode_key(key)
+        if self._db is None:
+            self._dict[encoded] = value
+            threshold = self.spill_threshold
+            if threshold is not None and len(self._dict) > threshold:
+                self._spill()
+        else:
+            self._db.execute(
+                "INSERT OR REPLACE INTO ids VALUES (?, ?)", (encoded, value)
+            )
+
+    def __delitem__(self, key):
+        encoded = self._encode_key(key)
+        if self._db is None:
+            del self._dict[encoded]
+        elif not self._db.execute("DELETE FROM ids WHERE key = ?", (encoded,)).rowcount:
+            raise KeyError(key)
+
+    def __contains__(self, key) -> bool:
+        try:
+            self[key]
+        except KeyError:
+            return False
+        return True
+
+    def __iter__(self) -> Iterator:
+        if self._db is None:
+            keys = iter(self._dict)
+        else:
+            # Read from a separate cursor, so that lookups made while
+            # iterating don't interfere
+            keys = (row[0] for row in self._db.execute("SELECT key FROM ids"))
+        return (self._decode_key(k) for k in keys)
+
+    def __len__(self) -> int:
+        if self._db is None:
+            return len(self._dict)
+        return self._db.execute("SELECT COUNT(*) FROM ids").fetchone()[0]
@@ -0,0 +1,557 @@
+"""
+Streaming intermediate representation shared by readers and writers of every
+format.
+
+A reader turns a Boost Note collection or a Joplin store into a stream of
+typed records: every folder, then every tag, then every resource, then every
+note. A writer consumes such a stream. In between, map_ids gives each record
+an ID in the output format and rewrites the links in note bodies to match. Any
+reader can therefore be joined to any writer, including one of the same
+format, in a single pass (see merge, which normalizes a single vault).
+
+boost2jex and jex2boost don't go through these stages: they keep their own
+pipelines, which journal, filter, deduplicate attachments and write sync
+targets. What is shared with them is reading (analyze, merge and linkgraph
+consume these streams) and the ID and link helpers imported from them below.
+
+Within a stream, links in note bodies all take the form `[text](:/<id>)`,
+where id is the ID of another record in the stream. Readers translate their
+format's links into this form, and writers translate them back. Records only
+refer to one another by ID, and notes and resource data are read one at a
+time, so memory use depends on the number of items rather than their size.
+"""
+import dataclasses
+import datetime
+import os
+import re
+import uuid
+from dataclasses import dataclass, field
+from typing import Iterable, Iterator, List, Optional, Tuple, Union
+
+from . import boostnote, joplin
+from .convert_boostnote_to_jex import (
+    BOOSTNOTE_NOTE_LINK_PROG,
+    BOOSTNOTE_STORAGE_LINK_PROG,
+    boostnote_to_joplin_id,
+    new_uuid,
+)
+from .convert_jex_to_boostnote import (
+    JOPLIN_LINK_PROG,
+    SHARED_ATTACHMENT,
+    convert_id_from_joplin_to_boostnote,
+)
+from .idmap import IdMap
+from .options import FORMAT_BOOSTNOTE, FORMAT_JEX, ID_MAP_SPILL_THRESHOLD
+
+
+@dataclass
+class Folder:
+    id: str
+    name: str
+
+
+@dataclass
+class Tag:
+    id: str
+    name: str
+
+
+@dataclass
+class Resource:
+    """
+    An attachment. Its data is either stored uncompressed in a file, at
+    location (file path, offset, size), or held in data.
+
+    filename: the name of the file when it was attached
+    owner_id: the note using the resource, if only one note does
+    """
+
+    id: str
+    filename: str
+    location: Optional[Tuple[str, int, int]] = None
+    data: Optional[bytes] = None
+    owner_id: Optional[str] = None
+
+
+@dataclass
+class Note:
+    """
+    body: the note's content, with links in the form `[text](:/<id>)`
+    tags: IDs of the note's tags
+    """
+
+    id: str
+    title: str
+    body: str
+    folder_id: str
+    created_at: datetime.datetime
+    updated_at: datetime.datetime
+    tags: List[str] = field(default_factory=list)
+
+
+Record = Union[Folder, Tag, Resource, Note]
+
+
+def rewrite_links(body: str, resolve) -> str:
+    """Replace the target of every link in body with resolve(target)"""
+    return JOPLIN_LINK_PROG.sub(
+        lambda m: f"[{m.group(1)}](:/{resolve(m.group(2))})", body
+    )
+
+
+#
+# Readers
+#
+
+
+def read_boostnote(
+    col: boostnote.BoostnoteCollection,
+    spill_threshold: Optional[int] = ID_MAP_SPILL_THRESHOLD,
+) -> Iterator[Record]:
+    """
+    Read a Boost Note collection as a stream of records.
+
+    Tags are identified by their names and resources by their paths within the
+    attachments directory. A resource is owned by the note whose directory it
+    is stored in. Snippets have no counterpart in other formats and are
+    skipped.
+    """
+    for folder_id in col.meta.list_folder_ids():
+        yield Folder(folder_id, col.meta.get_folder_name(folder_id))
+    for tag_name in sorted(col.list_tags()):
+        yield Tag(tag_name, tag_name)
+
+    attachment_paths = IdMap(spill_threshold)
+    for attachment in col.get_attachments():
+        relpath = os.path.normpath(attachment.relative_path)
+        attachment_paths[relpath] = relpath
+        src_path = col.attachment_path(attachment)
+        owner, _, rest = relpath.partition(os.sep)
+        yield Resource(
+            relpath,
+            attachment.filename,
+            location=(src_path, 0, os.path.getsize(src_path)),
+            owner_id=owner if rest else None,
+        )
+
+    def replace_storage_link(m: re.Match) -> str:
+        relpath = os.path.normpath(m.group(2))
+        if relpath not in attachment_paths:
+            return m.group(0)
+        return f"[{m.group(1)}](:/{relpath})"
+
+    try:
+        for entity in col.get_entities():
+            if not isinstance(entity, boostnote.BoostnoteNote):
+                continue
+            body = BOOSTNOTE_NOTE_LINK_PROG.sub(r"[\1](:/\2)", entity.content)
+            yield Note(
+                entity.id,
+                entity.title,
+                BOOSTNOTE_STORAGE_LINK_PROG.sub(replace_storage_link, body),
+                entity.folder_id,
+                entity.created_at,
+                entity.updated_at,
+                list(entity.tags),
+            )
+    finally:
+        attachment_paths.close()
+
+
+def read_joplin(
+    store: joplin.Store,
+    resource_owners: bool = True,
+    spill_threshold: Optional[int] = ID_MAP_SPILL_THRESHOLD,
+) -> Iterator[Record]:
+    """
+    Read a Joplin store as a stream of records.
+
+    Items are first indexed by their headers. If resource_owners is set, the
+    notes are then searched for the resources they link to, so that resources
+    used by a single note can be given that note as their owner; this reads
+    every note twice.
+    """
+    folder_paths = []
+    tag_paths = []
+    note_paths = []
+    resource_ids = IdMap(spill_threshold)
+    note_tag_ids = {}
+    for p, headers in store.iter_headers():
+        model_type = joplin.JoplinModelType(int(headers["type_"]))
+        if model_type == joplin.JoplinModelType.Folder:
+            folder_paths.append(p)
+        elif model_type == joplin.JoplinModelType.Tag:
+            tag_paths.append(p)
+        elif model_type == joplin.JoplinModelType.NoteTag:
+            note_tag_ids.setdefault(headers["note_id"], []).append(headers["tag_id"])
+        elif model_type == joplin.JoplinModelType.Note:
+            note_paths.append(p)
+        elif model_type == joplin.JoplinModelType.Resource:
+            resource_ids[headers["id"]] = p
+
+    owners = IdMap(spill_threshold)
+    if resource_owners:
+        for p in note_paths:
+            item = joplin.parse_joplin_note(store.read(p))
+            for m in JOPLIN_LINK_PROG.finditer(item.body):
+                resource_id = m.group(2)
+                if resource_id not in resource_ids:
+                    continue
+                owner = owners.get(resource_id)
+                if owner is None:
+                    owners[resource_id] = item.id
+                elif owner != item.id:
+                    owners[resource_id] = SHARED_ATTACHMENT
+
+    try:
+        for p in folder_paths:
+            folder = joplin.parse_joplin_note(store.read(p))
+            yield Folder(folder.id, folder.name)
+        for p in tag_paths:
+            tag = joplin.parse_joplin_note(store.read(p))
+            yield Tag(tag.id, tag.body)
+        for p in resource_ids.values():
+            resource = joplin.parse_joplin_note(store.read(p))
+            location = store.resource_location(resource)
+            data = store.read_resource_bin(resource) if location is None else None
+            yield Resource(
+                resource.id,
+                resource.basename,
+                location=location,
+                data=data,
+                owner_id=owners.get(resource.id) or None,
+            )
+        for p in note_paths:
+            item = joplin.parse_joplin_note(store.read(p))
+            title, _, body = item.body.partition("\n\n")
+            yield Note(
+                item.id,
+                title,
+                body,
+                item.headers["parent_id"],
+                datetime.datetime.strptime(
+                    item.headers["created_time"], joplin.JOPLIN_DATE_FORMAT
+                ),
+                datetime.datetime.strptime(
+                    item.headers["updated_time"], joplin.JOPLIN_DATE_FORMAT
+                ),
+                note_tag_ids.get(item.id, []),
+            )
+    finally:
+        resource_ids.close()
+        owners.close()
+
+
+def detect_format(path: str) -> str:
+    """Guess the format of an existing vault"""
+    if os.path.exists(os.path.join(path, "boostnote.json")):
+        return FORMAT_BOOSTNOTE
+    return FORMAT_JEX
+
+
+def read(
+    path: str,
+    resource_owners: bool = True,
+    spill_threshold: Optional[int] = ID_MAP_SPILL_THRESHOLD,
+) -> Iterator[Record]:
+    """
+    Read a Boost Note directory, JEX file, extracted JEX directory or Joplin
+    profile directory as a stream of records
+    """
+    if detect_format(path) == FORMAT_BOOSTNOTE:
+        col = boostnote.BoostnoteCollection.from_dir(path)
+        return read_boostnote(col, spill_threshold)
+    return read_joplin(joplin.open_store(path), resource_owners, spill_threshold)
+
+
+#
+# ID mapping
+#
+
+
+def _is_uuid(text: str) -> bool:
+    try:
+        uuid.UUID(text)
+    except ValueError:
+        return False
+    return True
+
+
+class IdScheme:
+    """How an output format identifies records. IDs are kept as they are."""
+
+    def folder_id(self, folder: Folder) -> str:
+        return folder.id
+
+    def tag_id(self, tag: Tag) -> str:
+        return tag.id
+
+    def resource_id(self, resource: Resource) -> str:
+        return resource.id
+
+    def note_id(self, note_id: str) -> str:
+        """Notes are identified from their ID alone, since links refer to them"""
+        return note_id
+
+
+class JoplinIds(IdScheme):
+    """
+    Joplin IDs, kept where they are already UUIDs. Other IDs are generated,
+    and derived from names if reproducible is set, as boost2jex does.
+    """
+
+    def __init__(self, reproducible: bool = False):
+        self.reproducible = reproducible
+
+    def tag_id(self, tag: Tag) -> str:
+        if _is_uuid(tag.id):
+            return tag.id
+        return str(new_uuid(self.reproducible, "tag", tag.name))
+
+    def resource_id(self, resource: Resource) -> str:
+        if _is_uuid(resource.id):
+            return resource.id
+        return new_uuid(self.reproducible, "attachment", resource.id).hex
+
+    def note_id(self, note_id: str) -> str:
+        return boostnote_to_joplin_id(note_id, self.reproducible)
+
+
+class BoostnoteIds(IdScheme):
+    """Boost Note IDs: hyphenated UUIDs for notes, and names for tags"""
+
+    def tag_id(self, tag: Tag) -> str:
+        return tag.name
+
+    def note_id(self, note_id: str) -> str:
+        if len(note_id) == 32 and _is_uuid(note_id):
+            return convert_id_from_joplin_to_boostnote(note_id)
+        return note_id
+
+
+def map_ids(
+    records: Iterable[Record],
+    ids: IdScheme,
+    spill_threshold: Optional[int] = ID_MAP_SPILL_THRESHOLD,
+) -> Iterator[Record]:
+    """
+    Give every record an ID from ids, and update every reference to it.
+
+    A note may link to a note later in the stream, so a note's new ID is
+    chosen the first time it is seen, whether as a record or as a link
+    target, and reused from then on. Resources come before notes, so a link
+    target that isn't a known resource is taken to be a note.
+    """
+    folder_ids = IdMap(spill_threshold)
+    tag_ids = IdMap(spill_threshold)
+    resource_ids = IdMap(spill_threshold)
+    note_ids = IdMap(spill_threshold)
+
+    def note_id(source_id: str) -> str:
+        target_id = note_ids.get(source_id)
+        if target_id is None:
+            target_id = note_ids[source_id] = ids.note_id(source_id)
+        return target_id
+
+    def resolve(source_id: str) -> str:
+        return resource_ids.get(source_id) or note_id(source_id)
+
+    try:
+        for record in records:
+            if isinstance(record, Folder):
+                folder_ids[record.id] = ids.folder_id(record)
+                yield dataclasses.replace(record, id=folder_ids[record.id])
+            elif isinstance(record, Tag):
+                tag_ids[record.id] = ids.tag_id(record)
+                yield dataclasses.replace(record, id=tag_ids[record.id])
+            elif isinstance(record, Resource):
+                resource_ids[record.id] = ids.resource_id(record)
+                owner_id = record.owner_id and note_id(record.owner_id)
+                yield dataclasses.replace(
+                    record, id=resource_ids[record.id], owner_id=owner_id
+                )
+            else:
+                yield dataclasses.replace(
+                    record,
+                    id=note_id(record.id),
+                    body=rewrite_links(record.body, resolve),
+                    folder_id=folder_ids.get(record.folder_id, record.folder_id),
+                    tags=[tag_ids.get(t, t) for t in record.tags],
+                )
+    finally:
+        for id_map in (folder_ids, tag_ids, resource_ids, note_ids):
+            id_map.close()
+
+
+#
+# Writers
+#
+
+
+class JoplinWriter:
+    """Write a stream of records into a JEX archive"""
+
+    # Resources don't need owners in a JEX
+    needs_resource_owners = False
+
+    def __init__(self, store: joplin.JoplinTarWriter, reproducible: bool = False):
+        self.store = store
+        self.reproducible = reproducible
+        self.ids = JoplinIds(reproducible)
+        self._tag_names = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.store.close()
+
+    def write(self, record: Record):
+        if isinstance(record, Folder):
+            item = joplin.joplin_create_folder(record.id, record.name)
+        elif isinstance(record, Tag):
+            self._tag_names[record.id] = record.name
+            item = joplin.joplin_create_tag(record.id, record.name)
+        elif isinstance(record, Resource):
+            if record.location is not None:
+                size = record.location[2]
+            else:
+                size = len(record.data)
+            item = joplin.joplin_create_resource(record.id, record.filename, size)
+            self._write_resource_data(record)
+        else:
+            item = joplin.joplin_create_note(
+                record.id,
+                record.title,
+                record.body,
+                record.folder_id,
+                record.created_at,
+                record.updated_at,
+            )
+            for tag_id in record.tags:
+                notetag_id = str(
+                    new_uuid(
+                        self.reproducible,
+                        "notetag",
+                        record.id,
+                        self._tag_names.get(tag_id, tag_id),
+                    )
+                )
+                notetag = joplin.joplin_create_notetag(notetag_id, record.id, tag_id)
+                self.store.write(
+                    f"{notetag_id}.md", joplin.unparse_joplin_note(notetag)
+                )
+        self.store.write(f"{record.id}.md", joplin.unparse_joplin_note(item))
+
+    def _write_resource_data(self, resource: Resource):
+        ext = resource.filename.rsplit(".", 1)[-1]
+        relpath = f"resources/{resource.id}.{ext}"
+        if resource.location is None:
+            self.store.write_bin(relpath, resource.data)
+            return
+        src_path, offset, size = resource.location
+        if offset == 0 and size == os.path.getsize(src_path):
+            self.store.write_file(relpath, src_path)
+            return
+        with open(src_path, "rb") as fh:
+            fh.seek(offset)
+            self.store.write_fileobj(relpath, fh, size)
+
+
+class BoostnoteWriter:
+    """
+    Write a stream of records into a Boost Note collection, through a
+    BoostnoteBulkWriter.
+
+    Attachments are stored in the directory of the note owning them, or in one
+    named after the resource if they have no single owner.
+    """
+
+    needs_resource_owners = True
+
+    def __init__(
+        self,
+        col: boostnote.BoostnoteCollection,
+        link: Optional[str] = None,
+        max_workers: Optional[int] = None,
+        spill_threshold: Optional[int] = ID_MAP_SPILL_THRESHOLD,
+    ):
+        self.col = col
+        self.link = link
+        self.ids = BoostnoteIds()
+        self._bulk_writer = col.bulk_writer(max_workers)
+        self._tag_names = {}
+        # Paths of the attachments written so far, by resource ID
+        self._attachment_paths = IdMap(spill_threshold)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            self._bulk_writer.__exit__(exc_type, exc, tb)
+        finally:
+            self._attachment_paths.close()
+
+    def _replace_link(self, m: re.Match) -> str:
+        target_id = m.group(2)
+        relpath = self._attachment_paths.get(target_id)
+        if relpath is None:
+            return f"[{m.group(1)}](:note:{target_id})"
+        return f"[{m.group(1)}](:storage/{relpath})"
+
+    def write(self, record: Record):
+        if isinstance(record, Folder):
+            self.col.meta.add_folder(record.id, "#FFFFFF", record.name)
+        elif isinstance(record, Tag):
+            self._tag_names[record.id] = record.name
+        elif isinstance(record, Resource):
+            relpath = os.path.join(record.owner_id or record.id, record.filename)
+            self._attachment_paths[record.id] = relpath
+            if record.location is None:
+                self._bulk_writer.add_attachment(relpath, record.data)
+            else:
+                src_path, offset, size = record.location
+                self._bulk_writer.add_attachment_from(
+                    relpath, src_path, offset, size, self.link
+                )
+        else:
+            self._bulk_writer.add_entity(
+                boostnote.BoostnoteNote(
+                    id=record.id,
+                    created_at=record.created_at,
+                    updated_at=record.updated_at,
+                    title=record.title,
+                    folder_id=record.folder_id,
+                    tags=[self._tag_names.get(t, t) for t in record.tags],
+                    is_starred=False,
+                    is_trashed=False,
+                    content=JOPLIN_LINK_PROG.sub(self._replace_link, record.body),
+                )
+            )
+
+
+def open_writer(
+    dst_path: str,
+    to: Optional[str] = None,
+    reproducible: bool = False,
+    link: Optional[str] = None,
+    jobs: Optional[int] = None,
+    spill_threshold: Optional[int] = ID_MAP_SPILL_THRESHOLD,
+) -> Union[JoplinWriter, BoostnoteWriter]:
+    """
+    Open a writer for dst_path.
+
+    :param to: FORMAT_BOOSTNOTE or FORMAT_JEX (default: FORMAT_JEX if dst_path
+        ends in `.jex`)
+    :param reproducible: derive generated IDs from names, as in boost2jex
+    :param link: how a Boost Note output shares attachment data, as in
+        jex2boost
+    :param jobs: threads writing a Boost Note output
+    """
+    if to is None:
+        to = FORMAT_JEX if dst_path.endswith(".jex") else FORMAT_BOOSTNOTE
+    if to == FORMAT_JEX:
+        return JoplinWriter(joplin.JoplinTarWriter(dst_path), reproducible)
+    col = boostnote.BoostnoteCollection.create(dst_path)
+    return BoostnoteWriter(col, link, jobs, spill_threshold)
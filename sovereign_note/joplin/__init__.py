@@ -2,18 +2,39 @@
 import abc
 import datetime
 import enum
+import hashlib
 import io
-import mimetypes
+import json
 import os
+import sqlite3
 import tarfile
+import threading
+import time
+import weakref
 
 # Note: We need to import Counter from typing rather than collections because
 # in Python versions 3.8 and older, collections.Counter raises a TypeError if
 # you use it as a type hint with an argument, e.g. Counter[str]
-from typing import Counter, Iterator, NamedTuple
+from typing import (
+    IO,
+    Callable,
+    Counter,
+    Dict,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+)
+
+from ..util import BulkWriteError, copy_range, hash_stream
 
 JOPLIN_DATE_FORMAT = "%Y-%m-%dT%H:%M:%S.%f%z"
 
+# Bytes read from the end of an item when looking for its headers. The window
+# doubles until the blank line separating the body from the headers is found.
+HEADER_PEEK_SIZE = 4096
+
 
 class JoplinMarkupLanguage(enum.Enum):
     # https://github.com/laurent22/joplin/blob/8063c94ff7133948604e7dc6bf0c13f8402e11ff/packages/renderer/MarkupToHtml.ts#L7
@@ -82,6 +103,36 @@ class JoplinResource(ParsedJoplinNote):
         return self.headers["file_extension"]
 
 
+def _parse_headers(raw_headers: str) -> dict:
+    return {
+        k: v.strip() for k, v in (row.split(":", 1) for row in raw_headers.split("\n"))
+    }
+
+
+def read_joplin_headers(read_range: Callable[[int, int], bytes], size: int) -> dict:
+    """
+    Parse the headers of a serialized item of size bytes, reading only as much
+    of its end as needed rather than the whole body.
+
+    :param read_range: function taking an offset and a count, and returning
+        that many bytes of the item from that offset
+    """
+    window = HEADER_PEEK_SIZE
+    while True:
+        start = max(0, size - window)
+        tail = read_range(start, size - start)
+        # The separator is ASCII, so it can't be part of a multibyte
+        # character cut off at the start of the window
+        sep = tail.rfind(b"\n\n")
+        if sep != -1:
+            tail = tail[sep + 2 :]
+            break
+        if start == 0:
+            break
+        window *= 2
+    return _parse_headers(tail.decode("utf-8"))
+
+
 def parse_joplin_note(content: str) -> ParsedJoplinNote:
     parts = content.rsplit("\n\n", 1)
     if len(parts) == 2:
@@ -89,9 +140,7 @@ def parse_joplin_note(content: str) -> ParsedJoplinNote:
     else:
         raw_body = ""
         raw_headers = parts[0]
-    headers = {
-        k: v.strip() for k, v in (row.split(":", 1) for row in raw_headers.split("\n"))
-    }
+    headers = _parse_headers(raw_headers)
     model_type = _parse_model_type(headers["type_"])
     # TODO If and only if the model type is 'Note', then we also need to parse out the title
     if model_type == JoplinModelType.Folder:
@@ -205,7 +254,12 @@ def joplin_create_note(
     )
 
 
-def joplin_create_resource(id: str, original_name: str) -> ParsedJoplinNote:
+def joplin_create_resource(id: str, original_name: str, size: int) -> ParsedJoplinNote:
+    """Create a resource whose data, in a file of its own, is size bytes long"""
+    # mimetypes reads the system's MIME databases on import, so only load it
+    # when a resource is actually created
+    import mimetypes
+
     extension = original_name.rsplit(".", 1)[-1]
     mime = mimetypes.guess_type(original_name)[0]
     return ParsedJoplinNote(
@@ -222,7 +276,7 @@ def joplin_create_resource(id: str, original_name: str) -> ParsedJoplinNote:
             "encryption_cipher_text": "",
             "encryption_applied": 0,
             "encryption_blob_encrypted": 0,
-            "size": 253631,
+            "size": size,
             "is_shared": 0,
             "share_id": "",
             "type_": JoplinModelType.Resource.value,
@@ -255,28 +309,117 @@ class Store(abc.ABC):
     # Some porcelain methods
     #
 
+    def resource_path(self, resource: JoplinResource) -> str:
+        return os.path.join("resources", f"{resource.id}.{resource.ext}")
+
     def read_resource_bin(self, resource: JoplinResource):
-        return self.read_bin(os.path.join("resources", f"{resource.id}.{resource.ext}"))
+        return self.read_bin(self.resource_path(resource))
+
+    def resource_location(
+        self, resource: JoplinResource
+    ) -> Optional[Tuple[str, int, int]]:
+        """
+        Get the (file path, offset, size) at which a resource's bytes are stored
+        uncompressed on disk, so they can be copied without reading them into
+        memory. Returns None if the store can't tell.
+        """
+        return None
 
     def get_note_by_id(self, joplin_id: str) -> ParsedJoplinNote:
         return parse_joplin_note(self.read(f"{joplin_id}.md"))
 
+    def read_headers(self, relative_path: str) -> dict:
+        """
+        Get the headers of an item. Stores that can read at an offset do so
+        without reading the item's body.
+        """
+        return parse_joplin_note(self.read(relative_path)).headers
+
+    def iter_headers(self) -> Iterator[Tuple[str, dict]]:
+        """
+        Get the path and headers of every item. Stores backed by a database
+        fetch them in batches rather than one item at a time.
+        """
+        for p in self.list():
+            yield p, self.read_headers(p)
+
+    def count_items(self) -> Counter[JoplinModelType]:
+        """Count the items of each type, skipping any that can't be parsed"""
+        c = Counter()
+        for p in self.list():
+            try:
+                n = parse_joplin_note(self.read(p))
+                c.update({n.model_type: 1})
+            except Exception:
+                print(f"Could not parse {p}")
+        return c
+
+    def count_items_fast(self) -> Counter[JoplinModelType]:
+        """
+        Count the items of each type from their headers alone, which stores
+        that can read at an offset get without reading item bodies. Items
+        whose headers can't be parsed are skipped.
+        """
+        c = Counter()
+        for p in self.list():
+            try:
+                c.update({_parse_model_type(self.read_headers(p)["type_"]): 1})
+            except Exception:
+                print(f"Could not parse the headers of {p}")
+        return c
+
+    def iter_resource_sizes(self) -> Iterator[int]:
+        """Get the size of each file of resource data"""
+        for p in self.list("resources/"):
+            yield len(self.read_bin(p))
+
+
+def _file_sizes(dir_path: str) -> Iterator[int]:
+    """Get the sizes of the files in a directory, which may not exist"""
+    if os.path.isdir(dir_path):
+        with os.scandir(dir_path) as entries:
+            for entry in entries:
+                if entry.is_file():
+                    yield entry.stat().st_size
+
 
 class JoplinRawStore(Store):
     def __init__(self, path: str):
         self._path = path
 
     def list(self, relative_path=""):
+        names = sorted(os.listdir(os.path.join(self._path, relative_path)))
+        if not relative_path:
+            # Items are the .md files at the top level, which in a sync target
+            # also holds info.json
+            names = [p for p in names if p.endswith(".md")]
         return [
-            p
-            for p in os.listdir(os.path.join(self._path, relative_path))
-            if os.path.isfile(p)
+            os.path.join(relative_path, p)
+            for p in names
+            if os.path.isfile(os.path.join(self._path, relative_path, p))
         ]
 
+    def resource_location(self, resource: JoplinResource):
+        path = os.path.join(self._path, self.resource_path(resource))
+        return path, 0, os.path.getsize(path)
+
     def read_bin(self, relative_path):
         with open(os.path.join(self._path, relative_path), "rb") as fh:
             return fh.read()
 
+    def iter_resource_sizes(self) -> Iterator[int]:
+        return _file_sizes(os.path.join(self._path, "resources"))
+
+    def read_headers(self, relative_path: str) -> dict:
+        fd = os.open(os.path.join(self._path, relative_path), os.O_RDONLY)
+        try:
+            return read_joplin_headers(
+                lambda offset, count: os.pread(fd, count, offset),
+                os.fstat(fd).st_size,
+            )
+        finally:
+            os.close(fd)
+
     def read(self, relative_path):
         with open(os.path.join(self._path, relative_path)) as fh:
             return fh.read()
@@ -324,6 +467,31 @@ class JoplinTarStore(Store):
     def read(self, relative_path: str) -> str:
         return self.read_bin(relative_path).decode("utf-8")
 
+    def iter_members(
+        self, latest_only: bool = False
+    ) -> Iterator[Tuple[tarfile.TarInfo, IO[bytes]]]:
+        """
+        Stream every regular file in the archive in a single sequential pass.
+
+        Each file handle is only valid until the next member is requested, so
+        callers must finish reading it before advancing the iterator.
+
+        :param latest_only: skip members that a later member of the same name
+            replaces on extraction, as in archives that are appended to. This
+            takes an extra pass over the member headers first.
+        """
+        latest = None
+        if latest_only:
+            with tarfile.open(self._tar_path) as arc:
+                latest = {info.name: info.offset for info in arc.getmembers()}
+        with tarfile.open(self._tar_path, mode="r|*") as arc:
+            for info in arc:
+                if not info.isfile():
+                    continue
+                if latest is not None and latest[info.name] != info.offset:
+                    continue
+                yield info, arc.extractfile(info)
+
     def write(self, relative_path: str, contents: str):
         # create a bytes IO object and calculate its size
         fobj = io.BytesIO(contents.encode("utf-8"))
@@ -357,12 +525,676 @@ class JoplinTarStore(Store):
         arc.close()
 
 
-def store_get_stats(store: Store) -> Counter[JoplinModelType]:
-    c = Counter()
-    for p in store.list():
+class IndexedJoplinTarStore(JoplinTarStore):
+    """
+    A read-only JoplinTarStore that scans the archive's headers once and then
+    reads members directly at their offsets.
+
+    Reads use os.pread on a single file descriptor and so don't share a file
+    position, which makes one instance safe to use from many threads.
+    """
+
+    def __init__(self, tar_path: str):
+        super().__init__(tar_path)
+        self._members: Dict[str, tarfile.TarInfo] = {}
+        with tarfile.TarFile(tar_path, mode="r") as arc:
+            # Iterating only reads headers, seeking past each member's data.
+            # Later members replace earlier ones with the same name, just as
+            # they would on extraction.
+            for info in arc:
+                if info.isfile():
+                    self._members[info.name] = info
+        self._fd = os.open(tar_path, os.O_RDONLY)
+        # Close the descriptor when the store is garbage collected, so that
+        # callers sharing an instance don't have to agree on who closes it
+        self._close = weakref.finalize(self, os.close, self._fd)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def close(self):
+        self._close()
+
+    def member(self, relative_path: str) -> tarfile.TarInfo:
+        """Get the header of a member, including its offset and size"""
         try:
-            n = parse_joplin_note(store.read(p))
-            c.update({n.model_type: 1})
-        except Exception:
-            print(f"Could not parse {p}")
-    return c
+            return self._members[relative_path]
+        except KeyError:
+            raise KeyError(f"filename {relative_path!r} not found") from None
+
+    def list(self, relative_path: str = "") -> Iterator[str]:
+        return list(filter_object_keys(self._members, relative_path))
+
+    def read_bin(self, relative_path: str) -> bytes:
+        info = self.member(relative_path)
+        return self.read_range(info.offset_data, info.size)
+
+    def read_headers(self, relative_path: str) -> dict:
+        info = self.member(relative_path)
+        return read_joplin_headers(
+            lambda offset, count: self.read_range(info.offset_data + offset, count),
+            info.size,
+        )
+
+    def resource_location(self, resource: JoplinResource):
+        info = self.member(self.resource_path(resource))
+        return self._tar_path, info.offset_data, info.size
+
+    def iter_resource_sizes(self) -> Iterator[int]:
+        # The sizes are in the tar headers already read
+        for p in self.list("resources/"):
+            yield self._members[p].size
+
+    def read_range(self, offset: int, size: int) -> bytes:
+        chunks = []
+        while size > 0:
+            chunk = os.pread(self._fd, size, offset)
+            if not chunk:
+                raise EOFError(f"Unexpected end of {self._tar_path}")
+            chunks.append(chunk)
+            offset += len(chunk)
+            size -= len(chunk)
+        return b"".join(chunks)
+
+    def write(self, relative_path: str, contents: str):
+        raise io.UnsupportedOperation("IndexedJoplinTarStore is read-only")
+
+    def write_bin(self, relative_path: str, contents: bytes):
+        raise io.UnsupportedOperation("IndexedJoplinTarStore is read-only")
+
+
+def _format_timestamp(ms: int) -> str:
+    """Format a time in milliseconds since the epoch the way a JEX does"""
+    dt = datetime.datetime.fromtimestamp(ms // 1000, datetime.timezone.utc)
+    return dt.strftime("%Y-%m-%dT%H:%M:%S") + f".{ms % 1000:03d}Z"
+
+
+class JoplinSqliteStore(Store):
+    """
+    A read-only store over a Joplin profile directory: the `database.sqlite`
+    that Joplin desktop keeps its items in, and the `resources` directory
+    beside it holding their data.
+
+    Items are presented just as they would be in a JEX export, as `<id>.md`
+    files in the serialized format, so anything that reads a JEX can read a
+    profile. Lookups by ID use the tables' primary keys, iter_headers and
+    count_items each take one query per table, and neither reads note bodies.
+
+    Each thread gets its own read-only connection, so one instance can be
+    shared by many threads.
+    """
+
+    DATABASE_NAME = "database.sqlite"
+
+    # Tables holding the items a JEX export contains
+    TABLES = {
+        JoplinModelType.Note: "notes",
+        JoplinModelType.Folder: "folders",
+        JoplinModelType.Resource: "resources",
+        JoplinModelType.Tag: "tags",
+        JoplinModelType.NoteTag: "note_tags",
+    }
+
+    # Columns holding times, which the database stores as milliseconds since
+    # the epoch
+    TIME_COLUMNS = {
+        "created_time",
+        "updated_time",
+        "user_created_time",
+        "user_updated_time",
+    }
+
+    # Rows fetched at a time by queries over a whole table
+    BATCH_SIZE = 1000
+
+    def __init__(self, profile_path: str):
+        self._path = profile_path
+        self._db_uri = "file:{}?mode=ro".format(
+            os.path.abspath(os.path.join(profile_path, self.DATABASE_NAME))
+        )
+        self._local = threading.local()
+        # The columns of each table other than the title and body, which make
+        # up the item's serialized body rather than its headers
+        self._header_columns: Dict[JoplinModelType, List[str]] = {}
+        self._model_types: Dict[str, JoplinModelType] = {}
+        for model_type, table in self.TABLES.items():
+            columns = [
+                row[1] for row in self._conn.execute(f"PRAGMA table_info({table})")
+            ]
+            self._header_columns[model_type] = [
+                c for c in columns if c not in ("title", "body")
+            ]
+            for (item_id,) in self._conn.execute(f"SELECT id FROM {table}"):
+                self._model_types[item_id] = model_type
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def close(self):
+        """Close the calling thread's connection to the database"""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    @property
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self._db_uri, uri=True)
+        return conn
+
+    def _select(self, model_type: JoplinModelType, extra=()) -> str:
+        # Column names are quoted, since notes have one called "order"
+        columns = ", ".join(
+            f'"{c}"' for c in (*self._header_columns[model_type], *extra)
+        )
+        return f"SELECT {columns} FROM {self.TABLES[model_type]}"
+
+    def _model_type(self, relative_path: str) -> JoplinModelType:
+        item_id, ext = os.path.splitext(relative_path)
+        model_type = self._model_types.get(item_id) if ext == ".md" else None
+        if model_type is None:
+            raise KeyError(f"filename {relative_path!r} not found")
+        return model_type
+
+    def _fetch_row(
+        self, relative_path: str, model_type: JoplinModelType, extra: tuple = ()
+    ) -> sqlite3.Row:
+        row = self._conn.execute(
+            f"{self._select(model_type, extra)} WHERE id = ?",
+            (relative_path[: -len(".md")],),
+        ).fetchone()
+        if row is None:
+            # Deleted since the store was opened
+            raise KeyError(relative_path)
+        return row
+
+    def _headers(self, model_type: JoplinModelType, row: sqlite3.Row) -> dict:
+        headers = {}
+        for column, value in zip(self._header_columns[model_type], row):
+            if column in self.TIME_COLUMNS and value is not None:
+                value = _format_timestamp(int(value))
+            headers[column] = "" if value is None else str(value)
+        headers["type_"] = str(model_type.value)
+        return headers
+
+    def read_item(self, relative_path: str) -> ParsedJoplinNote:
+        """Read an item without serializing and reparsing it"""
+        model_type = self._model_type(relative_path)
+        if model_type == JoplinModelType.Note:
+            extra = ("title", "body")
+        elif model_type == JoplinModelType.NoteTag:
+            extra = ()
+        else:
+            extra = ("title",)
+        row = self._fetch_row(relative_path, model_type, extra)
+        headers = self._headers(model_type, row)
+        if model_type == JoplinModelType.Note:
+            body = f"{row[-2]}\n\n{row[-1]}"
+        elif model_type == JoplinModelType.NoteTag:
+            body = ""
+        else:
+            body = row[-1]
+        if model_type == JoplinModelType.Folder:
+            return JoplinFolder(body=body, headers=headers)
+        elif model_type == JoplinModelType.Resource:
+            return JoplinResource(body=body, headers=headers)
+        return ParsedJoplinNote(body=body, headers=headers)
+
+    def list(self, relative_path: str = ""):
+        if relative_path:
+            # Resource data is kept in files
+            dir_path = os.path.join(self._path, relative_path)
+            return [
+                os.path.join(relative_path, p)
+                for p in sorted(os.listdir(dir_path))
+                if os.path.isfile(os.path.join(dir_path, p))
+            ]
+        return [f"{item_id}.md" for item_id in sorted(self._model_types)]
+
+    def read_bin(self, relative_path: str) -> bytes:
+        if "/" in relative_path:
+            with open(os.path.join(self._path, relative_path), "rb") as fh:
+                return fh.read()
+        return self.read(relative_path).encode("utf-8")
+
+    def read(self, relative_path: str) -> str:
+        return unparse_joplin_note(self.read_item(relative_path))
+
+    def read_headers(self, relative_path: str) -> dict:
+        model_type = self._model_type(relative_path)
+        row = self._fetch_row(relative_path, model_type)
+        return self._headers(model_type, row)
+
+    def iter_headers(self) -> Iterator[Tuple[str, dict]]:
+        for model_type in self.TABLES:
+            cursor = self._conn.execute(f"{self._select(model_type)} ORDER BY id")
+            while True:
+                rows = cursor.fetchmany(self.BATCH_SIZE)
+                if not rows:
+                    break
+                for row in rows:
+                    headers = self._headers(model_type, row)
+                    yield f"{headers['id']}.md", headers
+
+    def count_items(self) -> Counter[JoplinModelType]:
+        c = Counter()
+        for model_type, table in self.TABLES.items():
+            (n,) = self._conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()
+            if n:
+                c[model_type] = n
+        return c
+
+    def count_items_fast(self) -> Counter[JoplinModelType]:
+        return self.count_items()
+
+    def iter_resource_sizes(self) -> Iterator[int]:
+        return _file_sizes(os.path.join(self._path, "resources"))
+
+    def get_note_by_id(self, joplin_id: str) -> ParsedJoplinNote:
+        return self.read_item(f"{joplin_id}.md")
+
+    def resource_location(self, resource: JoplinResource):
+        path = os.path.join(self._path, self.resource_path(resource))
+        return path, 0, os.path.getsize(path)
+
+    def write(self, relative_path: str, contents: str):
+        raise io.UnsupportedOperation("JoplinSqliteStore is read-only")
+
+    def write_bin(self, relative_path: str, contents: bytes):
+        raise io.UnsupportedOperation("JoplinSqliteStore is read-only")
+
+
+class JoplinTarWriter:
+    """
+    Write a JEX archive while keeping it open.
+
+    JoplinTarStore.write reopens the archive in append mode for every item,
+    which rescans everything written so far. This writer appends each item in
+    constant time instead, and can report a checkpoint: an offset up to which
+    the archive is known to be durably written. Passing that offset back in
+    truncates anything written after it and continues from there.
+    """
+
+    def __init__(self, tar_path: str, offset: Optional[int] = None):
+        self._tar_path = tar_path
+        if offset is None:
+            self._fh = open(tar_path, "wb")
+        else:
+            self._fh = open(tar_path, "r+b")
+            self._fh.truncate(offset)
+            self._fh.seek(offset)
+        # In "w" mode, TarFile starts writing at the file object's position
+        self._arc = tarfile.TarFile(fileobj=self._fh, mode="w")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    @staticmethod
+    def _member_info(relative_path: str, size: int) -> tarfile.TarInfo:
+        # Every member gets the same metadata, so the archive's bytes depend
+        # only on what is written to it
+        info = tarfile.TarInfo(name=relative_path)
+        info.size = size
+        info.mtime = 0
+        info.mode = 0o644
+        info.uid = info.gid = 0
+        info.uname = info.gname = ""
+        return info
+
+    def write_fileobj(self, relative_path: str, fobj: IO[bytes], size: int):
+        """Copy size bytes from fobj into the archive without buffering them"""
+        self._arc.addfile(self._member_info(relative_path, size), fobj)
+
+    def write_file(self, relative_path: str, src_path: str):
+        """
+        Copy a whole file into the archive. The data is copied in the kernel
+        where possible rather than passing through Python.
+        """
+        with open(src_path, "rb") as src:
+            info = self._member_info(relative_path, os.fstat(src.fileno()).st_size)
+            # This mirrors TarFile.addfile, except for how the data is copied
+            header = info.tobuf(self._arc.format, self._arc.encoding, self._arc.errors)
+            self._fh.write(header)
+            self._fh.flush()
+            data_offset = self._arc.offset + len(header)
+            copy_range(src.fileno(), 0, info.size, self._fh.fileno(), data_offset)
+            self._fh.seek(data_offset + info.size)
+            blocks, remainder = divmod(info.size, tarfile.BLOCKSIZE)
+            if remainder:
+                self._fh.write(tarfile.NUL * (tarfile.BLOCKSIZE - remainder))
+                blocks += 1
+            self._arc.offset = data_offset + blocks * tarfile.BLOCKSIZE
+            self._arc.members.append(info)
+
+    def write(self, relative_path: str, contents: str):
+        self.write_bin(relative_path, contents.encode("utf-8"))
+
+    def write_bin(self, relative_path: str, contents: bytes):
+        self.write_fileobj(relative_path, io.BytesIO(contents), len(contents))
+
+    def checkpoint(self) -> int:
+        """Flush everything written so far to disk and return its end offset"""
+        self._fh.flush()
+        os.fsync(self._fh.fileno())
+        return self._arc.offset
+
+    def close(self):
+        # Closing the TarFile writes the end-of-archive marker
+        self._arc.close()
+        self._fh.close()
+
+
+def _bytes_headers(data: bytes) -> dict:
+    """Parse the headers of a serialized item held in memory"""
+    return read_joplin_headers(
+        lambda offset, count: data[offset : offset + count], len(data)
+    )
+
+
+def _updated_time(data: bytes) -> Optional[datetime.datetime]:
+    try:
+        return datetime.datetime.strptime(
+            _bytes_headers(data)["updated_time"], JOPLIN_DATE_FORMAT
+        )
+    except (KeyError, ValueError):
+        return None
+
+
+def _touch_resource(data: bytes, size: int) -> bytes:
+    """
+    Mark a serialized resource as updated now, with data of size bytes, so
+    that Joplin fetches the data again
+    """
+    body, _, raw_headers = data.decode("utf-8").rpartition("\n\n")
+    headers = _parse_headers(raw_headers)
+    now = _format_timestamp(int(time.time() * 1000))
+    headers["updated_time"] = headers["blob_updated_time"] = now
+    headers["size"] = str(size)
+    return unparse_joplin_note(ParsedJoplinNote(body, headers)).encode("utf-8")
+
+
+class JoplinSyncTargetWriter:
+    """
+    Write items into a Joplin filesystem sync target: a directory holding each
+    item as `<id>.md` and the data of each resource as `.resource/<id>`.
+
+    Only items that changed are written. An item is left alone if the target
+    already holds the same bytes, or a copy with a later updated_time, which
+    was edited in Joplin since. The data of a resource is compared by size and
+    hash; if it changed, the resource's updated_time is moved to now so that
+    Joplin fetches the new data. Items already in the target that aren't
+    written again are left in place rather than deleted.
+
+    A new target is given a minimal `info.json`, marking it as an unencrypted
+    target of the sync version this writes, so that Joplin syncs from it
+    rather than treating it as an old target to upgrade. An existing
+    `info.json` is left alone, but a target with encryption enabled is
+    refused, since items are written in plain text.
+
+    Every file is written to a temporary file in the target and renamed into
+    place, so Joplin never sees a partial file, and the data of a resource is
+    in place before the resource itself. Writes run on a thread pool. Failed
+    writes are raised together, in the order they were added, as a
+    BulkWriteError from checkpoint or close.
+    """
+
+    RESOURCE_DIR = ".resource"
+    INFO_NAME = "info.json"
+    # Layout version of the sync targets written by Joplin 2.0 and later
+    SYNC_VERSION = 3
+
+    # How many pending writes may be queued per worker before write blocks
+    PENDING_WRITES_PER_WORKER = 4
+
+    def __init__(self, path: str, max_workers: Optional[int] = None):
+        self._path = path
+        os.makedirs(os.path.join(path, self.RESOURCE_DIR), exist_ok=True)
+        self._write_info()
+        # Only loaded when writing, to keep reading a JEX file quick to start
+        from concurrent.futures import ThreadPoolExecutor
+
+        # Same default as ThreadPoolExecutor: writes are I/O bound
+        max_workers = max_workers or min(32, (os.cpu_count() or 1) + 4)
+        self._executor = ThreadPoolExecutor(max_workers)
+        self._pending = threading.BoundedSemaphore(
+            max_workers * self.PENDING_WRITES_PER_WORKER
+        )
+        self._futures = []
+        # Serialized resources waiting for their data, by ID
+        self._resources: Dict[str, bytes] = {}
+        self._lock = threading.Lock()
+        self.written = 0
+        self.unchanged = 0
+        self.kept = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _submit(self, relative_path: str, fn, *args):
+        self._pending.acquire()
+        future = self._executor.submit(fn, *args)
+        future.add_done_callback(lambda _: self._pending.release())
+        self._futures.append((relative_path, future))
+
+    def _count(self, outcome: str):
+        with self._lock:
+            setattr(self, outcome, getattr(self, outcome) + 1)
+
+    @staticmethod
+    def _replace(path: str, write: Callable[[IO[bytes]], None]):
+        """
+        Write a file with write(fh) to a temporary file beside path, named
+        after the process and thread writing it, and move it to path
+        """
+        tmp_path = os.path.join(
+            os.path.dirname(path),
+            f".{os.path.basename(path)}.{os.getpid()}-{threading.get_ident()}.tmp",
+        )
+        try:
+            with open(tmp_path, "wb") as fh:
+                write(fh)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def _write_info(self):
+        """Mark a new target with its version, and check an existing one"""
+        info_path = os.path.join(self._path, self.INFO_NAME)
+        try:
+            with open(info_path) as fh:
+                info = json.load(fh)
+        except FileNotFoundError:
+            info = {
+                "version": self.SYNC_VERSION,
+                "e2ee": {"value": False, "updatedTime": 0},
+                "activeMasterKeyId": {"value": "", "updatedTime": 0},
+                "masterKeys": [],
+            }
+            data = json.dumps(info, indent=2).encode("utf-8")
+            self._replace(info_path, lambda fh: fh.write(data))
+            return
+        if info.get("e2ee", {}).get("value"):
+            raise ValueError(f"{self._path} is an encrypted sync target")
+
+    def _sync_item(self, item_id: str, data: bytes):
+        path = os.path.join(self._path, f"{item_id}.md")
+        try:
+            with open(path, "rb") as fh:
+                existing = fh.read()
+        except FileNotFoundError:
+            existing = None
+        if existing == data:
+            self._count("unchanged")
+            return
+        if existing is not None:
+            theirs, ours = _updated_time(existing), _updated_time(data)
+            if theirs is not None and ours is not None and theirs > ours:
+                self._count("kept")
+                return
+        self._replace(path, lambda fh: fh.write(data))
+        self._count("written")
+
+    def _sync_resource(
+        self,
+        resource_id: str,
+        item: Optional[bytes],
+        src_path: Optional[str] = None,
+        data: Optional[bytes] = None,
+    ):
+        """
+        Write the data of a resource, from src_path or data, if it changed,
+        and then the resource itself if it was given
+        """
+        path = os.path.join(self._path, self.RESOURCE_DIR, resource_id)
+        size = os.path.getsize(src_path) if data is None else len(data)
+        try:
+            existing_size = os.path.getsize(path)
+        except FileNotFoundError:
+            existing_size = None
+        changed = existing_size != size
+        if not changed:
+            with open(path, "rb") as fh:
+                existing_digest = hash_stream(fh)
+            if data is None:
+                with open(src_path, "rb") as fh:
+                    changed = hash_stream(fh) != existing_digest
+            else:
+                changed = hashlib.sha256(data).hexdigest() != existing_digest
+        if changed:
+            if data is None:
+
+                def write(fh: IO[bytes]):
+                    src_fd = os.open(src_path, os.O_RDONLY)
+                    try:
+                        copy_range(src_fd, 0, size, fh.fileno(), 0)
+                    finally:
+                        os.close(src_fd)
+
+            else:
+
+                def write(fh: IO[bytes]):
+                    fh.write(data)
+
+            self._replace(path, write)
+            self._count("written")
+            if item is not None and existing_size is not None:
+                item = _touch_resource(item, size)
+        else:
+            self._count("unchanged")
+        if item is not None:
+            self._sync_item(resource_id, item)
+
+    def _resource_id(self, relative_path: str) -> str:
+        return os.path.basename(relative_path).split(".", 1)[0]
+
+    def write_file(self, relative_path: str, src_path: str):
+        """Copy a resource's data from a file"""
+        resource_id = self._resource_id(relative_path)
+        self._submit(
+            os.path.join(self.RESOURCE_DIR, resource_id),
+            self._sync_resource,
+            resource_id,
+            self._resources.pop(resource_id, None),
+            src_path,
+        )
+
+    def write(self, relative_path: str, contents: str):
+        self.write_bin(relative_path, contents.encode("utf-8"))
+
+    def write_bin(self, relative_path: str, contents: bytes):
+        """
+        Write an item, as `<id>.md`, or the data of a resource, as
+        `resources/<id>.<ext>` as in a JEX file
+        """
+        if relative_path.startswith("resources/"):
+            resource_id = self._resource_id(relative_path)
+            self._submit(
+                os.path.join(self.RESOURCE_DIR, resource_id),
+                self._sync_resource,
+                resource_id,
+                self._resources.pop(resource_id, None),
+                None,
+                contents,
+            )
+            return
+        item_id = relative_path[: -len(".md")]
+        if _bytes_headers(contents).get("type_") == str(JoplinModelType.Resource.value):
+            # Written along with its data, which comes next
+            self._resources[item_id] = contents
+        else:
+            self._submit(relative_path, self._sync_item, item_id, contents)
+
+    def checkpoint(self) -> int:
+        """
+        Wait for every write so far to finish, raising a BulkWriteError if any
+        failed. The position is always 0, since a sync target is rewritten
+        only where it changed rather than appended to.
+        """
+        futures, self._futures = self._futures, []
+        # exception() waits for each write to finish
+        errors = [
+            (path, future.exception())
+            for path, future in futures
+            if future.exception() is not None
+        ]
+        if errors:
+            raise BulkWriteError(errors) from errors[0][1]
+        return 0
+
+    def close(self):
+        # Resources whose data never came
+        for resource_id, item in self._resources.items():
+            self._submit(f"{resource_id}.md", self._sync_item, resource_id, item)
+        self._resources = {}
+        try:
+            self.checkpoint()
+        finally:
+            self._executor.shutdown(wait=True)
+
+
+class FastStats(NamedTuple):
+    counts: Counter[JoplinModelType]
+    resource_files: int
+    resource_bytes: int
+
+
+def store_get_stats(store: Store) -> Counter[JoplinModelType]:
+    return store.count_items()
+
+
+def store_get_fast_stats(store: Store) -> FastStats:
+    """
+    Get statistics from metadata alone: item types from their headers, and
+    the number and total size of resource files from the store's listing
+    (the tar headers, for a JEX file)
+    """
+    sizes = list(store.iter_resource_sizes())
+    return FastStats(store.count_items_fast(), len(sizes), sum(sizes))
+
+
+def open_store(path: str) -> Store:
+    """
+    Open a JEX file, a directory holding an extracted JEX (a Joplin "raw"
+    export) or a Joplin profile directory for reading
+    """
+    if os.path.exists(os.path.join(path, JoplinSqliteStore.DATABASE_NAME)):
+        return JoplinSqliteStore(path)
+    if os.path.isdir(path):
+        return JoplinRawStore(path)
+    return IndexedJoplinTarStore(path)
@@ -0,0 +1,137 @@
+"""
+Progress journal for resumable conversions.
+
+A journal is an append-only file of JSON lines. Each line is a checkpoint that
+records the items emitted since the previous checkpoint, the phases finished so
+far, and the offset up to which the output is durably written. A line is only
+appended after the output has been flushed to that offset, so replaying every
+complete line gives a consistent picture of the finished work.
+"""
+import json
+import os
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Set
+
+
+@dataclass
+class JournalState:
+    """
+    offset: size of the durably written output, or None if nothing was written
+    phases: names of the phases that have completed
+    items: per-phase record of what was emitted. Each phase maps either to a
+        dict (e.g. tag name to tag ID) or to a set of IDs.
+    """
+
+    offset: Optional[int] = None
+    phases: Set[str] = field(default_factory=set)
+    items: Dict[str, object] = field(default_factory=dict)
+
+    def done(self, phase: str) -> Set[str]:
+        """Get the set of item keys already emitted in phase"""
+        return set(self.items.get(phase, ()))
+
+    def mapping(self, phase: str) -> dict:
+        """Get the mapping recorded for phase"""
+        return dict(self.items.get(phase, {}))
+
+
+class ConversionJournal:
+    def __init__(self, path: str):
+        self.path = path
+        self.state = JournalState()
+        # items emitted since the last checkpoint
+        self._pending: Dict[str, object] = {}
+
+    @classmethod
+    def create(cls, path: str) -> "ConversionJournal":
+        """Start a new journal, discarding any previous one at path"""
+        self = cls(path)
+        with open(path, "w"):
+            pass
+        return self
+
+    @classmethod
+    def load(cls, path: str) -> "ConversionJournal":
+        """
+        Replay an existing journal. A torn last line, left by a crash in the
+        middle of a write, is ignored.
+        """
+        self = cls(path)
+        with open(path) as fh:
+            lines = fh.read().split("\n")
+        valid_length = 0
+        for line in lines[:-1]:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                break
+            self._apply(entry)
+            valid_length += len(line) + 1
+        # Drop the torn line so that later checkpoints start on a fresh line
+        with open(path, "r+") as fh:
+            fh.truncate(valid_length)
+        return self
+
+    def _apply(self, entry: dict):
+        self.state.offset = entry["offset"]
+        self.state.phases.update(entry.get("phases", []))
+        for phase, items in entry.get("items", {}).items():
+            if isinstance(items, dict):
+                self.state.items.setdefault(phase, {}).update(items)
+            else:
+                self.state.items.setdefault(phase, set()).update(items)
+
+    def record(self, phase: str, key: str, value: Optional[str] = None):
+        """
+        Note that an item was emitted. It becomes part of the journal at the
+        next checkpoint.
+        """
+        if value is None:
+            self._pending.setdefault(phase, []).append(key)
+        else:
+            self._pending.setdefault(phase, {})[key] = value
+
+    @property
+    def pending(self) -> int:
+        return sum(len(items) for items in self._pending.values())
+
+    def checkpoint(self, offset: int, finished_phases: List[str] = ()):
+        """
+        Durably record every pending item, along with any finished phases,
+        as written up to offset.
+        """
+        entry = {"offset": offset, "phases": list(finished_phases)}
+        if self._pending:
+            entry["items"] = self._pending
+        with open(self.path, "a") as fh:
+            fh.write(json.dumps(entry) + "\n")
+            fh.flush()
+            os.fsync(fh.fileno())
+        # Items are only replayed into the state on load. A running conversion
+        # holds its own copy of whatever it needs, so keeping every item here
+        # too would double its memory use.
+        self.state.offset = offset
+        self.state.phases.update(finished_phases)
+        self._pending = {}
+
+    def remove(self):
+        os.remove(self.path)
+
+
+class NullJournal(ConversionJournal):
+    """
+    A journal that keeps only the finished phases and writes nothing, for
+    conversions that won't be resumed
+    """
+
+    def __init__(self):
+        super().__init__(os.devnull)
+
+    def record(self, phase: str, key: str, value: Optional[str] = None):
+        pass
+
+    def checkpoint(self, offset: int, finished_phases: List[str] = ()):
+        self.state.phases.update(finished_phases)
+
+    def remove(self):
+        pass
@@ -0,0 +1,291 @@
+"""
+Persistent index of the links between the notes and attachments of a vault.
+
+The index is an SQLite database, by default next to the vault at
+`<vault>.links.sqlite`. It holds every note and attachment, and every link,
+with the links indexed both by their source and by their target. Looking up
+what a note links to, what links to it, or which items nothing links to is
+then a single indexed query, however large the vault.
+
+Each item is stored with a signature that changes whenever the item does: the
+modification time and size of a Boost Note file, or the size and update time
+of a Joplin item. Refreshing the index compares signatures and only re-reads
+the items that were added or changed, dropping those that were removed.
+"""
+import json
+import os
+import sqlite3
+from dataclasses import asdict, dataclass
+from typing import Callable, Iterable, List, Optional, Tuple
+
+from . import boostnote, joplin
+from .convert_boostnote_to_jex import (
+    BOOSTNOTE_NOTE_LINK_PROG,
+    BOOSTNOTE_STORAGE_LINK_PROG,
+)
+from .convert_jex_to_boostnote import JOPLIN_LINK_PROG
+
+NOTE = "note"
+ATTACHMENT = "attachment"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS items (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    title TEXT NOT NULL,
+    signature TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS links (
+    source TEXT NOT NULL,
+    target TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS links_by_source ON links (source);
+CREATE INDEX IF NOT EXISTS links_by_target ON links (target);
+"""
+
+
+@dataclass
+class IndexedItem:
+    """
+    An item in the index. kind is None for the target of a link to an item
+    that doesn't exist.
+    """
+
+    id: str
+    kind: Optional[str]
+    title: str
+
+
+@dataclass
+class ItemEntry:
+    """
+    An item found while scanning a vault. Its title and links are only read,
+    with read(), if its signature differs from the one in the index.
+    """
+
+    id: str
+    kind: str
+    signature: str
+    read: Callable[[], Tuple[str, List[str]]]
+
+
+def default_index_path(vault_path: str) -> str:
+    return f"{os.path.normpath(vault_path)}.links.sqlite"
+
+
+class LinkGraph:
+    """A link-graph index, stored in an SQLite database at path"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._db = sqlite3.connect(path)
+        # Let queries run while another process refreshes the index
+        self._db.execute("PRAGMA journal_mode = WAL")
+        self._db.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def close(self):
+        self._db.close()
+
+    def __len__(self) -> int:
+        return self._db.execute("SELECT COUNT(*) FROM items").fetchone()[0]
+
+    def update(self, entries: Iterable[ItemEntry]) -> Tuple[int, int]:
+        """
+        Bring the index up to date with a full listing of the vault's items,
+        in a single transaction. Returns how many items were (re)indexed and
+        how many were removed.
+        """
+        signatures = dict(self._db.execute("SELECT id, signature FROM items"))
+        updated = 0
+        with self._db:
+            for entry in entries:
+                if signatures.pop(entry.id, None) == entry.signature:
+                    continue
+                title, targets = entry.read()
+                self._db.execute("DELETE FROM links WHERE source = ?", (entry.id,))
+                self._db.execute(
+                    "INSERT OR REPLACE INTO items VALUES (?, ?, ?, ?)",
+                    (entry.id, entry.kind, title, entry.signature),
+                )
+                self._db.executemany(
+                    "INSERT INTO links VALUES (?, ?)",
+                    ((entry.id, target) for target in targets),
+                )
+                updated += 1
+            # Whatever wasn't listed is gone from the vault
+            removed = [(item_id,) for item_id in signatures]
+            self._db.executemany("DELETE FROM links WHERE source = ?", removed)
+            self._db.executemany("DELETE FROM items WHERE id = ?", removed)
+        return updated, len(removed)
+
+    def get(self, item_id: str) -> Optional[IndexedItem]:
+        row = self._db.execute(
+            "SELECT id, kind, title FROM items WHERE id = ?", (item_id,)
+        ).fetchone()
+        return None if row is None else IndexedItem(*row)
+
+    def _linked(self, query: str, item_id: str) -> List[IndexedItem]:
+        return [
+            IndexedItem(other_id, kind, title or "")
+            for other_id, kind, title in self._db.execute(query, (item_id,))
+        ]
+
+    def links(self, item_id: str) -> List[IndexedItem]:
+        """Get the items an item links to, in the order of its links"""
+        return self._linked(
+            """
+            SELECT links.target, items.kind, items.title
+            FROM links LEFT JOIN items ON items.id = links.target
+            WHERE links.source = ? ORDER BY links.rowid
+            """,
+            item_id,
+        )
+
+    def backlinks(self, item_id: str) -> List[IndexedItem]:
+        """Get the items linking to an item"""
+        return self._linked(
+            """
+            SELECT DISTINCT links.source, items.kind, items.title
+            FROM links JOIN items ON items.id = links.source
+            WHERE links.target = ? ORDER BY links.source
+            """,
+            item_id,
+        )
+
+    def orphans(self, kind: Optional[str] = None) -> List[IndexedItem]:
+        """Get the items, optionally only those of one kind, that nothing links to"""
+        query = """
+            SELECT id, kind, title FROM items
+            WHERE NOT EXISTS (SELECT 1 FROM links WHERE links.target = items.id)
+        """
+        params: tuple = ()
+        if kind is not None:
+            query += " AND kind = ?"
+            params = (kind,)
+        return [
+            IndexedItem(*row)
+            for row in self._db.execute(query + " ORDER BY id", params)
+        ]
+
+
+def scan_boostnote(col: boostnote.BoostnoteCollection) -> Iterable[ItemEntry]:
+    """
+    List the notes and attachments of a Boost Note collection. Notes are
+    identified by their IDs and attachments by their paths within the
+    attachments directory.
+    """
+    for attachment in col.get_attachments():
+        relpath = os.path.normpath(attachment.relative_path)
+        st = os.stat(col.attachment_path(attachment))
+        yield ItemEntry(
+            relpath,
+            ATTACHMENT,
+            f"{st.st_mtime_ns}:{st.st_size}",
+            lambda filename=attachment.filename: (filename, []),
+        )
+
+    def read_note(note_path: str) -> Tuple[str, List[str]]:
+        # Links and the title are found in the raw text, without parsing it
+        with open(note_path) as fh:
+            text = fh.read()
+        title = boostnote.scan_entity_keys(text, ("title",)).get("title", "")
+        targets = [m.group(2) for m in BOOSTNOTE_NOTE_LINK_PROG.finditer(text)]
+        targets.extend(
+            os.path.normpath(m.group(2))
+            for m in BOOSTNOTE_STORAGE_LINK_PROG.finditer(text)
+        )
+        return title, targets
+
+    for note_path in col.get_entity_paths():
+        st = os.stat(note_path)
+        yield ItemEntry(
+            os.path.basename(note_path).rsplit(".", 1)[0],
+            NOTE,
+            f"{st.st_mtime_ns}:{st.st_size}",
+            lambda note_path=note_path: read_note(note_path),
+        )
+
+
+def scan_joplin(store: joplin.Store) -> Iterable[ItemEntry]:
+    """
+    List the notes and resources of a Joplin store, by the headers alone
+    where the store supports it
+    """
+
+    def read_item(p: str) -> Tuple[str, List[str]]:
+        item = joplin.parse_joplin_note(store.read(p))
+        if item.model_type == joplin.JoplinModelType.Resource:
+            return item.body, []
+        title, _, body = item.body.partition("\n\n")
+        return title, [m.group(2) for m in JOPLIN_LINK_PROG.finditer(body)]
+
+    kinds = {
+        joplin.JoplinModelType.Note: NOTE,
+        joplin.JoplinModelType.Resource: ATTACHMENT,
+    }
+    for p, headers in store.iter_headers():
+        kind = kinds.get(joplin.JoplinModelType(int(headers["type_"])))
+        if kind is None:
+            continue
+        yield ItemEntry(
+            headers["id"],
+            kind,
+            f"{headers.get('size', '')}:{headers.get('updated_time', '')}",
+            lambda p=p: read_item(p),
+        )
+
+
+def scan(vault_path: str) -> Iterable[ItemEntry]:
+    if os.path.exists(os.path.join(vault_path, "boostnote.json")):
+        return scan_boostnote(boostnote.BoostnoteCollection.from_dir(vault_path))
+    return scan_joplin(joplin.open_store(vault_path))
+
+
+def open_index(
+    vault_path: str, index_path: Optional[str] = None, refresh: bool = False
+) -> LinkGraph:
+    """
+    Open the index of a vault, building it if it doesn't exist yet, and
+    bringing it up to date with the vault if refresh is set
+    """
+    index_path = index_path or default_index_path(vault_path)
+    exists = os.path.exists(index_path)
+    graph = LinkGraph(index_path)
+    if refresh or not exists:
+        updated, removed = graph.update(scan(vault_path))
+        print(f"Indexed {updated} items and removed {removed} from {index_path}")
+    return graph
+
+
+def main(
+    vault_path: str,
+    item_id: Optional[str] = None,
+    orphans: bool = False,
+    refresh: bool = False,
+    index_path: Optional[str] = None,
+) -> Optional[dict]:
+    """
+    Print, as JSON, what an item links to and what links to it, or which
+    items nothing links to. Returns None if there is no item with item_id.
+    """
+    with open_index(vault_path, index_path, refresh) as graph:
+        if orphans:
+            result = {"orphans": [asdict(item) for item in graph.orphans()]}
+        else:
+            item = graph.get(item_id)
+            if item is None:
+                print(f"No note or attachment with ID {item_id}")
+                return None
+            result = {
+                **asdict(item),
+                "links": [asdict(i) for i in graph.links(item_id)],
+                "backlinks": [asdict(i) for i in graph.backlinks(item_id)],
+            }
+    print(json.dumps(result, indent=2))
+    return result
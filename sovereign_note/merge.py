@@ -0,0 +1,181 @@
+"""
+Merge several vaults into one.
+
+Each input is streamed through the intermediate representation (see ir), and
+then through a stage that resolves collisions with the inputs before it:
+
+- Folders and tags with the same name as one in an earlier input are merged
+  into the first one seen. Folders or tags that share a name within a single
+  input are kept apart, as they were in that input.
+- Any other item whose ID was already used by an earlier input gets a new ID,
+  and every reference to it from its own input, including links in notes, is
+  updated to match.
+
+Whether an ID collides depends only on the inputs before it, so the new ID of
+a note can be settled the first time the note is seen, even if that is as the
+target of a link from an earlier note in the same input. Only IDs and names
+are remembered, in maps that move to disk once they grow large, so memory use
+depends on the number of items rather than the size of the vaults.
+"""
+import dataclasses
+from typing import Iterable, Iterator, List, Optional
+
+from . import ir
+from .convert_boostnote_to_jex import new_uuid
+from .idmap import IdMap
+from .options import ID_MAP_SPILL_THRESHOLD
+
+
+class MergeState:
+    """What the inputs merged so far have used: their IDs and names"""
+
+    def __init__(
+        self,
+        ids: ir.IdScheme,
+        reproducible: bool = False,
+        spill_threshold: Optional[int] = ID_MAP_SPILL_THRESHOLD,
+    ):
+        self.ids = ids
+        self.reproducible = reproducible
+        self.spill_threshold = spill_threshold
+        # IDs used by earlier inputs
+        self.used_ids = IdMap(spill_threshold)
+        self.folder_ids_by_name = IdMap(spill_threshold)
+        self.tag_ids_by_name = IdMap(spill_threshold)
+        self.remapped = 0
+        self.merged = 0
+
+    def close(self):
+        for id_map in (self.used_ids, self.folder_ids_by_name, self.tag_ids_by_name):
+            id_map.close()
+
+
+def resolve_collisions(
+    records: Iterable[ir.Record], state: MergeState, input_index: int
+) -> Iterator[ir.Record]:
+    """
+    Give the records of one input, already mapped to the output's IDs, new
+    IDs wherever they collide with an earlier input, and merge its folders
+    and tags into earlier ones with the same names
+    """
+    # New IDs for this input's items, by the ID they had in the input
+    remapped = IdMap(state.spill_threshold)
+    # IDs this input uses, which later inputs must not reuse
+    used_ids = IdMap(state.spill_threshold)
+    # Folder and tag names this input uses, which later inputs merge into
+    folder_ids_by_name = IdMap(state.spill_threshold)
+    tag_ids_by_name = IdMap(state.spill_threshold)
+
+    def remap(item_id: str, is_note: bool = False) -> str:
+        new_id = remapped.get(item_id)
+        if new_id is not None:
+            return new_id
+        if item_id not in state.used_ids:
+            return item_id
+        new_id = new_uuid(state.reproducible, "merge", str(input_index), item_id).hex
+        if is_note:
+            new_id = state.ids.note_id(new_id)
+        remapped[item_id] = new_id
+        state.remapped += 1
+        return new_id
+
+    def merge_named(record, ids_by_name: IdMap) -> bool:
+        """Merge a folder or tag into one of the same name in an earlier input"""
+        existing_id = ids_by_name.get(record.name)
+        if existing_id is None:
+            return False
+        if existing_id != record.id:
+            remapped[record.id] = existing_id
+        state.merged += 1
+        return True
+
+    def resolve_link(target_id: str) -> str:
+        # Resources come before notes, so any target not yet remapped that
+        # collides is a note
+        return remap(target_id, is_note=True)
+
+    try:
+        for record in records:
+            if isinstance(record, (ir.Folder, ir.Tag)):
+                if isinstance(record, ir.Folder):
+                    earlier, ids_by_name = state.folder_ids_by_name, folder_ids_by_name
+                else:
+                    earlier, ids_by_name = state.tag_ids_by_name, tag_ids_by_name
+                if merge_named(record, earlier):
+                    continue
+                record = dataclasses.replace(record, id=remap(record.id))
+                if record.name not in ids_by_name:
+                    ids_by_name[record.name] = record.id
+            elif isinstance(record, ir.Resource):
+                owner_id = record.owner_id and remap(record.owner_id, is_note=True)
+                record = dataclasses.replace(
+                    record, id=remap(record.id), owner_id=owner_id
+                )
+            else:
+                record = dataclasses.replace(
+                    record,
+                    id=remap(record.id, is_note=True),
+                    body=ir.rewrite_links(record.body, resolve_link),
+                    folder_id=remapped.get(record.folder_id, record.folder_id),
+                    tags=[remapped.get(t, t) for t in record.tags],
+                )
+            used_ids[record.id] = ""
+            yield record
+        # Only now do this input's IDs and names become off limits, so that
+        # references within it to its own items are left alone
+        state.used_ids.update(used_ids)
+        state.folder_ids_by_name.update(folder_ids_by_name)
+        state.tag_ids_by_name.update(tag_ids_by_name)
+    finally:
+        for id_map in (remapped, used_ids, folder_ids_by_name, tag_ids_by_name):
+            id_map.close()
+
+
+def merge(
+    input_paths: List[str],
+    output_path: str,
+    to: Optional[str] = None,
+    reproducible: bool = False,
+    link: Optional[str] = None,
+    jobs: Optional[int] = None,
+    spill_threshold: Optional[int] = ID_MAP_SPILL_THRESHOLD,
+) -> MergeState:
+    """
+    Merge Boost Note directories, JEX files, extracted JEX directories and
+    Joplin profiles into a single output, in one streaming pass over each.
+    Merging a single input normalizes it, in either format. See ir.open_writer
+    for the parameters.
+    """
+    writer = ir.open_writer(output_path, to, reproducible, link, jobs, spill_threshold)
+    state = MergeState(writer.ids, reproducible, spill_threshold)
+    try:
+        with writer:
+            for input_index, input_path in enumerate(input_paths):
+                print(f"Merging {input_path}")
+                records = ir.read(
+                    input_path, writer.needs_resource_owners, spill_threshold
+                )
+                mapped = ir.map_ids(records, writer.ids, spill_threshold)
+                for record in resolve_collisions(mapped, state, input_index):
+                    writer.write(record)
+    finally:
+        state.close()
+    return state
+
+
+def main(
+    input_paths: List[str],
+    output_path: str,
+    to: Optional[str] = None,
+    reproducible: bool = False,
+    link: Optional[str] = None,
+    jobs: Optional[int] = None,
+    spill_threshold: Optional[int] = ID_MAP_SPILL_THRESHOLD,
+):
+    state = merge(
+        input_paths, output_path, to, reproducible, link, jobs, spill_threshold
+    )
+    print(
+        f"Merged {len(input_paths)} vaults into {output_path}: "
+        f"{state.remapped} IDs remapped, {state.merged} folders and tags merged"
+    )
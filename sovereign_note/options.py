@@ -0,0 +1,30 @@
+"""
+Defaults and choices shared by the command line interface and the modules it
+dispatches to.
+
+This module must not import anything: the CLI builds its argument parser from
+these values without loading the (much slower to import) commands themselves.
+"""
+
+# convert_boostnote_to_jex: items written between checkpoints when journaling
+CHECKPOINT_EVERY = 100
+
+# util.link_or_copy: ways to share a file's data instead of copying it
+LINK_HARDLINK = "hardlink"
+LINK_REFLINK = "reflink"
+
+# watch: seconds to wait for changes to settle before converting
+DEBOUNCE = 1.0
+# watch: seconds between scans when inotify is not available
+POLL_INTERVAL = 2.0
+
+# server: where to listen by default
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8737
+
+# idmap: entries an ID map holds in memory before moving to a temporary file
+ID_MAP_SPILL_THRESHOLD = 1_000_000
+
+# ir: formats that can be converted between
+FORMAT_BOOSTNOTE = "boostnote"
+FORMAT_JEX = "jex"
@@ -0,0 +1,310 @@
+"""
+Long-lived conversion service.
+
+Serves stats, conversions and single-note lookups over HTTP, on either a
+localhost port or a Unix socket. The vaults opened for stats and lookups are
+cached and reused until their modification times change, so repeated queries
+skip both Python startup and re-reading the vault; checking for changes still
+stats each note file. Conversions always read the vault afresh.
+
+Endpoints (all responses are JSON):
+
+- ``GET /stats?path=PATH``
+- ``GET /note?path=PATH&id=ID``
+- ``POST /convert`` with a JSON body (``Content-Type: application/json``) of
+  ``{"command": "boost2jex" | "jex2boost", "path": PATH, "output": OUTPUT}``.
+  OUTPUT must be inside the output root the server was started with.
+
+Over TCP, requests whose Host header doesn't name the address the server is
+bound to are refused, so that web pages can't reach the server through DNS
+rebinding.
+"""
+import ipaddress
+import json
+import os
+import socketserver
+import stat
+import threading
+from contextlib import suppress
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Optional, Set, Tuple
+from urllib.parse import parse_qs, urlparse
+
+from . import boostnote
+from . import convert_boostnote_to_jex as boost2jex
+from . import convert_jex_to_boostnote as jex2boost
+from . import joplin
+from .options import DEFAULT_HOST, DEFAULT_PORT
+
+
+def vault_signature(path: str) -> tuple:
+    """
+    Summarize the modification times of everything a vault is read from. The
+    cached copy of a vault is reused for as long as this doesn't change.
+    """
+    if not os.path.isdir(path):
+        st = os.stat(path)
+        return (st.st_mtime_ns, st.st_size)
+    signature = [os.stat(os.path.join(path, "boostnote.json")).st_mtime_ns]
+    for subdir in ("notes", "attachments"):
+        subdir_path = os.path.join(path, subdir)
+        if not os.path.isdir(subdir_path):
+            continue
+        # A directory's mtime changes when entries are added or removed, but
+        # not when a note is edited in place, so the notes themselves are
+        # checked too.
+        signature.append(os.stat(subdir_path).st_mtime_ns)
+        if subdir == "notes":
+            with os.scandir(subdir_path) as entries:
+                signature.append(
+                    max((e.stat().st_mtime_ns for e in entries), default=0)
+                )
+    return tuple(signature)
+
+
+class CachedVault:
+    """An opened vault along with lazily computed results about it"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.is_boostnote = os.path.isdir(path)
+        if self.is_boostnote:
+            self.vault = boostnote.BoostnoteCollection.from_dir(path)
+        else:
+            self.vault = joplin.IndexedJoplinTarStore(path)
+        self._lock = threading.Lock()
+        self._results: Dict[str, object] = {}
+
+    def _memoize(self, key: str, compute: Callable[[], object]):
+        with self._lock:
+            if key not in self._results:
+                self._results[key] = compute()
+            return self._results[key]
+
+    def stats(self) -> dict:
+        if self.is_boostnote:
+            return dict(self._memoize("stats", self.vault.stats))
+        counts = self._memoize("stats", lambda: joplin.store_get_stats(self.vault))
+        return {model_type.name: n for model_type, n in counts.items()}
+
+    def _boostnote_paths(self) -> Dict[str, str]:
+        return {
+            os.path.basename(p).rsplit(".", 1)[0]: p
+            for p in self.vault.get_entity_paths()
+        }
+
+    def note(self, note_id: str) -> Optional[dict]:
+        if self.is_boostnote:
+            note_path = self._memoize("paths", self._boostnote_paths).get(note_id)
+            if note_path is None:
+                return None
+            entity = self.vault.read_entity(note_path)
+            if isinstance(entity, boostnote.BoostnoteNote):
+                return boostnote.BoostnoteCollection._serialize_entity(entity)
+            return None
+        try:
+            item = self.vault.get_note_by_id(note_id)
+        except KeyError:
+            return None
+        return {"headers": item.headers, "body": item.body}
+
+
+class VaultCache:
+    """Opened vaults by path, invalidated whenever a vault changes on disk"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._vaults: Dict[str, Tuple[tuple, CachedVault]] = {}
+
+    def get(self, path: str) -> CachedVault:
+        path = os.path.abspath(path)
+        signature = vault_signature(path)
+        with self._lock:
+            cached = self._vaults.get(path)
+            if cached is not None and cached[0] == signature:
+                return cached[1]
+        vault = CachedVault(path)
+        with self._lock:
+            # Requests still holding a replaced vault keep using it until they
+            # finish, after which it is garbage collected
+            self._vaults[path] = (signature, vault)
+        return vault
+
+
+def allowed_hosts(host: str, port: int) -> Optional[Set[str]]:
+    """
+    Get the Host header values that name a server bound to host and port, or
+    None if it is bound to every interface, in which case any IP address is
+    allowed but no name is
+    """
+    names = {host}
+    with suppress(ValueError):
+        address = ipaddress.ip_address(host)
+        if address.is_unspecified:
+            return None
+        if address.version == 6:
+            names = {f"[{host}]"}
+        if address.is_loopback:
+            names |= {"localhost", "127.0.0.1", "[::1]"}
+    return names | {f"{name}:{port}" for name in names}
+
+
+def is_within(path: str, root: str) -> bool:
+    """Whether path is root or inside it, once symlinks are resolved"""
+    path, root = os.path.realpath(path), os.path.realpath(root)
+    return os.path.commonpath([path, root]) == root
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    server_version = "SovereignNote"
+
+    @property
+    def cache(self) -> VaultCache:
+        return self.server.cache
+
+    def _check_host(self) -> bool:
+        """Refuse the request unless its Host header names this server"""
+        if not isinstance(self.server, TCPServer):
+            return True
+        host, port = self.server.server_address[:2]
+        names = allowed_hosts(host, port)
+        requested = self.headers.get("Host", "")
+        if names is None:
+            if requested.startswith("["):
+                name = requested[1:].split("]", 1)[0]
+            else:
+                name = requested.rsplit(":", 1)[0]
+            with suppress(ValueError):
+                ipaddress.ip_address(name)
+                return True
+        elif requested in names:
+            return True
+        self._send_json(403, {"error": f"Unexpected Host header {requested!r}"})
+        return False
+
+    def address_string(self):
+        # Unix socket clients have no address
+        return str(self.client_address[0]) if self.client_address else "unix"
+
+    def _send_json(self, status: int, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _handle(self, handler: Callable[[], Tuple[int, object]]):
+        try:
+            status, payload = handler()
+        except (FileNotFoundError, KeyError, ValueError) as exc:
+            status, payload = 400, {"error": str(exc)}
+        except Exception as exc:
+            self.log_error("Request failed: %r", exc)
+            status, payload = 500, {"error": str(exc)}
+        self._send_json(status, payload)
+
+    def do_GET(self):
+        if not self._check_host():
+            return
+        url = urlparse(self.path)
+        params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        if url.path == "/stats":
+            self._handle(
+                lambda: (200, {"stats": self.cache.get(params["path"]).stats()})
+            )
+        elif url.path == "/note":
+
+            def get_note():
+                note = self.cache.get(params["path"]).note(params["id"])
+                if note is None:
+                    return 404, {"error": f"No note with ID {params['id']}"}
+                return 200, {"note": note}
+
+            self._handle(get_note)
+        else:
+            self._send_json(404, {"error": f"Unknown endpoint {url.path}"})
+
+    def do_POST(self):
+        if not self._check_host():
+            return
+        url = urlparse(self.path)
+        if url.path != "/convert":
+            self._send_json(404, {"error": f"Unknown endpoint {url.path}"})
+            return
+        content_type = self.headers.get("Content-Type", "").split(";")[0].strip()
+        if content_type != "application/json":
+            # Browsers can only send other content types across origins
+            # without a preflight request
+            self._send_json(415, {"error": "Expected Content-Type application/json"})
+            return
+
+        def convert():
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length) or b"{}")
+            converters = {"boost2jex": boost2jex.main, "jex2boost": jex2boost.main}
+            if request.get("command") not in converters:
+                raise ValueError(f"Unknown command {request.get('command')!r}")
+            if not is_within(request["output"], self.server.output_root):
+                return 403, {
+                    "error": f"{request['output']} is outside the output root "
+                    f"{self.server.output_root}"
+                }
+            converters[request["command"]](request["path"], request["output"])
+            return 200, {"output": request["output"]}
+
+        self._handle(convert)
+
+
+class _CachingServerMixin:
+    daemon_threads = True
+
+    def __init__(self, *args, output_root: str = ".", **kwargs):
+        super().__init__(*args, **kwargs)
+        self.cache = VaultCache()
+        self.output_root = os.path.realpath(output_root)
+
+
+class TCPServer(_CachingServerMixin, ThreadingHTTPServer):
+    pass
+
+
+class UnixServer(_CachingServerMixin, socketserver.ThreadingUnixStreamServer):
+    pass
+
+
+def make_server(
+    host: str = DEFAULT_HOST,
+    port: int = DEFAULT_PORT,
+    socket_path: str = None,
+    output_root: str = ".",
+):
+    """
+    Make a server listening on host and port, or on socket_path if given, that
+    only writes conversions inside output_root
+    """
+    if socket_path:
+        # Clean up a socket left behind by a previous run, but never anything
+        # else that happens to be at that path
+        with suppress(FileNotFoundError):
+            if stat.S_ISSOCK(os.stat(socket_path).st_mode):
+                os.remove(socket_path)
+        return UnixServer(socket_path, RequestHandler, output_root=output_root)
+    return TCPServer((host, port), RequestHandler, output_root=output_root)
+
+
+def main(
+    host: str = DEFAULT_HOST,
+    port: int = DEFAULT_PORT,
+    socket_path: str = None,
+    output_root: str = ".",
+):
+    server = make_server(host, port, socket_path, output_root)
+    where = socket_path or f"http://{host}:{server.server_address[1]}"
+    print(f"Serving on {where}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
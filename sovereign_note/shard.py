@@ -0,0 +1,343 @@
+"""
+Split a Boost Note to JEX conversion into several self-contained JEX shards.
+
+A shard carries every folder, tag and resource that its notes reference, so
+each one can be imported into Joplin on its own. IDs are assigned up front so
+that links between notes in different shards still resolve once all shards
+have been imported.
+"""
+import itertools
+import json
+import os
+import tempfile
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from . import boostnote, joplin
+from .convert_boostnote_to_jex import (
+    BOOSTNOTE_STORAGE_LINK_PROG,
+    attachment_blob_key,
+    boostnote_to_joplin_id,
+    new_uuid,
+    write_attachment,
+    write_folder,
+    write_note,
+    write_tag,
+)
+
+# Top-level keys of a note that shards are planned with
+PLAN_KEYS = ("type", "folder", "tags")
+
+
+@dataclass
+class _NoteInfo:
+    """The parts of a note needed to plan shards, without its body"""
+
+    path: str
+    folder_id: str
+    tags: List[str]
+    attachments: List[str]
+    size: int
+
+
+@dataclass
+class ShardPlan:
+    """
+    path: location of the shard's JEX file
+    note_paths: paths of the Boost Note files converted into this shard
+    """
+
+    path: str
+    note_paths: List[str] = field(default_factory=list)
+    folders: List[str] = field(default_factory=list)
+    tags: List[str] = field(default_factory=list)
+    attachments: List[str] = field(default_factory=list)
+    size: int = 0
+    # The folders, tags and attachments above as sets, for checking what the
+    # shard already holds without scanning the lists
+    _members: Dict[str, Set[str]] = field(
+        default_factory=lambda: {"folders": set(), "tags": set(), "attachments": set()},
+        repr=False,
+        compare=False,
+    )
+
+
+def _read_plan_keys(
+    col: boostnote.BoostnoteCollection, note_path: str
+) -> Optional[Tuple[str, List[str], str]]:
+    """
+    Get a note's folder, tags and raw text, or None if it isn't a markdown
+    note. Its content is only parsed if its top-level keys can't be scanned;
+    otherwise that is left to the workers writing the shards.
+    """
+    with open(note_path) as fh:
+        text = fh.read()
+    keys = boostnote.scan_entity_keys(text, PLAN_KEYS)
+    if all(k in keys for k in PLAN_KEYS):
+        if keys["type"] != boostnote.BoostnoteEntityType.MARKDOWN_NOTE.value:
+            return None
+        return keys["folder"], keys["tags"], text
+    entity = col.read_entity(note_path)
+    if not isinstance(entity, boostnote.BoostnoteNote):
+        return None
+    return entity.folder_id, entity.tags, text
+
+
+def _scan_notes(col: boostnote.BoostnoteCollection) -> List[_NoteInfo]:
+    attachments_by_note = {}
+    attachment_sizes = {}
+    for attachment in col.get_attachments():
+        relpath = os.path.normpath(attachment.relative_path)
+        attachments_by_note.setdefault(relpath.split(os.sep, 1)[0], []).append(relpath)
+        attachment_sizes[relpath] = os.path.getsize(
+            os.path.join(col.dir_path, "attachments", relpath)
+        )
+
+    notes = []
+    for note_path in col.get_entity_paths():
+        try:
+            keys = _read_plan_keys(col, note_path)
+        except Exception:
+            print(f"Bad note: {note_path}")
+            continue
+        if keys is None:
+            continue
+        folder_id, tags, text = keys
+        note_id = os.path.basename(note_path).rsplit(".", 1)[0]
+        # A note owns the attachments stored in its own directory, as well as
+        # any it links to from elsewhere.
+        attachments = set(attachments_by_note.get(note_id, []))
+        for m in BOOSTNOTE_STORAGE_LINK_PROG.finditer(text):
+            relpath = os.path.normpath(m.group(2))
+            if relpath in attachment_sizes:
+                attachments.add(relpath)
+        size = os.path.getsize(note_path)
+        size += sum(attachment_sizes[a] for a in attachments)
+        notes.append(
+            _NoteInfo(
+                path=note_path,
+                folder_id=folder_id,
+                tags=list(tags),
+                attachments=sorted(attachments),
+                size=size,
+            )
+        )
+    return notes
+
+
+def _assign_by_folder(notes: List[_NoteInfo], shards: List[ShardPlan]):
+    """
+    Keep each folder in a single shard, placing the largest folders first into
+    whichever shard is currently the smallest.
+    """
+    folders: Dict[str, List[_NoteInfo]] = {}
+    for note in notes:
+        folders.setdefault(note.folder_id, []).append(note)
+    for folder_notes in sorted(
+        folders.values(), key=lambda ns: sum(n.size for n in ns), reverse=True
+    ):
+        shard = min(shards, key=lambda s: s.size)
+        for note in folder_notes:
+            _add_note(shard, note)
+
+
+def _assign_by_size(notes: List[_NoteInfo], max_bytes: int, make_shard):
+    """
+    Fill shards in folder order, starting a new shard whenever the next note
+    would push the current one past max_bytes.
+    """
+    shards = [make_shard()]
+    for note in sorted(notes, key=lambda n: (n.folder_id, n.path)):
+        if shards[-1].note_paths and shards[-1].size + note.size > max_bytes:
+            shards.append(make_shard())
+        _add_note(shards[-1], note)
+    return shards
+
+
+def _add_note(shard: ShardPlan, note: _NoteInfo):
+    shard.note_paths.append(note.path)
+    shard.size += note.size
+    _add_members(shard, "folders", [note.folder_id])
+    _add_members(shard, "tags", note.tags)
+    _add_members(shard, "attachments", note.attachments)
+
+
+def _add_members(shard: ShardPlan, attr: str, values: Iterable[str]):
+    """Add folders, tags or attachments to a shard, skipping those it holds"""
+    members = shard._members[attr]
+    for value in values:
+        if value not in members:
+            members.add(value)
+            getattr(shard, attr).append(value)
+
+
+def _write_shard(
+    boost_dir_path: str,
+    plan: ShardPlan,
+    map_boostnote_to_joplin: dict,
+    map_attachment_to_joplin_id: dict,
+    tag_name_to_id: dict,
+    reproducible: bool,
+):
+    col = boostnote.BoostnoteCollection.from_dir(boost_dir_path)
+    store = joplin.JoplinTarWriter(plan.path)
+    folder_ids = set(col.meta.list_folder_ids())
+    for folder_id in plan.folders:
+        if folder_id in folder_ids:
+            write_folder(store, folder_id, col.meta.get_folder_name(folder_id))
+    for tag_name in plan.tags:
+        write_tag(store, tag_name_to_id[tag_name], tag_name)
+    map_boostnote_attachment_to_joplin_id = {
+        boostnote.BoostnoteAttachment(relpath): attachment_id
+        for relpath, attachment_id in map_attachment_to_joplin_id.items()
+    }
+    written = set()
+    for relpath in plan.attachments:
+        attachment = boostnote.BoostnoteAttachment(relpath)
+        attachment_id = map_boostnote_attachment_to_joplin_id[attachment]
+        # Copies of a file already in this shard share its resource
+        if attachment_id not in written:
+            write_attachment(store, col, attachment, attachment_id)
+            written.add(attachment_id)
+    for note_path in plan.note_paths:
+        write_note(
+            store,
+            col.read_entity(note_path),
+            map_boostnote_to_joplin,
+            map_boostnote_attachment_to_joplin_id,
+            tag_name_to_id,
+            reproducible=reproducible,
+        )
+    store.close()
+    print(f"Saved shard to {plan.path}")
+
+
+def main(
+    boost_dir_path: str,
+    output_location: Optional[str] = None,
+    shards: Optional[int] = None,
+    max_bytes: Optional[int] = None,
+    jobs: Optional[int] = None,
+    reproducible: bool = False,
+) -> List[ShardPlan]:
+    """
+    Convert a Boost Note directory into several JEX files.
+
+    Pass shards to split by folder into that many files, or max_bytes to split
+    into as many files as needed to keep each under the size budget. A note
+    larger than the budget gets a shard to itself.
+
+    The shards are written next to output_location along with a
+    `.manifest.json` file recording which items went into which shard.
+
+    reproducible derives IDs from names, as for convert_boostnote_to_jex.main.
+    """
+    if (shards is None) == (max_bytes is None):
+        raise ValueError("Exactly one of shards or max_bytes must be given")
+    if not output_location:
+        output_location = os.path.join(tempfile.mkdtemp(), "vault.jex")
+    base, ext = os.path.splitext(output_location)
+    ext = ext or ".jex"
+
+    col = boostnote.BoostnoteCollection.from_dir(boost_dir_path)
+    notes = _scan_notes(col)
+
+    counter = itertools.count(1)
+
+    def make_shard() -> ShardPlan:
+        return ShardPlan(path=f"{base}-{next(counter):03d}{ext}")
+
+    if shards is not None:
+        plans = [make_shard() for _ in range(shards)]
+        _assign_by_folder(notes, plans)
+    else:
+        plans = _assign_by_size(notes, max_bytes, make_shard)
+
+    # Folders without notes and attachments that no note uses still belong
+    # somewhere; put them in the first shard.
+    folder_shards = {f: plan for plan in plans for f in plan.folders}
+    attachment_shards = {a: plan for plan in plans for a in plan.attachments}
+    for folder_id in col.meta.list_folder_ids():
+        if folder_id not in folder_shards:
+            _add_members(plans[0], "folders", [folder_id])
+    # Copies of the same file share a resource, found as boost2jex finds them
+    attachments = list(col.get_attachments())
+    sizes = {a: os.path.getsize(col.attachment_path(a)) for a in attachments}
+    size_counts = Counter(sizes.values())
+    blob_to_joplin_id = {}
+    map_attachment_to_joplin_id = {}
+    for attachment in attachments:
+        relpath = os.path.normpath(attachment.relative_path)
+        blob_key = None
+        if size_counts[sizes[attachment]] > 1:
+            blob_key = attachment_blob_key(col, attachment, sizes[attachment])
+        attachment_id = blob_to_joplin_id.get(blob_key)
+        if attachment_id is None:
+            attachment_id = new_uuid(reproducible, "attachment", relpath).hex
+            if blob_key is not None:
+                blob_to_joplin_id[blob_key] = attachment_id
+        map_attachment_to_joplin_id[relpath] = attachment_id
+        if relpath not in attachment_shards:
+            _add_members(plans[0], "attachments", [relpath])
+
+    plans = [plan for plan in plans if plan.note_paths or plan.folders]
+
+    map_boostnote_to_joplin = {
+        boostnote_id: boostnote_to_joplin_id(boostnote_id, reproducible)
+        for boostnote_id in (
+            os.path.basename(p).rsplit(".", 1)[0] for p in col.get_entity_paths()
+        )
+    }
+    tag_name_to_id = {
+        tag_name: str(new_uuid(reproducible, "tag", tag_name))
+        for tag_name in sorted({t for note in notes for t in note.tags})
+    }
+
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = [
+            executor.submit(
+                _write_shard,
+                boost_dir_path,
+                plan,
+                map_boostnote_to_joplin,
+                map_attachment_to_joplin_id,
+                tag_name_to_id,
+                reproducible,
+            )
+            for plan in plans
+        ]
+        for future in futures:
+            future.result()
+
+    manifest_path = f"{base}.manifest.json"
+    with open(manifest_path, "w") as fh:
+        json.dump(
+            {
+                "shards": [
+                    {
+                        "path": plan.path,
+                        "folders": plan.folders,
+                        "tags": [tag_name_to_id[t] for t in plan.tags],
+                        "resources": list(
+                            dict.fromkeys(
+                                map_attachment_to_joplin_id[a] for a in plan.attachments
+                            )
+                        ),
+                        "notes": [
+                            map_boostnote_to_joplin[
+                                os.path.basename(p).rsplit(".", 1)[0]
+                            ]
+                            for p in plan.note_paths
+                        ],
+                        "size": plan.size,
+                    }
+                    for plan in plans
+                ]
+            },
+            fh,
+            indent=2,
+        )
+    print(f"Saved shard manifest to {manifest_path}")
+    return plans
@@ -1,14 +1,151 @@
+import datetime
+import errno
+import hashlib
 import os
+from typing import IO, List, Optional, Tuple
+
+from .options import LINK_HARDLINK, LINK_REFLINK
+
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows, where reflinks aren't supported anyway
+    fcntl = None
+
+HASH_CHUNK_SIZE = 1024 * 1024
+COPY_CHUNK_SIZE = 1024 * 1024
+
+# ioctl request for cloning a whole file on copy-on-write filesystems (Linux)
+FICLONE = 0x40049409
+
+# Errors meaning "this kind of copy isn't possible here", after which the next
+# strategy is tried
+_UNSUPPORTED_COPY_ERRNOS = {
+    errno.EXDEV,
+    errno.ENOSYS,
+    errno.EINVAL,
+    errno.EOPNOTSUPP,
+    errno.ENOTSUP,
+    errno.EBADF,
+    errno.ENOTTY,
+    errno.EPERM,
+}
+
+
+def to_utc(dt: datetime.datetime) -> datetime.datetime:
+    """Convert a datetime to UTC, taking naive datetimes to be in UTC already"""
+    if not dt.tzinfo:
+        return dt.replace(tzinfo=datetime.timezone.utc)
+    return (dt - dt.utcoffset()).replace(tzinfo=datetime.timezone.utc)
+
+
+class BulkWriteError(Exception):
+    """
+    Raised when writes made concurrently, such as through a
+    BoostnoteBulkWriter, fail.
+
+    errors: (path, exception) pairs for every failed write, in the order the
+        writes were added, with paths relative to the output
+    """
+
+    def __init__(self, errors: List[Tuple[str, BaseException]]):
+        self.errors = errors
+        lines = [f"{len(errors)} files could not be written:"]
+        lines.extend(f"  {path}: {exc}" for path, exc in errors)
+        super().__init__("\n".join(lines))
 
 
 def get_child_paths(root: str):
     """
     Return the paths of all files contained by root relative to the root
-    directory path
+    directory path, in a stable order
     """
     paths = []
-    for parent, _, filenames in os.walk(root):
+    for parent, dirnames, filenames in os.walk(root):
+        # Sorting in place makes os.walk visit subdirectories in order
+        dirnames.sort()
         relative_parent = os.path.relpath(parent, root)
-        for filename in filenames:
+        for filename in sorted(filenames):
             paths.append(os.path.join(relative_parent, filename))
     return paths
+
+
+def hash_stream(fh: IO[bytes], chunk_size: int = HASH_CHUNK_SIZE) -> str:
+    """
+    Return the hex SHA-256 digest of everything remaining in fh, reading it in
+    fixed-size chunks so that large files never have to fit in memory
+    """
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: fh.read(chunk_size), b""):
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _copy_file_range(src_fd, src_offset, count, dst_fd, dst_offset) -> int:
+    return os.copy_file_range(src_fd, dst_fd, count, src_offset, dst_offset)
+
+
+def _sendfile(src_fd, src_offset, count, dst_fd, dst_offset) -> int:
+    # sendfile writes at the destination's file position
+    os.lseek(dst_fd, dst_offset, os.SEEK_SET)
+    return os.sendfile(dst_fd, src_fd, src_offset, count)
+
+
+def _pread_pwrite(src_fd, src_offset, count, dst_fd, dst_offset) -> int:
+    data = os.pread(src_fd, min(count, COPY_CHUNK_SIZE), src_offset)
+    return os.pwrite(dst_fd, data, dst_offset) if data else 0
+
+
+def copy_range(src_fd: int, src_offset: int, count: int, dst_fd: int, dst_offset: int):
+    """
+    Copy count bytes from src_fd at src_offset to dst_fd at dst_offset.
+
+    The copy happens in the kernel with copy_file_range or sendfile where the
+    platform and filesystems allow it, and through a bounded buffer otherwise,
+    so the data never has to fit in memory.
+    """
+    strategies = [_pread_pwrite]
+    if hasattr(os, "sendfile"):
+        strategies.insert(0, _sendfile)
+    if hasattr(os, "copy_file_range"):
+        strategies.insert(0, _copy_file_range)
+    while count > 0:
+        try:
+            n = strategies[0](src_fd, src_offset, count, dst_fd, dst_offset)
+        except OSError as exc:
+            if exc.errno not in _UNSUPPORTED_COPY_ERRNOS or len(strategies) == 1:
+                raise
+            strategies.pop(0)
+            continue
+        if n == 0:
+            raise EOFError("Source ended before the requested range was copied")
+        src_offset += n
+        dst_offset += n
+        count -= n
+
+
+def link_or_copy(src_path: str, dst_path: str, link: Optional[str] = None):
+    """
+    Create dst_path with the contents of src_path.
+
+    With link=LINK_HARDLINK or LINK_REFLINK, try to share the source's data
+    rather than copying it. This falls back to a (kernel-side) copy when the
+    files are on different filesystems or the filesystem can't share extents.
+    """
+    if link == LINK_HARDLINK:
+        try:
+            os.link(src_path, dst_path)
+            return
+        except OSError as exc:
+            if exc.errno not in _UNSUPPORTED_COPY_ERRNOS:
+                raise
+    with open(src_path, "rb") as src, open(dst_path, "wb") as dst:
+        if link == LINK_REFLINK and fcntl is not None:
+            try:
+                fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+                return
+            except OSError as exc:
+                if exc.errno not in _UNSUPPORTED_COPY_ERRNOS:
+                    raise
+        size = os.fstat(src.fileno()).st_size
+        copy_range(src.fileno(), 0, size, dst.fileno(), 0)
@@ -0,0 +1,212 @@
+"""
+Check every link in a vault against an index built in a single pass.
+
+Boost Note directories, JEX files, extracted JEX directories and Joplin
+profiles are supported. Each item is read exactly once, so validating a vault
+costs about as much as reading it. Boost Note notes are only parsed in full
+when they contain a link.
+"""
+import json
+import os
+from collections import Counter
+from dataclasses import asdict, dataclass, field
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+from . import boostnote, ir, joplin
+from .convert_boostnote_to_jex import (
+    BOOSTNOTE_NOTE_LINK_PROG,
+    BOOSTNOTE_STORAGE_LINK_PROG,
+)
+from .convert_jex_to_boostnote import JOPLIN_LINK_PROG
+from .options import FORMAT_BOOSTNOTE
+
+# Top-level keys of a note needed to validate it, besides its links
+SCAN_KEYS = ("type", "folder")
+
+
+@dataclass
+class DanglingLink:
+    """
+    source: ID of the item containing the link
+    target: the ID or attachment path that could not be found
+    kind: what the link was expected to point at, eg. "note" or "attachment"
+    """
+
+    source: str
+    target: str
+    kind: str
+
+
+@dataclass
+class ValidationReport:
+    dangling_links: List[DanglingLink] = field(default_factory=list)
+    orphan_resources: List[str] = field(default_factory=list)
+    duplicate_ids: List[str] = field(default_factory=list)
+    missing_blobs: List[str] = field(default_factory=list)
+
+    def is_valid(self) -> bool:
+        return not any(asdict(self).values())
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+def _duplicates(counts: Counter) -> List[str]:
+    return sorted(k for k, n in counts.items() if n > 1)
+
+
+def _scan_note(
+    col: boostnote.BoostnoteCollection, note_path: str
+) -> Optional[Tuple[str, Optional[str]]]:
+    """
+    Get the folder of an entity, and its content if it is a note that links
+    to anything (or an empty string if it links to nothing). The content is
+    only parsed when it is needed for its links, or if the top-level keys
+    can't be scanned. Returns None if the entity can't be parsed.
+    """
+    with open(note_path) as fh:
+        text = fh.read()
+    keys = boostnote.scan_entity_keys(text, SCAN_KEYS)
+    if all(k in keys for k in SCAN_KEYS):
+        if keys["type"] != boostnote.BoostnoteEntityType.MARKDOWN_NOTE.value:
+            return keys["folder"], None
+        if ":note:" not in text and ":storage/" not in text:
+            return keys["folder"], ""
+    entity = next(col.get_entities(note_paths=[note_path]), None)
+    if entity is None:
+        return None
+    if not isinstance(entity, boostnote.BoostnoteNote):
+        return entity.folder_id, None
+    return entity.folder_id, entity.content
+
+
+def validate_boostnote(col: boostnote.BoostnoteCollection) -> ValidationReport:
+    report = ValidationReport()
+
+    attachments: Set[str] = {
+        os.path.normpath(a.relative_path) for a in col.get_attachments()
+    }
+    id_counts = Counter(col.meta.list_folder_ids())
+    folder_ids = set(id_counts)
+    note_links: Dict[str, List[str]] = {}
+    referenced_attachments: Set[str] = set()
+
+    for note_path in col.get_entity_paths():
+        scanned = _scan_note(col, note_path)
+        if scanned is None:
+            continue
+        note_id = os.path.basename(note_path).rsplit(".", 1)[0]
+        folder_id, content = scanned
+        id_counts[note_id] += 1
+        if folder_id not in folder_ids:
+            report.dangling_links.append(DanglingLink(note_id, folder_id, "folder"))
+        if content is None:
+            continue
+        note_links[note_id] = [
+            m.group(2) for m in BOOSTNOTE_NOTE_LINK_PROG.finditer(content)
+        ]
+        for m in BOOSTNOTE_STORAGE_LINK_PROG.finditer(content):
+            relpath = os.path.normpath(m.group(2))
+            referenced_attachments.add(relpath)
+            if relpath not in attachments:
+                report.dangling_links.append(
+                    DanglingLink(note_id, m.group(2), "attachment")
+                )
+
+    for source, targets in note_links.items():
+        for target in targets:
+            if target not in id_counts:
+                report.dangling_links.append(DanglingLink(source, target, "note"))
+
+    report.orphan_resources = sorted(attachments - referenced_attachments)
+    report.duplicate_ids = _duplicates(id_counts)
+    return report
+
+
+def _iter_jex_items(store: joplin.Store) -> Iterator[Tuple[str, Optional[str]]]:
+    """
+    Get the path and text of every item, and the path of every file of
+    resource data with None as its text. Archives are read in a single pass.
+    """
+    if isinstance(store, joplin.JoplinTarStore):
+        for info, fh in store.iter_members(latest_only=True):
+            if info.name.startswith("resources/"):
+                yield info.name, None
+            elif "/" not in info.name and info.name.endswith(".md"):
+                yield info.name, fh.read().decode("utf-8")
+        return
+    try:
+        resource_paths = store.list("resources/")
+    except FileNotFoundError:
+        resource_paths = []
+    for p in resource_paths:
+        yield p, None
+    for p in store.list():
+        if p.endswith(".md"):
+            yield p, store.read(p)
+
+
+def validate_jex(store: joplin.Store) -> ValidationReport:
+    """
+    Validate a JEX file, extracted JEX directory or Joplin profile opened with
+    joplin.open_store
+    """
+    report = ValidationReport()
+
+    id_counts: Counter = Counter()
+    model_types: Dict[str, joplin.JoplinModelType] = {}
+    blobs: Set[str] = set()
+    # (source, target, kind) triples checked once every ID is known
+    references = []
+
+    for path, text in _iter_jex_items(store):
+        if text is None:
+            blobs.add(os.path.basename(path).split(".", 1)[0])
+            continue
+        try:
+            item = joplin.parse_joplin_note(text)
+        except Exception:
+            print(f"Could not parse {path}")
+            continue
+        id_counts[item.id] += 1
+        model_types[item.id] = item.model_type
+        parent_id = item.headers.get("parent_id")
+        if parent_id:
+            references.append((item.id, parent_id, "folder"))
+        if item.model_type == joplin.JoplinModelType.Note:
+            references.extend(
+                (item.id, m.group(2), "note")
+                for m in JOPLIN_LINK_PROG.finditer(item.body)
+            )
+        elif item.model_type == joplin.JoplinModelType.NoteTag:
+            references.append((item.id, item.headers["note_id"], "note"))
+            references.append((item.id, item.headers["tag_id"], "tag"))
+
+    linked: Set[str] = set()
+    for source, target, kind in references:
+        linked.add(target)
+        if target not in id_counts:
+            report.dangling_links.append(DanglingLink(source, target, kind))
+
+    resources = {
+        item_id
+        for item_id, model_type in model_types.items()
+        if model_type == joplin.JoplinModelType.Resource
+    }
+    report.orphan_resources = sorted(resources - linked)
+    report.missing_blobs = sorted(resources - blobs)
+    report.duplicate_ids = _duplicates(id_counts)
+    return report
+
+
+def main(path: str) -> ValidationReport:
+    """
+    Validate a Boost Note directory, JEX file, extracted JEX directory or
+    Joplin profile and print a JSON report
+    """
+    if ir.detect_format(path) == FORMAT_BOOSTNOTE:
+        report = validate_boostnote(boostnote.BoostnoteCollection.from_dir(path))
+    else:
+        report = validate_jex(joplin.open_store(path))
+    print(json.dumps(report.to_dict(), indent=2))
+    return report
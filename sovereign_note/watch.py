@@ -0,0 +1,465 @@
+"""
+Continuously mirror a Boost Note directory into a JEX file.
+
+After an initial full conversion, only the notes and attachments that change
+are converted again. Updated items are appended to the archive; since a later
+member of a tarball replaces an earlier one with the same name on extraction,
+this is enough for edits. Deleting an item (or a note losing a tag) leaves a
+member behind that must not be imported, so the archive is then compacted by
+copying the live members into a new archive.
+
+Changes are detected with inotify on Linux, falling back to polling file
+modification times elsewhere. If inotify drops events, the whole collection is
+checked again.
+
+IDs are assigned as in boost2jex, including sharing one resource between
+attachments with identical contents.
+"""
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import tarfile
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional, Set
+
+from . import boostnote, joplin
+from .convert_boostnote_to_jex import (
+    attachment_blob_key,
+    boostnote_to_joplin_id,
+    new_uuid,
+    write_attachment,
+    write_folder,
+    write_note,
+    write_tag,
+)
+from .options import DEBOUNCE, POLL_INTERVAL
+from .util import get_child_paths
+
+# Reported by a watcher in place of the changed paths when it lost track of
+# them, so that everything must be checked
+RESCAN = "."
+
+
+def collection_paths(dir_path: str) -> List[str]:
+    """Get the paths of the files a collection is read from, relative to it"""
+    paths = ["boostnote.json"]
+    for subdir in ("notes", "attachments"):
+        paths.extend(
+            os.path.normpath(os.path.join(subdir, p))
+            for p in get_child_paths(os.path.join(dir_path, subdir))
+        )
+    return paths
+
+
+class JexMirror:
+    """
+    A JEX file kept in sync with a Boost Note directory, along with the state
+    needed to convert single items into it.
+    """
+
+    def __init__(
+        self, boost_dir_path: str, output_location: str, reproducible: bool = False
+    ):
+        self.col = boostnote.BoostnoteCollection.from_dir(boost_dir_path)
+        self.output_location = output_location
+        self.reproducible = reproducible
+        self.folder_names: Dict[str, str] = {}
+        self.tag_name_to_id: Dict[str, str] = {}
+        self.map_boostnote_to_joplin: Dict[str, str] = {}
+        self.map_boostnote_attachment_to_joplin_id: Dict[
+            boostnote.BoostnoteAttachment, str
+        ] = {}
+        # Sizes and content keys (see attachment_blob_key) of the attachments,
+        # for finding copies of the same file
+        self.attachment_sizes: Dict[boostnote.BoostnoteAttachment, int] = {}
+        self._attachments_by_size: Dict[
+            int, Set[boostnote.BoostnoteAttachment]
+        ] = defaultdict(set)
+        self._blob_keys: Dict[boostnote.BoostnoteAttachment, str] = {}
+        # NoteTag IDs by tag name, for each note
+        self.notetag_ids: Dict[str, Dict[str, str]] = {}
+        # End of the last member in the archive, where appends start
+        self._end: Optional[int] = None
+
+    def _live_names(self) -> Set[str]:
+        names = {f"{folder_id}.md" for folder_id in self.folder_names}
+        names.update(f"{tag_id}.md" for tag_id in self.tag_name_to_id.values())
+        attachment_ids = self.map_boostnote_attachment_to_joplin_id
+        for attachment, attachment_id in attachment_ids.items():
+            ext = attachment.filename.rsplit(".", 1)[-1]
+            names.add(f"{attachment_id}.md")
+            names.add(f"resources/{attachment_id}.{ext}")
+        for boostnote_id, notetags in self.notetag_ids.items():
+            names.add(f"{self.map_boostnote_to_joplin[boostnote_id]}.md")
+            names.update(f"{notetag_id}.md" for notetag_id in notetags.values())
+        return names
+
+    def _known_paths(self) -> Set[str]:
+        """Paths of everything in the output, relative to the collection"""
+        paths = {
+            os.path.join("notes", f"{boostnote_id}.cson")
+            for boostnote_id in self.notetag_ids
+        }
+        paths.update(
+            os.path.join("attachments", attachment.relative_path)
+            for attachment in self.map_boostnote_attachment_to_joplin_id
+        )
+        return paths
+
+    def _joplin_id(self, boostnote_id: str) -> str:
+        if boostnote_id not in self.map_boostnote_to_joplin:
+            self.map_boostnote_to_joplin[boostnote_id] = boostnote_to_joplin_id(
+                boostnote_id, self.reproducible
+            )
+        return self.map_boostnote_to_joplin[boostnote_id]
+
+    def _sync_folders(self, store):
+        self.col.meta = boostnote.BoostnoteMeta.from_file(
+            os.path.join(self.col.dir_path, "boostnote.json")
+        )
+        folder_names = {
+            folder_id: self.col.meta.get_folder_name(folder_id)
+            for folder_id in self.col.meta.list_folder_ids()
+        }
+        for folder_id, folder_name in folder_names.items():
+            if self.folder_names.get(folder_id) != folder_name:
+                write_folder(store, folder_id, folder_name)
+        self.folder_names = folder_names
+
+    def _blob_key(self, attachment: boostnote.BoostnoteAttachment) -> str:
+        if attachment not in self._blob_keys:
+            self._blob_keys[attachment] = attachment_blob_key(
+                self.col, attachment, self.attachment_sizes[attachment]
+            )
+        return self._blob_keys[attachment]
+
+    def _find_copy(self, attachment: boostnote.BoostnoteAttachment) -> Optional[str]:
+        """
+        Get the resource ID of another attachment with the same contents. As in
+        boost2jex, contents are only hashed when two attachments have the same
+        size.
+        """
+        ids = self.map_boostnote_attachment_to_joplin_id
+        size = self.attachment_sizes[attachment]
+        for other in self._attachments_by_size[size]:
+            if other == attachment or other not in ids:
+                continue
+            if self._blob_key(other) == self._blob_key(attachment):
+                return ids[other]
+        return None
+
+    def _sync_attachment(self, store, relpath: str) -> bool:
+        """
+        Write an attachment unless a copy of it was already written, returning
+        whether its resource ID changed
+        """
+        attachment = boostnote.BoostnoteAttachment(os.path.normpath(relpath))
+        ids = self.map_boostnote_attachment_to_joplin_id
+        old_id = ids.pop(attachment, None)
+        self._blob_keys.pop(attachment, None)
+        old_size = self.attachment_sizes.pop(attachment, None)
+        if old_size is not None:
+            self._attachments_by_size[old_size].discard(attachment)
+        path = os.path.join(self.col.dir_path, "attachments", relpath)
+        if not os.path.isfile(path):
+            return False
+        size = self.attachment_sizes[attachment] = os.path.getsize(path)
+        self._attachments_by_size[size].add(attachment)
+        attachment_id = self._find_copy(attachment)
+        if attachment_id is None:
+            if old_id is not None and old_id not in ids.values():
+                attachment_id = old_id
+            else:
+                attachment_id = new_uuid(
+                    self.reproducible, "attachment", attachment.relative_path
+                ).hex
+            write_attachment(store, self.col, attachment, attachment_id)
+        ids[attachment] = attachment_id
+        return old_id is not None and attachment_id != old_id
+
+    def _sync_note(self, store, note_path: str):
+        boostnote_id = os.path.basename(note_path).rsplit(".", 1)[0]
+        if not os.path.isfile(note_path):
+            self.notetag_ids.pop(boostnote_id, None)
+            return
+        try:
+            entity = self.col.read_entity(note_path)
+        except Exception as exc:
+            # Most likely caught halfway through being saved; the next event
+            # for this file will pick it up.
+            print(f"Skipping note {note_path}: {exc}")
+            return
+        if not isinstance(entity, boostnote.BoostnoteNote):
+            return
+        for tag_name in entity.tags:
+            if tag_name not in self.tag_name_to_id:
+                self.tag_name_to_id[tag_name] = str(
+                    new_uuid(self.reproducible, "tag", tag_name)
+                )
+                write_tag(store, self.tag_name_to_id[tag_name], tag_name)
+        self._joplin_id(boostnote_id)
+        self.notetag_ids[boostnote_id] = write_note(
+            store,
+            entity,
+            self.map_boostnote_to_joplin,
+            self.map_boostnote_attachment_to_joplin_id,
+            self.tag_name_to_id,
+            self.notetag_ids.get(boostnote_id),
+            reproducible=self.reproducible,
+        )
+
+    def build(self):
+        """Convert the whole collection, replacing the output"""
+        with joplin.JoplinTarWriter(self.output_location) as store:
+            self._sync_folders(store)
+            for attachment in self.col.get_attachments():
+                self._sync_attachment(store, attachment.relative_path)
+            for note_path in self.col.get_entity_paths():
+                self._joplin_id(os.path.basename(note_path).rsplit(".", 1)[0])
+            for note_path in self.col.get_entity_paths():
+                self._sync_note(store, note_path)
+            self._end = store.checkpoint()
+
+    def apply(self, changed: Set[str]):
+        """
+        Bring the output up to date with the given paths, relative to the
+        collection directory, which were created, modified or deleted. If
+        changed contains RESCAN, every path is checked.
+        """
+        if RESCAN in changed:
+            changed = self._known_paths().union(collection_paths(self.col.dir_path))
+        before = self._live_names()
+        with joplin.JoplinTarWriter(self.output_location, offset=self._end) as store:
+            if "boostnote.json" in changed:
+                self._sync_folders(store)
+            # Attachments first, so that new notes can link to new attachments
+            relinked = False
+            for path in sorted(changed):
+                if path.startswith("attachments" + os.sep):
+                    relpath = os.path.relpath(path, "attachments")
+                    relinked |= self._sync_attachment(store, relpath)
+            if relinked:
+                # An attachment that stopped being a copy of another got its
+                # own resource, which the notes linking to it must use. Which
+                # notes those are isn't known, so all of them are rewritten.
+                changed = changed | self._known_paths()
+            for path in sorted(changed):
+                if path.startswith("notes" + os.sep) and path.endswith(".cson"):
+                    self._sync_note(store, os.path.join(self.col.dir_path, path))
+            self._end = store.checkpoint()
+        if before - self._live_names():
+            self.compact()
+
+    def compact(self):
+        """Rewrite the archive without members that are no longer live"""
+        live = self._live_names()
+        tmp_path = f"{self.output_location}.compact"
+        with tarfile.open(self.output_location) as src:
+            # Keep only the last copy of each member, as extraction would
+            latest = {info.name: info for info in src.getmembers() if info.isfile()}
+            with joplin.JoplinTarWriter(tmp_path) as dst:
+                for name, info in latest.items():
+                    if name in live:
+                        dst.write_fileobj(name, src.extractfile(info), info.size)
+                self._end = dst.checkpoint()
+        os.replace(tmp_path, self.output_location)
+        print(f"Compacted {self.output_location}")
+
+
+class PollingWatcher:
+    """Detect changes by comparing modification times between scans"""
+
+    def __init__(self, dir_path: str, interval: float = POLL_INTERVAL):
+        self.dir_path = dir_path
+        self.interval = interval
+        self._snapshot = self._scan()
+
+    def _scan(self) -> Dict[str, tuple]:
+        snapshot = {}
+        for path in collection_paths(self.dir_path):
+            try:
+                st = os.stat(os.path.join(self.dir_path, path))
+            except FileNotFoundError:
+                continue
+            snapshot[path] = (st.st_mtime_ns, st.st_size)
+        return snapshot
+
+    def wait(self, timeout: Optional[float] = None) -> Set[str]:
+        """Return the paths that changed, waiting up to timeout for any"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            snapshot = self._scan()
+            changed = {
+                path
+                for path in set(snapshot) | set(self._snapshot)
+                if snapshot.get(path) != self._snapshot.get(path)
+            }
+            self._snapshot = snapshot
+            if changed:
+                return changed
+            if deadline is not None and time.monotonic() >= deadline:
+                return set()
+            delay = self.interval
+            if deadline is not None:
+                delay = min(delay, max(0.0, deadline - time.monotonic()))
+            time.sleep(delay)
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher:
+    """Detect changes with Linux's inotify, which costs nothing while idle"""
+
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_Q_OVERFLOW = 0x00004000
+    IN_ISDIR = 0x40000000
+    IN_NONBLOCK = 0o4000
+    IN_CLOEXEC = 0o2000000
+    MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+    _EVENT = struct.Struct("iIII")
+
+    def __init__(self, dir_path: str):
+        self.dir_path = dir_path
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self._fd = self._libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._watches: Dict[int, str] = {}
+        self._add_watch("")
+        self._add_watch("notes")
+        self._add_tree("attachments")
+
+    def _add_watch(self, relpath: str):
+        path = os.path.join(self.dir_path, relpath)
+        if not os.path.isdir(path):
+            return
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(path), self.MASK)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f"inotify_add_watch failed for {path}")
+        self._watches[wd] = relpath
+
+    def _add_tree(self, relpath: str) -> Set[str]:
+        """Watch a directory and its subdirectories, returning the files found"""
+        files = set()
+        for parent, _, filenames in os.walk(os.path.join(self.dir_path, relpath)):
+            parent_relpath = os.path.relpath(parent, self.dir_path)
+            self._add_watch(parent_relpath)
+            files.update(os.path.join(parent_relpath, f) for f in filenames)
+        return files
+
+    def _read_events(self) -> Set[str]:
+        changed = set()
+        try:
+            buf = os.read(self._fd, 65536)
+        except BlockingIOError:
+            return changed
+        offset = 0
+        while offset < len(buf):
+            wd, mask, _, length = self._EVENT.unpack_from(buf, offset)
+            offset += self._EVENT.size
+            name = buf[offset : offset + length].rstrip(b"\0").decode()
+            offset += length
+            if mask & self.IN_Q_OVERFLOW:
+                # Events were dropped, so which paths changed is unknown.
+                # Directories created meanwhile must be watched too.
+                self._add_tree("notes")
+                self._add_tree("attachments")
+                changed.add(RESCAN)
+                continue
+            if wd not in self._watches:
+                continue
+            watched = self._watches[wd]
+            relpath = os.path.normpath(os.path.join(watched, name))
+            if mask & self.IN_ISDIR:
+                if mask & (self.IN_CREATE | self.IN_MOVED_TO) and relpath.split(os.sep)[
+                    0
+                ] in ("notes", "attachments"):
+                    # Files may land in a new directory before it is watched,
+                    # so report whatever is already in it
+                    changed.update(self._add_tree(relpath))
+            elif mask & self.IN_CREATE:
+                # Wait for IN_CLOSE_WRITE rather than reading a half-written file
+                continue
+            elif watched or name == "boostnote.json":
+                changed.add(relpath)
+        return changed
+
+    def wait(self, timeout: Optional[float] = None) -> Set[str]:
+        """Return the paths that changed, waiting up to timeout for any"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            remaining = None
+            if deadline is not None:
+                remaining = max(0.0, deadline - time.monotonic())
+            readable, _, _ = select.select([self._fd], [], [], remaining)
+            if not readable:
+                return set()
+            changed = self._read_events()
+            if changed:
+                return changed
+
+    def close(self):
+        os.close(self._fd)
+
+
+def make_watcher(dir_path: str, poll: bool = False, interval: float = POLL_INTERVAL):
+    """
+    Get an inotify watcher if possible, or one polling every interval seconds
+    otherwise
+    """
+    if not poll:
+        try:
+            return InotifyWatcher(dir_path)
+        except (OSError, AttributeError, TypeError):
+            # AttributeError/TypeError: no libc or no inotify in it
+            print("inotify is unavailable; falling back to polling")
+    return PollingWatcher(dir_path, interval)
+
+
+def main(
+    boost_dir_path: str,
+    output_location: str,
+    debounce: float = DEBOUNCE,
+    poll: bool = False,
+    stop: Optional[threading.Event] = None,
+    interval: float = POLL_INTERVAL,
+    reproducible: bool = False,
+):
+    """
+    Convert boost_dir_path into output_location, then keep converting changed
+    items until interrupted (or until stop is set). Changes are polled for
+    every interval seconds if inotify is unavailable, and stop is checked as
+    often.
+    """
+    stop = stop or threading.Event()
+    watcher = make_watcher(boost_dir_path, poll, interval)
+    mirror = JexMirror(boost_dir_path, output_location, reproducible)
+    mirror.build()
+    print(f"Watching {boost_dir_path} for changes")
+    try:
+        while not stop.is_set():
+            changed = watcher.wait(timeout=interval)
+            if not changed:
+                continue
+            # Debounce: keep collecting until the burst of changes settles
+            while True:
+                more = watcher.wait(timeout=debounce)
+                if not more:
+                    break
+                changed |= more
+            print(f"Converting {len(changed)} changed path(s)")
+            mirror.apply(changed)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
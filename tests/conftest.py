@@ -0,0 +1,73 @@
+import datetime
+import os
+import shutil
+import sqlite3
+import tempfile
+from pathlib import Path
+
+import pytest
+
+from sovereign_note import joplin
+
+REFERENCE_BOOST = (
+    Path(__file__).resolve().parent / "resources" / "example-boostnote-collection"
+)
+
+
+@pytest.fixture
+def reference_boost() -> Path:
+    """The example Boost Note collection, which tests must not change"""
+    return REFERENCE_BOOST
+
+
+@pytest.fixture
+def boost_copy(tmp_path) -> str:
+    """A copy of the example Boost Note collection that a test may change"""
+    path = tmp_path / "boost"
+    shutil.copytree(REFERENCE_BOOST, path)
+    return str(path)
+
+
+@pytest.fixture
+def joplin_profile(tmp_path):
+    """
+    Get a function that loads the items of a JEX file into a new Joplin-style
+    profile directory
+    """
+
+    def make(jex_path: str) -> str:
+        profile = tempfile.mkdtemp(dir=tmp_path)
+        os.mkdir(os.path.join(profile, "resources"))
+        db = sqlite3.connect(os.path.join(profile, "database.sqlite"))
+        store = joplin.IndexedJoplinTarStore(jex_path)
+        for p in store.list():
+            item = joplin.parse_joplin_note(store.read(p))
+            table = joplin.JoplinSqliteStore.TABLES[item.model_type]
+            row = {k: v for k, v in item.headers.items() if k != "type_"}
+            for k in joplin.JoplinSqliteStore.TIME_COLUMNS & set(row):
+                parsed = datetime.datetime.strptime(row[k], joplin.JOPLIN_DATE_FORMAT)
+                row[k] = round(parsed.timestamp() * 1000)
+            if item.model_type == joplin.JoplinModelType.Note:
+                row["title"], _, row["body"] = item.body.partition("\n\n")
+            elif item.model_type != joplin.JoplinModelType.NoteTag:
+                row["title"] = item.body
+            columns = [f'"{k}"' for k in row if k != "id"]
+            db.execute(
+                f"CREATE TABLE IF NOT EXISTS {table} "
+                f"(id TEXT PRIMARY KEY, {', '.join(columns)})"
+            )
+            db.execute(
+                f"INSERT INTO {table} (id, {', '.join(columns)}) VALUES "
+                f"({', '.join('?' for _ in row)})",
+                [row["id"], *(v for k, v in row.items() if k != "id")],
+            )
+            if item.model_type == joplin.JoplinModelType.Resource:
+                with open(os.path.join(profile, store.resource_path(item)), "wb") as fh:
+                    fh.write(store.read_resource_bin(item))
+        for table in joplin.JoplinSqliteStore.TABLES.values():
+            db.execute(f"CREATE TABLE IF NOT EXISTS {table} (id TEXT PRIMARY KEY)")
+        db.commit()
+        db.close()
+        return profile
+
+    return make
@@ -0,0 +1,92 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from sovereign_note import aio, boostnote
+from sovereign_note import convert_boostnote_to_jex as boost2jex
+from sovereign_note import joplin
+
+
+async def collect(async_iterator) -> list:
+    return [item async for item in async_iterator]
+
+
+def test_async_boostnote_collection_matches_sync(reference_boost):
+    col = boostnote.BoostnoteCollection.from_dir(reference_boost)
+
+    async def read_all():
+        async_col = await aio.AsyncBoostnoteCollection.from_dir(
+            reference_boost, max_concurrency=2
+        )
+        return await collect(async_col.get_entities())
+
+    assert asyncio.run(read_all()) == list(col.get_entities())
+
+
+def test_async_store_serves_concurrent_vaults(reference_boost, tmp_path):
+    jex_paths = [str(tmp_path / "a.jex"), str(tmp_path / "b.jex")]
+    for jex_path in jex_paths:
+        boost2jex.main(reference_boost, jex_path)
+
+    async def read_vault(jex_path):
+        store = aio.AsyncStore(joplin.IndexedJoplinTarStore(jex_path))
+        items = await collect(store.get_entities())
+        resource = next(i for i in items if isinstance(i, joplin.JoplinResource))
+        note_id = next(
+            i.id for i in items if i.model_type == joplin.JoplinModelType.Note
+        )
+        return (
+            items,
+            await store.read_resource_bin(resource),
+            await store.get_note_by_id(note_id),
+        )
+
+    async def read_vaults():
+        return await asyncio.gather(*map(read_vault, jex_paths))
+
+    for jex_path, (items, blob, note) in zip(jex_paths, asyncio.run(read_vaults())):
+        store = joplin.JoplinTarStore(jex_path)
+        expected = [
+            joplin.parse_joplin_note(store.read(p))
+            for p in store.list()
+            if p.endswith(".md")
+        ]
+        assert sorted(items) == sorted(expected)
+        assert blob
+        assert note in expected
+
+
+class SlowRawStore(joplin.JoplinRawStore):
+    """Records when writes start and finish, and takes a while over each"""
+
+    def __init__(self, path):
+        super().__init__(path)
+        self.events = []
+        self.lock = threading.Lock()
+
+    def write(self, relative_path, contents):
+        with self.lock:
+            self.events.append(("start", relative_path))
+        time.sleep(0.01)
+        super().write(relative_path, contents)
+        with self.lock:
+            self.events.append(("end", relative_path))
+
+
+def test_async_store_serializes_writes(tmp_path):
+    raw_store = SlowRawStore(str(tmp_path))
+    # Enough threads that every write could run at once if it were allowed to
+    store = aio.AsyncStore(
+        raw_store, max_concurrency=20, executor=ThreadPoolExecutor(20)
+    )
+
+    async def write_all():
+        await asyncio.gather(*(store.write(f"{i}.md", f"Item {i}") for i in range(20)))
+        return await store.list()
+
+    assert sorted(asyncio.run(write_all())) == sorted(f"{i}.md" for i in range(20))
+    # Each write finished before the next one started
+    assert len(raw_store.events) == 40
+    for start, end in zip(raw_store.events[::2], raw_store.events[1::2]):
+        assert start[0] == "start" and end == ("end", start[1])
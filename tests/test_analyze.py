@@ -0,0 +1,49 @@
+import csv
+import os
+
+from sovereign_note import analyze
+from sovereign_note import convert_boostnote_to_jex as boost2jex
+
+
+def test_analyze_boostnote_and_jex(reference_boost, tmp_path):
+    csv_path = str(tmp_path / "stats.csv")
+    result = analyze.main(reference_boost, json_path=os.devnull, csv_path=csv_path)
+    assert result["notes"]["size"]["count"] == 3
+    assert sum(b["count"] for b in result["notes"]["size_histogram"]) == 3
+    for bucket in result["attachments"]["size_histogram"]:
+        assert bucket["min"] * 2 == bucket["max"] or bucket["min"] == 0
+    assert result["attachments"]["size"]["count"] == 2
+    assert sum(f["notes"] for f in result["folders"]) == 3
+    # Both of the first two notes link to each other and themselves, and the
+    # third links to its two attachments
+    assert result["links"]["per_note"]["total"] == 6
+    assert result["links"]["notes_without_links"] == 0
+    assert sum(result["created"].values()) == 3
+
+    with open(csv_path, newline="") as fh:
+        rows = list(csv.DictReader(fh))
+    assert sum(int(row["size"]) for row in rows) == result["notes"]["size"]["total"]
+    assert sum(int(row["links"]) for row in rows) == 6
+
+    jex_loc = str(tmp_path / "vault.jex")
+    boost2jex.main(reference_boost, jex_loc)
+    jex_result = analyze.analyze(jex_loc)
+    for key in ("attachments", "tags", "tags_per_note", "created", "updated"):
+        assert jex_result[key] == result[key]
+    assert jex_result["links"]["per_note"]["total"] == 6
+
+
+def test_percentiles_interpolate():
+    values = analyze.array("q", [1, 2, 3, 4, 100])
+    assert analyze.percentiles(values, (0, 50, 75, 100)) == {
+        "p0": 1.0,
+        "p50": 3.0,
+        "p75": 4.0,
+        "p100": 100.0,
+    }
+    assert [(b["min"], b["count"]) for b in analyze.size_histogram(values)] == [
+        (1, 1),
+        (2, 2),
+        (4, 1),
+        (64, 1),
+    ]
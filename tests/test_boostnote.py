@@ -0,0 +1,115 @@
+import datetime
+import os
+
+import pytest
+
+from sovereign_note import boostnote
+
+
+def make_note(note_id: str) -> boostnote.BoostnoteNote:
+    now = datetime.datetime(2021, 10, 2, tzinfo=datetime.timezone.utc)
+    return boostnote.BoostnoteNote(
+        id=note_id,
+        created_at=now,
+        updated_at=now,
+        title=f"Note {note_id}",
+        folder_id="folder",
+        tags=[],
+        is_starred=False,
+        is_trashed=False,
+        content="Hello",
+    )
+
+
+def test_bulk_writer_replaces_existing_collection(tmp_path):
+    dir_path = str(tmp_path / "collection")
+    os.makedirs(os.path.join(dir_path, "notes"))
+    with open(os.path.join(dir_path, "notes", "stale.cson"), "w") as fh:
+        fh.write("")
+    boostnote.BoostnoteMeta.create().write_to_file(
+        os.path.join(dir_path, "boostnote.json")
+    )
+
+    col = boostnote.BoostnoteCollection.create(dir_path)
+    col.meta.add_folder("folder", "#FFFFFF", "Folder")
+    with col.bulk_writer(max_workers=2) as writer:
+        for i in range(10):
+            writer.add_entity(make_note(str(i)))
+        writer.add_attachment(os.path.join("0", "a.txt"), b"attachment")
+
+    assert sorted(os.listdir(os.path.join(dir_path, "notes"))) == sorted(
+        f"{i}.cson" for i in range(10)
+    )
+    assert os.listdir(os.path.dirname(dir_path)) == ["collection"]
+    written = boostnote.BoostnoteCollection.from_dir(dir_path)
+    assert written.meta.list_folder_ids() == ["folder"]
+    assert {e.id for e in written.get_entities()} == {str(i) for i in range(10)}
+    assert written.read_attachment(boostnote.BoostnoteAttachment("0/a.txt")) == (
+        b"attachment"
+    )
+
+
+def test_bulk_writer_refuses_to_replace_other_directories(tmp_path):
+    dir_path = str(tmp_path / "collection")
+    os.makedirs(dir_path)
+    with open(os.path.join(dir_path, "thesis.txt"), "w") as fh:
+        fh.write("years of work")
+    col = boostnote.BoostnoteCollection.create(dir_path)
+    with pytest.raises(FileExistsError):
+        col.bulk_writer()
+    assert os.listdir(dir_path) == ["thesis.txt"]
+    assert os.listdir(os.path.dirname(dir_path)) == ["collection"]
+
+
+def test_bulk_writer_publishes_with_default_mode(tmp_path):
+    parent = str(tmp_path)
+    dir_path = os.path.join(parent, "collection")
+    col = boostnote.BoostnoteCollection.create(dir_path)
+    with col.bulk_writer() as writer:
+        writer.add_entity(make_note("1"))
+    os.mkdir(os.path.join(parent, "plain"))
+    mode = os.stat(dir_path).st_mode & 0o777
+    assert mode == os.stat(os.path.join(parent, "plain")).st_mode & 0o777
+
+
+def test_interrupted_replacement_is_recovered(tmp_path):
+    parent = str(tmp_path)
+    dir_path = os.path.join(parent, "collection")
+    col = boostnote.BoostnoteCollection.create(dir_path)
+    with col.bulk_writer() as writer:
+        writer.add_entity(make_note("1"))
+    # Crash between moving the old collection aside and moving the new one in
+    os.rename(dir_path, os.path.join(parent, ".collection-replaced"))
+
+    col = boostnote.BoostnoteCollection.create(dir_path)
+    with col.bulk_writer() as writer:
+        writer.add_entity(make_note("2"))
+    assert os.listdir(parent) == ["collection"]
+    assert sorted(os.listdir(os.path.join(dir_path, "notes"))) == ["2.cson"]
+
+
+def test_bulk_writer_discards_on_error(tmp_path):
+    dir_path = str(tmp_path / "collection")
+    col = boostnote.BoostnoteCollection.create(dir_path)
+    with pytest.raises(RuntimeError):
+        with col.bulk_writer() as writer:
+            writer.add_entity(make_note("1"))
+            raise RuntimeError()
+    assert os.listdir(os.path.dirname(dir_path)) == []
+
+
+def test_bulk_writer_reports_failed_writes_in_order(tmp_path):
+    dir_path = str(tmp_path / "collection")
+    missing = str(tmp_path / "missing")
+    col = boostnote.BoostnoteCollection.create(dir_path)
+    with pytest.raises(boostnote.BulkWriteError) as exc_info:
+        with col.bulk_writer(max_workers=4) as writer:
+            for i in range(8):
+                writer.add_entity(make_note(str(i)))
+                if i % 3 == 0:
+                    writer.add_attachment_from(os.path.join(str(i), "a"), missing)
+    assert [path for path, _ in exc_info.value.errors] == [
+        os.path.join("attachments", str(i), "a") for i in (0, 3, 6)
+    ]
+    assert all(isinstance(e, FileNotFoundError) for _, e in exc_info.value.errors)
+    assert os.listdir(os.path.dirname(dir_path)) == []
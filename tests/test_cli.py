@@ -0,0 +1,103 @@
+import subprocess
+import sys
+from pathlib import Path
+
+from sovereign_note import convert_boostnote_to_jex as boost2jex
+
+# Time allowed for `import sovereign_note.cli` on top of importing argparse, in
+# microseconds. Importing the converters eagerly took well over 100ms.
+CLI_IMPORT_BUDGET_US = 10_000
+
+# Modules that must not be loaded just to parse arguments
+HEAVY_MODULES = {
+    "cson",
+    "tarfile",
+    "mimetypes",
+    "uuid",
+    "datetime",
+    "concurrent.futures",
+    "http.server",
+    "ctypes",
+    "sovereign_note.boostnote",
+    "sovereign_note.joplin",
+}
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def import_times(*args) -> dict:
+    """
+    Run python -X importtime with args and get the cumulative import time of
+    each module it loaded, in microseconds
+    """
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", *args],
+        cwd=ROOT,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True,
+    )
+    times = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+def test_cli_import_budget():
+    # Take the best of a few runs so that a busy machine doesn't fail the test
+    overheads = []
+    for _ in range(3):
+        times = import_times("-c", "import sovereign_note.cli")
+        overheads.append(times["sovereign_note.cli"] - times["argparse"])
+    assert min(overheads) < CLI_IMPORT_BUDGET_US
+
+
+def test_help_imports_no_commands():
+    modules = import_times("-m", "sovereign_note.cli", "--help")
+    assert "argparse" in modules
+    assert not HEAVY_MODULES & set(modules)
+
+
+def test_filters_do_not_import_cson():
+    modules = import_times("-c", "import sovereign_note.filters")
+    assert "cson" not in modules
+    assert "sovereign_note.boostnote" not in modules
+
+
+def test_jexstats_does_not_import_cson(tmp_path, reference_boost):
+    jex_loc = str(tmp_path / "vault.jex")
+    boost2jex.main(reference_boost, jex_loc)
+
+    modules = import_times("-m", "sovereign_note.cli", "jexstats", jex_loc)
+    assert "sovereign_note.joplin" in modules
+    assert "cson" not in modules
+    assert "sovereign_note.boostnote" not in modules
+
+
+def test_shards_reject_unsupported_options(reference_boost, tmp_path):
+    for option in (
+        ["--resume"],
+        ["--checkpoint-every", "5"],
+        ["--spill-threshold", "5"],
+    ):
+        proc = subprocess.run(
+            [
+                *(
+                    sys.executable,
+                    "-m",
+                    "sovereign_note.cli",
+                    "boost2jex",
+                    reference_boost,
+                ),
+                *("--shards", "2", "--output", tmp_path, *option),
+            ],
+            cwd=ROOT,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            text=True,
+        )
+        assert proc.returncode == 2
+        assert f"{option[0]} can't be combined with --shards" in proc.stderr
@@ -1,13 +1,17 @@
 import enum
 import json
 import os
-import tempfile
-from pathlib import Path
+import shutil
+import sqlite3
+import tarfile
 
 import cson
+import pytest
 
+from sovereign_note import boostnote
 from sovereign_note import convert_boostnote_to_jex as boost2jex
 from sovereign_note import convert_jex_to_boostnote as jex2boost
+from sovereign_note import diff, joplin, util
 
 
 class FileComparison(enum.Enum):
@@ -83,14 +87,274 @@ def assert_equal_boostnote(a, b):
     )
 
 
-def test_convert():
-    parent = Path(__file__).resolve().parent
-    reference_boost = parent / "resources" / "example-boostnote-collection"
-    jex_loc = tempfile.mktemp()
-    boost_loc = tempfile.mkdtemp()
+def test_convert(reference_boost, tmp_path):
+    jex_loc = str(tmp_path / "vault.jex")
+    boost_loc = str(tmp_path / "boost")
     # Convert from boostnote to JEX
     boost2jex.main(reference_boost, jex_loc)
     # Convert JEX back to boostnote
     jex2boost.main(jex_loc, boost_loc)
     # Verify that no information was lost in the conversion
     assert_equal_boostnote(reference_boost, boost_loc)
+
+
+def test_convert_resume(monkeypatch, reference_boost, tmp_path):
+    jex_loc = str(tmp_path / "vault.jex")
+    boost_loc = str(tmp_path / "boost")
+
+    # Make the conversion die after the first note has been checkpointed
+    write_note = boost2jex.write_note
+    calls = []
+
+    def failing_write_note(*args, **kwargs):
+        calls.append(args)
+        if len(calls) == 2:
+            raise MemoryError()
+        write_note(*args, **kwargs)
+
+    monkeypatch.setattr(boost2jex, "write_note", failing_write_note)
+    with pytest.raises(MemoryError):
+        boost2jex.main(reference_boost, jex_loc)
+    assert not os.path.exists(f"{jex_loc}.journal")
+    calls.clear()
+    with pytest.raises(MemoryError):
+        boost2jex.main(reference_boost, jex_loc, resume=True, checkpoint_every=1)
+    # No checkpoint holds more than checkpoint_every items
+    with open(f"{jex_loc}.journal") as fh:
+        for line in fh:
+            items = json.loads(line).get("items", {})
+            assert sum(len(v) for v in items.values()) <= 1
+
+    monkeypatch.setattr(boost2jex, "write_note", write_note)
+    boost2jex.main(reference_boost, jex_loc, resume=True)
+    assert not os.path.exists(f"{jex_loc}.journal")
+
+    jex2boost.main(jex_loc, boost_loc)
+    assert_equal_boostnote(reference_boost, boost_loc)
+    assert len(os.listdir(os.path.join(boost_loc, "notes"))) == 3
+
+
+def test_convert_from_extracted_jex_with_hardlinks(reference_boost, tmp_path):
+    jex_loc = str(tmp_path / "vault.jex")
+    extracted = str(tmp_path / "extracted")
+    boost_loc = str(tmp_path / "collection")
+    boost2jex.main(reference_boost, jex_loc)
+    with tarfile.open(jex_loc) as tar:
+        tar.extractall(extracted)
+
+    jex2boost.main(extracted, boost_loc, link=util.LINK_HARDLINK)
+    # A directory has no member order to preserve, so only compare the notes
+    # themselves and the set of folders
+    assert_equal_boostnote(reference_boost / "notes", os.path.join(boost_loc, "notes"))
+    with open(reference_boost / "boostnote.json") as a, open(
+        os.path.join(boost_loc, "boostnote.json")
+    ) as b:
+        folder_names = [
+            sorted(f["name"] for f in json.load(fh)["folders"]) for fh in (a, b)
+        ]
+    assert folder_names[0] == folder_names[1]
+
+    resource_inodes = {
+        os.stat(os.path.join(extracted, "resources", name)).st_ino
+        for name in os.listdir(os.path.join(extracted, "resources"))
+    }
+    attachment_paths = [
+        os.path.join(boost_loc, "attachments", relpath)
+        for relpath in get_relpaths(os.path.join(boost_loc, "attachments"))
+    ]
+    assert len(attachment_paths) == 2
+    assert {os.stat(p).st_ino for p in attachment_paths} == resource_inodes
+    for path in attachment_paths:
+        with open(path, "rb") as fh, open(
+            reference_boost / os.path.relpath(path, boost_loc), "rb"
+        ) as ref:
+            assert fh.read() == ref.read()
+
+
+def test_convert_with_spilled_id_maps(reference_boost, tmp_path):
+    jex_loc = str(tmp_path / "vault.jex")
+    boost_loc = str(tmp_path / "boost")
+    boost2jex.main(reference_boost, jex_loc, spill_threshold=0)
+    jex2boost.main(jex_loc, boost_loc, spill_threshold=0)
+    assert_equal_boostnote(reference_boost, boost_loc)
+    assert get_relpaths(os.path.join(reference_boost, "attachments")) == get_relpaths(
+        os.path.join(boost_loc, "attachments")
+    )
+
+
+def test_convert_reproducible(reference_boost, tmp_path):
+    outputs = []
+    for i in range(2):
+        boost_dir = str(tmp_path / f"collection-{i}")
+        shutil.copytree(reference_boost, boost_dir)
+        for note_name in os.listdir(os.path.join(boost_dir, "notes")):
+            note_path = os.path.join(boost_dir, "notes", note_name)
+            with open(note_path) as fh:
+                text = fh.read()
+            with open(note_path, "w") as fh:
+                fh.write(text.replace("tags: []", 'tags: [\n  "b"\n  "a"\n]'))
+        jex_loc = str(tmp_path / f"vault-{i}.jex")
+        boost2jex.main(boost_dir, jex_loc, reproducible=True)
+        with open(jex_loc, "rb") as fh:
+            outputs.append(fh.read())
+    assert outputs[0] == outputs[1]
+
+    with tarfile.open(jex_loc) as tar:
+        members = tar.getmembers()
+    assert {(m.mtime, m.uid, m.gid, m.uname, m.gname) for m in members} == {
+        (0, 0, 0, "", "")
+    }
+
+
+def test_convert_deduplicates_attachments(reference_boost, tmp_path):
+    boost_dir = str(tmp_path / "collection")
+    shutil.copytree(reference_boost, boost_dir)
+    attachments_dir = os.path.join(boost_dir, "attachments")
+    original = os.path.join(
+        attachments_dir, "9836727e-da73-4191-b4e2-81770565e494", "6ea0d43d.png"
+    )
+    os.makedirs(os.path.join(attachments_dir, "other"))
+    shutil.copy(original, os.path.join(attachments_dir, "other", "copy.png"))
+
+    jex_loc = str(tmp_path / "vault.jex")
+    boost2jex.main(boost_dir, jex_loc)
+    with tarfile.open(jex_loc) as tar:
+        blobs = [m.name for m in tar.getmembers() if m.name.startswith("resources/")]
+    assert len(blobs) == 2
+    assert diff.diff(boost_dir, jex_loc).is_empty()
+
+
+def test_convert_from_joplin_profile(reference_boost, tmp_path, joplin_profile):
+    jex_loc = str(tmp_path / "vault.jex")
+    boost2jex.main(reference_boost, jex_loc)
+    profile = joplin_profile(jex_loc)
+
+    store = joplin.open_store(profile)
+    assert isinstance(store, joplin.JoplinSqliteStore)
+    assert store.count_items() == joplin.IndexedJoplinTarStore(jex_loc).count_items()
+
+    boost_loc = str(tmp_path / "collection")
+    jex2boost.main(profile, boost_loc)
+    # Like a directory, a database has no member order to preserve
+    assert_equal_boostnote(reference_boost / "notes", os.path.join(boost_loc, "notes"))
+    with open(reference_boost / "boostnote.json") as a, open(
+        os.path.join(boost_loc, "boostnote.json")
+    ) as b:
+        folder_names = [
+            sorted(f["name"] for f in json.load(fh)["folders"]) for fh in (a, b)
+        ]
+    assert folder_names[0] == folder_names[1]
+    assert get_relpaths(os.path.join(reference_boost, "attachments")) == get_relpaths(
+        os.path.join(boost_loc, "attachments")
+    )
+
+
+def test_joplin_profile_item_deleted_after_opening(
+    reference_boost, tmp_path, joplin_profile
+):
+    jex_loc = str(tmp_path / "vault.jex")
+    boost2jex.main(reference_boost, jex_loc)
+    profile = joplin_profile(jex_loc)
+    store = joplin.open_store(profile)
+
+    note_id = "ae08726c53434f59a3d6bd0544381a1e"
+    with sqlite3.connect(os.path.join(profile, "database.sqlite")) as db:
+        db.execute("DELETE FROM notes WHERE id = ?", (note_id,))
+    for read in (store.read_headers, store.read_item):
+        with pytest.raises(KeyError):
+            read(f"{note_id}.md")
+
+
+def test_fast_stats(reference_boost, tmp_path, joplin_profile):
+    col = boostnote.BoostnoteCollection.from_dir(reference_boost)
+    assert col.stats(fast=True) == col.stats()
+
+    jex_loc = str(tmp_path / "vault.jex")
+    boost2jex.main(reference_boost, jex_loc)
+    extracted = str(tmp_path / "extracted")
+    with tarfile.open(jex_loc) as arc:
+        arc.extractall(extracted)
+    attachments = [
+        os.path.join(reference_boost, "attachments", p)
+        for p in get_relpaths(os.path.join(reference_boost, "attachments"))
+    ]
+    expected_bytes = sum(os.path.getsize(p) for p in attachments)
+    for path in (jex_loc, extracted, joplin_profile(jex_loc)):
+        store = joplin.open_store(path)
+        stats = joplin.store_get_fast_stats(store)
+        assert stats.counts == joplin.store_get_stats(store)
+        assert stats.resource_files == len(attachments)
+        assert stats.resource_bytes == expected_bytes
+
+
+def test_convert_to_sync_target(monkeypatch, reference_boost, tmp_path):
+    boost_loc = str(tmp_path / "boost")
+    shutil.copytree(reference_boost, boost_loc)
+    target = str(tmp_path / "target")
+
+    writers = []
+
+    class RecordingWriter(joplin.JoplinSyncTargetWriter):
+        def close(self):
+            super().close()
+            writers.append(self)
+
+    monkeypatch.setattr(joplin, "JoplinSyncTargetWriter", RecordingWriter)
+
+    def sync() -> tuple:
+        boost2jex.main(boost_loc, target, sync_target=True, jobs=2)
+        return writers[-1].written, writers[-1].unchanged, writers[-1].kept
+
+    # 3 folders, 3 notes, and 2 resources with their data
+    assert sync() == (10, 0, 0)
+    with open(os.path.join(target, "info.json")) as fh:
+        info = json.load(fh)
+    assert info["version"] == joplin.JoplinSyncTargetWriter.SYNC_VERSION
+    assert not info["e2ee"]["value"]
+    assert joplin.open_store(target).count_items()[joplin.JoplinModelType.Note] == 3
+    assert len(os.listdir(os.path.join(target, ".resource"))) == 2
+    store = joplin.JoplinRawStore(target)
+    for resource_id in os.listdir(os.path.join(target, ".resource")):
+        size = os.path.getsize(os.path.join(target, ".resource", resource_id))
+        assert store.get_note_by_id(resource_id).headers["size"] == str(size)
+    assert sync() == (0, 10, 0)
+
+    note_path = os.path.join(
+        boost_loc, "notes", "ae08726c-5343-4f59-a3d6-bd0544381a1e.cson"
+    )
+    with open(note_path) as fh:
+        text = fh.read()
+    with open(note_path, "w") as fh:
+        fh.write(text.replace("My Second Note", "My 2nd Note", 1))
+    assert sync() == (1, 9, 0)
+
+    # An item edited in Joplin since is left alone
+    target_note = os.path.join(target, "d70facf23fba46e8a17202a7be3742c7.md")
+    with open(target_note) as fh:
+        item = joplin.parse_joplin_note(fh.read())
+    item.headers["updated_time"] = "2099-01-01T00:00:00.000Z"
+    with open(target_note, "w") as fh:
+        fh.write(joplin.unparse_joplin_note(item))
+    assert sync() == (0, 9, 1)
+
+    # New data for a resource is written along with the resource, which is
+    # marked as updated
+    attachment = os.path.join(
+        boost_loc, "attachments", "9836727e-da73-4191-b4e2-81770565e494", "6ea0d43d.png"
+    )
+    with open(attachment, "wb") as fh:
+        fh.write(b"not a png")
+    assert sync() == (2, 7, 1)
+    resources = [
+        store.get_note_by_id(r) for r in os.listdir(os.path.join(target, ".resource"))
+    ]
+    touched = [r for r in resources if "blob_updated_time" in r.headers]
+    assert [r.headers["size"] for r in touched] == [str(len(b"not a png"))]
+    assert not [f for f in os.listdir(target) if f.endswith(".tmp")]
+
+    # Encrypted targets are refused, since items are written in plain text
+    info["e2ee"]["value"] = True
+    with open(os.path.join(target, "info.json"), "w") as fh:
+        json.dump(info, fh)
+    with pytest.raises(ValueError):
+        sync()
@@ -0,0 +1,101 @@
+import os
+import subprocess
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from sovereign_note import convert_boostnote_to_jex as boost2jex
+from sovereign_note import diff
+
+
+def test_diff_identical(reference_boost, tmp_path):
+    jex_loc = str(tmp_path / "vault.jex")
+    boost2jex.main(reference_boost, jex_loc)
+    assert diff.diff(reference_boost, jex_loc).is_empty()
+
+
+def test_diff_changes(boost_copy, reference_boost, tmp_path):
+    jex_loc = str(tmp_path / "vault.jex")
+    boost2jex.main(reference_boost, jex_loc)
+    os.remove(
+        os.path.join(boost_copy, "notes", "9836727e-da73-4191-b4e2-81770565e494.cson")
+    )
+    with open(
+        os.path.join(
+            boost_copy,
+            "attachments",
+            "9836727e-da73-4191-b4e2-81770565e494",
+            "6ea0d43d.png",
+        ),
+        "wb",
+    ) as fh:
+        fh.write(b"not a png")
+
+    result = diff.diff(boost_copy, jex_loc)
+    assert [(e.kind, e.key) for e in result.removed] == [
+        ("note", "9836727eda734191b4e281770565e494")
+    ]
+    assert [(e.kind, e.key) for e in result.modified] == [
+        ("attachment", "6ea0d43d.png")
+    ]
+    assert result.added == []
+
+
+def test_diff_metadata_changes(boost_copy, tmp_path):
+    note_path = os.path.join(
+        boost_copy, "notes", "ae08726c-5343-4f59-a3d6-bd0544381a1e.cson"
+    )
+    with open(note_path) as fh:
+        text = fh.read()
+    with open(note_path, "w") as fh:
+        fh.write(text.replace("tags: []", 'tags: [\n  "a"\n  "b"\n]'))
+    jex_loc = str(tmp_path / "vault.jex")
+    boost2jex.main(boost_copy, jex_loc)
+    assert diff.diff(boost_copy, jex_loc).is_empty()
+
+    with open(note_path, "w") as fh:
+        fh.write(text.replace("tags: []", 'tags: [\n  "a"\n]'))
+    result = diff.diff(boost_copy, jex_loc)
+    assert [(e.kind, e.key) for e in result.metadata_changed] == [
+        ("note", "ae08726c53434f59a3d6bd0544381a1e")
+    ]
+    assert not (result.added or result.removed or result.modified)
+
+    with open(note_path, "w") as fh:
+        fh.write(
+            text.replace("tags: []", 'tags: [\n  "b"\n  "a"\n]').replace(
+                "isStarred: false", "isStarred: true"
+            )
+        )
+    assert len(diff.diff(boost_copy, jex_loc).metadata_changed) == 1
+
+    proc = subprocess.run(
+        [sys.executable, "-m", "sovereign_note.cli", "diff", boost_copy, jex_loc],
+        cwd=Path(__file__).resolve().parent.parent,
+        stdout=subprocess.DEVNULL,
+    )
+    assert proc.returncode == 1
+
+
+def test_diff_non_uuid_note_ids(boost_copy, tmp_path):
+    notes_dir = os.path.join(boost_copy, "notes")
+    os.rename(
+        os.path.join(notes_dir, "9836727e-da73-4191-b4e2-81770565e494.cson"),
+        os.path.join(notes_dir, "my-note.cson"),
+    )
+    jex_loc = str(tmp_path / "vault.jex")
+    boost2jex.main(boost_copy, jex_loc, reproducible=True)
+    assert diff.diff(boost_copy, jex_loc).is_empty()
+
+
+def test_diff_with_process_pool(reference_boost, tmp_path):
+    jex_loc = str(tmp_path / "vault.jex")
+    boost2jex.main(reference_boost, jex_loc)
+    serial = (diff.scan_boostnote(reference_boost), diff.scan_jex(jex_loc))
+    with ProcessPoolExecutor(2) as executor:
+        pooled = (
+            diff.scan_boostnote(reference_boost, executor),
+            diff.scan_jex(jex_loc, executor),
+        )
+    assert pooled == serial
+    assert diff.compare(*pooled).is_empty()
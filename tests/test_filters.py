@@ -0,0 +1,135 @@
+import datetime
+import os
+
+import pytest
+
+from sovereign_note import boostnote
+from sovereign_note import convert_boostnote_to_jex as boost2jex
+from sovereign_note import convert_jex_to_boostnote as jex2boost
+from sovereign_note import joplin
+from sovereign_note.filters import NoteFilter, parse_since
+
+SPECIAL_NOTE = "9836727e-da73-4191-b4e2-81770565e494"
+FIRST_NOTE = "ae08726c-5343-4f59-a3d6-bd0544381a1e"
+
+
+@pytest.fixture
+def tagged_collection(boost_copy) -> str:
+    """A copy of the reference collection with the first note tagged"""
+    note_path = os.path.join(boost_copy, "notes", f"{FIRST_NOTE}.cson")
+    with open(note_path) as fh:
+        text = fh.read()
+    with open(note_path, "w") as fh:
+        fh.write(text.replace("tags: []", 'tags: [\n  "work"\n  "misc"\n]'))
+    return boost_copy
+
+
+def jex_items(jex_path: str) -> dict:
+    store = joplin.JoplinTarStore(jex_path)
+    items = {}
+    for p in store.list():
+        item = joplin.parse_joplin_note(store.read(p))
+        items.setdefault(item.model_type, []).append(item)
+    return items
+
+
+def test_scan_entity_keys():
+    keys = boostnote.scan_entity_keys(
+        'title: "A \\"quoted\\" title"\ntags: [\n  "a]b"\n  \'c\'\n]\n'
+        "isStarred: true\ncontent: '''\n  tags: []\n'''\n",
+        {"title", "tags", "isStarred"},
+    )
+    assert keys == {
+        "title": 'A "quoted" title',
+        "tags": ["a]b", "c"],
+        "isStarred": True,
+    }
+
+
+def test_boost2jex_filter_by_folder_and_tag(monkeypatch, tagged_collection, tmp_path):
+    dir_path = tagged_collection
+    read_entity = boostnote.BoostnoteCollection.read_entity
+    parsed = []
+
+    def spy_read_entity(self, note_path):
+        parsed.append(os.path.basename(note_path))
+        return read_entity(self, note_path)
+
+    monkeypatch.setattr(boostnote.BoostnoteCollection, "read_entity", spy_read_entity)
+    jex_path = str(tmp_path / "vault.jex")
+    boost2jex.main(
+        dir_path,
+        jex_path,
+        note_filter=NoteFilter(folders={"Folder One"}, tags={"work"}),
+    )
+
+    # Only the selected note was ever parsed
+    assert parsed == [f"{FIRST_NOTE}.cson"]
+    items = jex_items(jex_path)
+    assert [n.id for n in items[joplin.JoplinModelType.Note]] == [
+        FIRST_NOTE.replace("-", "")
+    ]
+    assert [f.name for f in items[joplin.JoplinModelType.Folder]] == ["Folder One"]
+    assert sorted(t.body for t in items[joplin.JoplinModelType.Tag]) == [
+        "misc",
+        "work",
+    ]
+    assert len(items[joplin.JoplinModelType.NoteTag]) == 2
+    assert joplin.JoplinModelType.Resource not in items
+
+
+def test_boost2jex_filter_by_id_copies_used_attachments(reference_boost, tmp_path):
+    jex_path = str(tmp_path / "vault.jex")
+    boost2jex.main(
+        reference_boost,
+        jex_path,
+        note_filter=NoteFilter(ids={SPECIAL_NOTE.replace("-", "")}),
+    )
+    items = jex_items(jex_path)
+    assert len(items[joplin.JoplinModelType.Note]) == 1
+    assert len(items[joplin.JoplinModelType.Resource]) == 2
+    assert len(joplin.JoplinTarStore(jex_path).list("resources/")) == 2
+
+
+def test_jex2boost_filters_on_headers(monkeypatch, tagged_collection, tmp_path):
+    jex_path = str(tmp_path / "vault.jex")
+    boost2jex.main(tagged_collection, jex_path)
+
+    read = joplin.IndexedJoplinTarStore.read
+    read_paths = []
+
+    def spy_read(self, relative_path):
+        read_paths.append(relative_path)
+        return read(self, relative_path)
+
+    monkeypatch.setattr(joplin.IndexedJoplinTarStore, "read", spy_read)
+    boost_loc = str(tmp_path / "collection")
+    jex2boost.main(
+        jex_path, boost_loc, note_filter=NoteFilter(tags={"work"}, ids={FIRST_NOTE})
+    )
+
+    col = boostnote.BoostnoteCollection.from_dir(boost_loc)
+    assert [e.id for e in col.get_entities()] == [FIRST_NOTE]
+    assert [col.meta.get_folder_name(f) for f in col.meta.list_folder_ids()] == [
+        "Folder One"
+    ]
+    assert list(col.get_attachments()) == []
+    # The unselected note that nothing links to was never read in full
+    assert f"{SPECIAL_NOTE.replace('-', '')}.md" not in read_paths
+
+
+def test_jex2boost_filter_since(reference_boost, tmp_path):
+    jex_path = str(tmp_path / "vault.jex")
+    boost2jex.main(reference_boost, jex_path)
+    boost_loc = str(tmp_path / "collection")
+    jex2boost.main(
+        jex_path,
+        boost_loc,
+        note_filter=NoteFilter(since=parse_since("2021-10-02T16:40:00Z")),
+    )
+    col = boostnote.BoostnoteCollection.from_dir(boost_loc)
+    assert [e.id for e in col.get_entities()] == [SPECIAL_NOTE]
+    assert len(list(col.get_attachments())) == 2
+    assert parse_since("2021-10-02") == datetime.datetime(
+        2021, 10, 2, tzinfo=datetime.timezone.utc
+    )
@@ -0,0 +1,31 @@
+from sovereign_note import boostnote
+from sovereign_note.idmap import IdMap
+
+
+def test_id_map_spills_to_disk():
+    id_map = IdMap(spill_threshold=2)
+    id_map["a"] = "1"
+    id_map["b"] = "2"
+    assert not id_map.spilled
+    id_map["c"] = "3"
+    assert id_map.spilled
+
+    id_map["a"] = "4"
+    del id_map["b"]
+    assert dict(id_map) == {"a": "4", "c": "3"}
+    assert "b" not in id_map
+    assert id_map.get("b") is None
+    assert len(id_map) == 2
+    id_map.close()
+
+
+def test_id_map_key_codec():
+    id_map = IdMap(
+        spill_threshold=0,
+        encode_key=lambda attachment: attachment.relative_path,
+        decode_key=boostnote.BoostnoteAttachment,
+    )
+    id_map[boostnote.BoostnoteAttachment("note/a.png")] = "1"
+    assert id_map.spilled
+    assert id_map[boostnote.BoostnoteAttachment("note/a.png")] == "1"
+    assert list(id_map) == [boostnote.BoostnoteAttachment("note/a.png")]
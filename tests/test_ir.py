@@ -0,0 +1,83 @@
+import os
+
+import pytest
+
+from sovereign_note import boostnote, diff, ir, joplin, merge
+
+
+def get_relpaths(base):
+    return {
+        os.path.relpath(os.path.join(dirname, leaf), base)
+        for dirname, _, leaves in os.walk(base)
+        for leaf in leaves
+    }
+
+
+def read_notes(dir_path):
+    col = boostnote.BoostnoteCollection.from_dir(dir_path)
+    return {
+        e.id: (e.title, e.folder_id, sorted(e.tags), e.content)
+        for e in col.get_entities()
+        if isinstance(e, boostnote.BoostnoteNote)
+    }
+
+
+def test_records_are_streamed_in_order(reference_boost):
+    kinds = [type(r).__name__ for r in ir.read(str(reference_boost))]
+    assert kinds == sorted(kinds, key=["Folder", "Tag", "Resource", "Note"].index)
+    assert "Note" in kinds and "Resource" in kinds
+
+
+def test_pipeline_boostnote_to_jex(reference_boost, tmp_path):
+    jex_loc = str(tmp_path / "vault.jex")
+    merge.merge([str(reference_boost)], jex_loc)
+    assert diff.diff(reference_boost, jex_loc).is_empty()
+    store = joplin.IndexedJoplinTarStore(jex_loc)
+    for name in store.list("resources/"):
+        resource_id = os.path.basename(name).split(".", 1)[0]
+        size = store.get_note_by_id(resource_id).headers["size"]
+        assert size == str(store.member(name).size)
+
+
+def test_pipeline_jex_to_jex_keeps_ids(reference_boost, tmp_path):
+    jex_loc = str(tmp_path / "vault.jex")
+    merge.merge([str(reference_boost)], jex_loc, reproducible=True)
+    normalized_loc = str(tmp_path / "normalized.jex")
+    merge.merge([jex_loc], normalized_loc)
+
+    def ids(path):
+        return sorted(joplin.IndexedJoplinTarStore(path).list())
+
+    assert ids(normalized_loc) == ids(jex_loc)
+    assert diff.diff(reference_boost, normalized_loc).is_empty()
+
+
+def test_pipeline_round_trip(boost_copy, tmp_path):
+    for note_name in os.listdir(os.path.join(boost_copy, "notes")):
+        note_path = os.path.join(boost_copy, "notes", note_name)
+        with open(note_path) as fh:
+            text = fh.read()
+        with open(note_path, "w") as fh:
+            fh.write(text.replace("tags: []", 'tags: [\n  "b"\n  "a"\n]'))
+
+    jex_loc = str(tmp_path / "vault.jex")
+    merge.merge([boost_copy], jex_loc)
+    boost_loc = str(tmp_path / "round-tripped")
+    merge.merge([jex_loc], boost_loc)
+    assert read_notes(boost_loc) == read_notes(boost_copy)
+    assert get_relpaths(os.path.join(boost_loc, "attachments")) == get_relpaths(
+        os.path.join(boost_copy, "attachments")
+    )
+
+    normalized_loc = str(tmp_path / "normalized")
+    merge.merge([boost_loc], normalized_loc, to=ir.FORMAT_BOOSTNOTE, spill_threshold=0)
+    assert read_notes(normalized_loc) == read_notes(boost_copy)
+
+
+def test_pipeline_unreadable_input_leaves_no_staging(tmp_path):
+    out_dir = str(tmp_path)
+    with pytest.raises(FileNotFoundError):
+        merge.merge(
+            [os.path.join(out_dir, "missing.jex")], os.path.join(out_dir, "out")
+        )
+    assert os.listdir(out_dir) == []
@@ -0,0 +1,50 @@
+import os
+import shutil
+
+from sovereign_note import convert_boostnote_to_jex as boost2jex
+from sovereign_note import linkgraph
+
+FIRST_NOTE = "ae08726c-5343-4f59-a3d6-bd0544381a1e"
+SECOND_NOTE = "d70facf2-3fba-46e8-a172-02a7be3742c7"
+ATTACHMENT_NOTE = "9836727e-da73-4191-b4e2-81770565e494"
+
+
+def test_link_graph_refreshes_incrementally(reference_boost, tmp_path):
+    vault = str(tmp_path / "vault")
+    shutil.copytree(reference_boost, vault)
+
+    with linkgraph.open_index(vault) as graph:
+        assert len(graph) == 5
+        assert [i.id for i in graph.links(FIRST_NOTE)] == [FIRST_NOTE, SECOND_NOTE]
+        assert [i.id for i in graph.backlinks(FIRST_NOTE)] == [FIRST_NOTE, SECOND_NOTE]
+        attachment = os.path.join(ATTACHMENT_NOTE, "6ea0d43d.png")
+        assert graph.get(attachment).kind == linkgraph.ATTACHMENT
+        assert [i.id for i in graph.backlinks(attachment)] == [ATTACHMENT_NOTE]
+        assert [i.id for i in graph.orphans()] == [ATTACHMENT_NOTE]
+
+    # Only the changed note is read again
+    first_note_path = os.path.join(vault, "notes", f"{FIRST_NOTE}.cson")
+    with open(first_note_path) as fh:
+        text = fh.read()
+    with open(first_note_path, "w") as fh:
+        fh.write(text.replace(f"(:note:{SECOND_NOTE})", ""))
+    os.remove(os.path.join(vault, "notes", f"{SECOND_NOTE}.cson"))
+    with linkgraph.LinkGraph(linkgraph.default_index_path(vault)) as graph:
+        assert graph.update(linkgraph.scan(vault)) == (1, 1)
+        assert [i.id for i in graph.links(FIRST_NOTE)] == [FIRST_NOTE]
+        assert graph.get(SECOND_NOTE) is None
+        assert graph.update(linkgraph.scan(vault)) == (0, 0)
+
+
+def test_link_graph_of_jex(reference_boost, tmp_path):
+    jex_loc = str(tmp_path / "vault.jex")
+    boost2jex.main(reference_boost, jex_loc)
+    index_path = str(tmp_path / "index.sqlite")
+    with linkgraph.open_index(jex_loc, index_path) as graph:
+        first_note = FIRST_NOTE.replace("-", "")
+        item = graph.get(first_note)
+        assert item.kind == linkgraph.NOTE
+        assert item.title == "My First Note"
+        assert len(graph.backlinks(first_note)) == 2
+        resources = graph.links(ATTACHMENT_NOTE.replace("-", ""))
+        assert [i.kind for i in resources] == [linkgraph.ATTACHMENT] * 2
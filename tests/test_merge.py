@@ -0,0 +1,63 @@
+import json
+import os
+import re
+
+from sovereign_note import boostnote
+from sovereign_note import convert_boostnote_to_jex as boost2jex
+from sovereign_note import merge
+
+
+def test_merge_remaps_colliding_ids(reference_boost, tmp_path):
+    jex_loc = str(tmp_path / "vault.jex")
+    boost2jex.main(reference_boost, jex_loc)
+    out = str(tmp_path / "merged")
+    state = merge.merge([reference_boost, jex_loc, reference_boost], out)
+    assert state.merged == 6
+
+    col = boostnote.BoostnoteCollection.from_dir(out)
+    assert len(col.meta.list_folder_ids()) == 3
+    notes = list(col.get_entities())
+    assert len(notes) == 9
+    assert len({n.id for n in notes}) == 9
+    assert len(list(col.get_attachments())) == 6
+
+    # Each copy of "My First Note" links to the notes of its own copy
+    links = {}
+    for note in notes:
+        links[note.id] = re.findall(r"\(:note:([^)]*)\)", note.content)
+    first_notes = [n for n in notes if n.title == "My First Note"]
+    assert len({tuple(links[n.id]) for n in first_notes}) == 3
+    for note in first_notes:
+        assert note.id in links[note.id]
+        assert all(target in links for target in links[note.id])
+
+    attachments = {a.relative_path for a in col.get_attachments()}
+    storage_links = [
+        target
+        for note in notes
+        for target in re.findall(r"\(:storage/([^)]*)\)", note.content)
+    ]
+    assert len(storage_links) == 6
+    assert set(storage_links) == attachments
+
+
+def test_merge_keeps_same_named_folders_within_an_input(boost_copy, tmp_path):
+    meta_path = os.path.join(boost_copy, "boostnote.json")
+    with open(meta_path) as fh:
+        meta = json.load(fh)
+    meta["folders"][1]["name"] = meta["folders"][0]["name"]
+    with open(meta_path, "w") as fh:
+        json.dump(meta, fh)
+
+    out = str(tmp_path / "merged")
+    state = merge.merge([boost_copy], out)
+    assert state.merged == 0
+    col = boostnote.BoostnoteCollection.from_dir(out)
+    assert len(col.meta.list_folder_ids()) == 3
+
+    # Across inputs, both merge into the first folder of that name
+    out = str(tmp_path / "merged-twice")
+    state = merge.merge([boost_copy, boost_copy], out)
+    assert state.merged == 3
+    col = boostnote.BoostnoteCollection.from_dir(out)
+    assert len(col.meta.list_folder_ids()) == 3
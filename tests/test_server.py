@@ -0,0 +1,96 @@
+import json
+import threading
+import urllib.error
+import urllib.request
+from pathlib import Path
+from urllib.parse import urlencode
+
+import pytest
+
+from sovereign_note import server
+
+
+@pytest.fixture
+def base_url(tmp_path):
+    httpd = server.make_server(port=0, output_root=tmp_path)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def get(base_url, endpoint, **params):
+    with urllib.request.urlopen(f"{base_url}{endpoint}?{urlencode(params)}") as resp:
+        return json.load(resp)
+
+
+def post(base_url, endpoint, payload, **headers):
+    request = urllib.request.Request(
+        f"{base_url}{endpoint}",
+        data=json.dumps(payload).encode("utf-8"),
+        headers={"Content-Type": "application/json", **headers},
+        method="POST",
+    )
+    return urllib.request.urlopen(request)
+
+
+def test_serve_stats_convert_and_lookup(base_url, tmp_path, reference_boost):
+    stats = get(base_url, "/stats", path=reference_boost)["stats"]
+    assert stats["notes"] == 3
+
+    jex_loc = str(tmp_path / "out.jex")
+    payload = {"command": "boost2jex", "path": str(reference_boost), "output": jex_loc}
+    with post(base_url, "/convert", payload) as resp:
+        assert json.load(resp) == {"output": jex_loc}
+
+    stats = get(base_url, "/stats", path=jex_loc)["stats"]
+    assert stats == {"Folder": 3, "Resource": 2, "Note": 3}
+
+    note = get(base_url, "/note", path=jex_loc, id="ae08726c53434f59a3d6bd0544381a1e")[
+        "note"
+    ]
+    assert note["body"].startswith("My First Note")
+    note = get(
+        base_url,
+        "/note",
+        path=reference_boost,
+        id="ae08726c-5343-4f59-a3d6-bd0544381a1e",
+    )["note"]
+    assert note["title"] == "My First Note"
+
+    with pytest.raises(urllib.error.HTTPError) as excinfo:
+        get(base_url, "/note", path=jex_loc, id="missing")
+    assert excinfo.value.code == 404
+
+
+def test_convert_refuses_untrusted_requests(
+    base_url, tmp_path, tmp_path_factory, reference_boost
+):
+    outside = tmp_path_factory.mktemp("outside")
+    payload = {
+        "command": "boost2jex",
+        "path": str(reference_boost),
+        "output": str(outside / "out.jex"),
+    }
+    with pytest.raises(urllib.error.HTTPError) as excinfo:
+        post(base_url, "/convert", payload)
+    assert excinfo.value.code == 403
+    assert not Path(payload["output"]).exists()
+
+    payload["output"] = str(tmp_path / "out.jex")
+    with pytest.raises(urllib.error.HTTPError) as excinfo:
+        post(base_url, "/convert", payload, **{"Content-Type": "text/plain"})
+    assert excinfo.value.code == 415
+    with pytest.raises(urllib.error.HTTPError) as excinfo:
+        post(base_url, "/convert", payload, Host="attacker.example:8737")
+    assert excinfo.value.code == 403
+    assert not Path(payload["output"]).exists()
+
+    request = urllib.request.Request(
+        f"{base_url}/stats?{urlencode({'path': reference_boost})}",
+        headers={"Host": "attacker.example"},
+    )
+    with pytest.raises(urllib.error.HTTPError) as excinfo:
+        urllib.request.urlopen(request)
+    assert excinfo.value.code == 403
@@ -0,0 +1,74 @@
+import json
+import os
+import shutil
+import tarfile
+
+from sovereign_note import boostnote
+from sovereign_note import convert_boostnote_to_jex as boost2jex
+from sovereign_note import joplin, shard
+
+
+def test_shards_are_self_contained(reference_boost, tmp_path):
+    output = str(tmp_path / "vault.jex")
+    plans = shard.main(reference_boost, output, shards=2, jobs=2)
+    assert len(plans) == 2
+
+    with open(os.path.join(os.path.dirname(output), "vault.manifest.json")) as fh:
+        manifest = json.load(fh)
+    notes = [n for s in manifest["shards"] for n in s["notes"]]
+    assert sorted(notes) == [
+        "9836727eda734191b4e281770565e494",
+        "ae08726c53434f59a3d6bd0544381a1e",
+        "d70facf23fba46e8a17202a7be3742c7",
+    ]
+
+    for entry in manifest["shards"]:
+        store = joplin.JoplinTarStore(entry["path"])
+        names = set(store.list())
+        for item_id in entry["folders"] + entry["resources"] + entry["notes"]:
+            assert f"{item_id}.md" in names
+        for resource_id in entry["resources"]:
+            assert any(
+                n.startswith(f"resources/{resource_id}.")
+                for n in store.list("resources/")
+            )
+
+
+def test_planning_scans_notes_without_parsing(monkeypatch, reference_boost):
+    col = boostnote.BoostnoteCollection.from_dir(reference_boost)
+    expected = {
+        path: (entity.folder_id, entity.tags)
+        for path, entity in (
+            (path, col.read_entity(path)) for path in col.get_entity_paths()
+        )
+    }
+
+    def read_entity(self, note_path):
+        raise AssertionError(f"{note_path} was parsed")
+
+    monkeypatch.setattr(boostnote.BoostnoteCollection, "read_entity", read_entity)
+    notes = shard._scan_notes(col)
+    assert len(notes) == 3
+    assert {note.path: (note.folder_id, note.tags) for note in notes} == expected
+    assert any(note.attachments for note in notes)
+
+
+def test_shards_share_copies_of_attachments(boost_copy, tmp_path):
+    attachment_dir = os.path.join(
+        boost_copy, "attachments", "9836727e-da73-4191-b4e2-81770565e494"
+    )
+    shutil.copy(
+        os.path.join(attachment_dir, "6ea0d43d.png"),
+        os.path.join(attachment_dir, "copy.png"),
+    )
+    output = str(tmp_path / "vault.jex")
+    plans = shard.main(boost_copy, output, shards=1, reproducible=True)
+    jex_loc = str(tmp_path / "whole.jex")
+    boost2jex.main(boost_copy, jex_loc, reproducible=True)
+
+    def blobs(path):
+        with tarfile.open(path) as tar:
+            return sorted(n for n in tar.getnames() if n.startswith("resources/"))
+
+    assert len(blobs(plans[0].path)) == 2
+    assert blobs(plans[0].path) == blobs(jex_loc)
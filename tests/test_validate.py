@@ -0,0 +1,98 @@
+import datetime
+import os
+import re
+import tarfile
+
+from sovereign_note import boostnote
+from sovereign_note import convert_boostnote_to_jex as boost2jex
+from sovereign_note import joplin, validate
+
+
+def test_validate_reference_collection(reference_boost):
+    col = boostnote.BoostnoteCollection.from_dir(reference_boost)
+    assert validate.validate_boostnote(col).is_valid()
+
+
+def test_validate_boostnote_problems(boost_copy):
+    os.remove(
+        os.path.join(boost_copy, "notes", "d70facf2-3fba-46e8-a172-02a7be3742c7.cson")
+    )
+    with open(os.path.join(boost_copy, "attachments", "unused.txt"), "w") as fh:
+        fh.write("orphan")
+
+    report = validate.validate_boostnote(
+        boostnote.BoostnoteCollection.from_dir(boost_copy)
+    )
+    assert {(d.source, d.target) for d in report.dangling_links} == {
+        (
+            "ae08726c-5343-4f59-a3d6-bd0544381a1e",
+            "d70facf2-3fba-46e8-a172-02a7be3742c7",
+        )
+    }
+    assert report.orphan_resources == ["unused.txt"]
+
+
+def test_validate_jex_problems(tmp_path):
+    jex_loc = str(tmp_path / "vault.jex")
+    store = joplin.JoplinTarStore(jex_loc)
+    note = joplin.joplin_create_note(
+        "a" * 32,
+        "Title",
+        "[missing](:/" + "b" * 32 + ")",
+        "",
+        datetime.datetime(2021, 1, 1, tzinfo=datetime.timezone.utc),
+        datetime.datetime(2021, 1, 1, tzinfo=datetime.timezone.utc),
+    )
+    store.write(f"{'a' * 32}.md", joplin.unparse_joplin_note(note))
+    resource = joplin.joplin_create_resource("c" * 32, "image.png", 0)
+    # An appended copy of a member replaces it, but the same ID under another
+    # name is a duplicate
+    store.write(f"{'c' * 32}.md", joplin.unparse_joplin_note(resource))
+    store.write(f"{'c' * 32}.md", joplin.unparse_joplin_note(resource))
+    store.write(f"{'d' * 32}.md", joplin.unparse_joplin_note(resource))
+
+    report = validate.validate_jex(store)
+    assert [d.target for d in report.dangling_links] == ["b" * 32]
+    assert report.duplicate_ids == ["c" * 32]
+    assert report.orphan_resources == ["c" * 32]
+    assert report.missing_blobs == ["c" * 32]
+
+
+def test_validate_extracted_jex_and_profile(reference_boost, tmp_path, joplin_profile):
+    jex_loc = str(tmp_path / "vault.jex")
+    boost2jex.main(reference_boost, jex_loc)
+    extracted = str(tmp_path / "extracted")
+    with tarfile.open(jex_loc) as tar:
+        tar.extractall(extracted)
+    profile = joplin_profile(jex_loc)
+    for path in (jex_loc, extracted, profile):
+        assert validate.main(path).is_valid()
+
+    os.remove(
+        os.path.join(
+            extracted, "resources", os.listdir(os.path.join(extracted, "resources"))[0]
+        )
+    )
+    assert len(validate.main(extracted).missing_blobs) == 1
+
+
+def test_validate_boostnote_only_parses_linking_notes(monkeypatch, boost_copy):
+    note_path = os.path.join(
+        boost_copy, "notes", "d70facf2-3fba-46e8-a172-02a7be3742c7.cson"
+    )
+    with open(note_path) as fh:
+        text = fh.read()
+    with open(note_path, "w") as fh:
+        fh.write(re.sub(r"\[([^\]]*)\]\(:note:[^)]*\)", r"\1", text))
+    col = boostnote.BoostnoteCollection.from_dir(boost_copy)
+    parsed = []
+    read_entity = col.read_entity
+
+    def counting_read_entity(note_path):
+        parsed.append(os.path.basename(note_path))
+        return read_entity(note_path)
+
+    monkeypatch.setattr(col, "read_entity", counting_read_entity)
+    assert validate.validate_boostnote(col).is_valid()
+    assert "d70facf2-3fba-46e8-a172-02a7be3742c7.cson" not in parsed
+    assert len(parsed) == 2
@@ -0,0 +1,77 @@
+import os
+
+import pytest
+
+from sovereign_note import convert_boostnote_to_jex as boost2jex
+from sovereign_note import verify
+
+LOST_NOTE = "9836727e-da73-4191-b4e2-81770565e494"
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_verify_round_trips(jobs, reference_boost, tmp_path):
+    assert verify.verify(reference_boost, jobs).is_empty()
+
+    jex_loc = str(tmp_path / "vault.jex")
+    boost2jex.main(reference_boost, jex_loc)
+    assert verify.verify(jex_loc, jobs).is_empty()
+
+
+def test_verify_non_uuid_note_ids(boost_copy, tmp_path):
+    # A note with an ID Joplin doesn't accept
+    notes_dir = os.path.join(boost_copy, "notes")
+    os.rename(
+        os.path.join(notes_dir, f"{LOST_NOTE}.cson"),
+        os.path.join(notes_dir, "my-note.cson"),
+    )
+    boost_loc = boost_copy
+    assert verify.verify(boost_loc, jobs=1).is_empty()
+
+    jex_loc = str(tmp_path / "vault.jex")
+    boost2jex.main(boost_loc, jex_loc, reproducible=True)
+    assert verify.verify(jex_loc, jobs=1).is_empty()
+
+
+def test_verify_reports_lost_items(monkeypatch, reference_boost):
+    convert = verify.jex2boost.main
+
+    def lossy_convert(jex_path, output_location, **kwargs):
+        convert(jex_path, output_location, **kwargs)
+        os.remove(os.path.join(output_location, "notes", f"{LOST_NOTE}.cson"))
+
+    monkeypatch.setattr(verify.jex2boost, "main", lossy_convert)
+    report = verify.verify(reference_boost, jobs=1)
+    assert report.forward.is_empty()
+    assert [(e.kind, e.key) for e in report.backward.removed] == [
+        ("note", LOST_NOTE.replace("-", ""))
+    ]
+    assert not report.backward.added and not report.backward.modified
+
+
+def test_verify_reports_lost_tags(monkeypatch, boost_copy, tmp_path):
+    note_path = os.path.join(boost_copy, "notes", f"{LOST_NOTE}.cson")
+    with open(note_path) as fh:
+        text = fh.read()
+    with open(note_path, "w") as fh:
+        fh.write(text.replace("tags: []", 'tags: [\n  "a"\n]'))
+    jex_loc = str(tmp_path / "vault.jex")
+    boost2jex.main(boost_copy, jex_loc)
+    assert verify.verify(jex_loc, jobs=1).is_empty()
+
+    convert = verify.jex2boost.main
+
+    def untagging_convert(jex_path, output_location, **kwargs):
+        convert(jex_path, output_location, **kwargs)
+        with open(os.path.join(output_location, "notes", f"{LOST_NOTE}.cson")) as fh:
+            text = fh.read()
+        with open(
+            os.path.join(output_location, "notes", f"{LOST_NOTE}.cson"), "w"
+        ) as fh:
+            fh.write(text.replace('"tags":["a"]', '"tags":[]'))
+
+    monkeypatch.setattr(verify.jex2boost, "main", untagging_convert)
+    report = verify.verify(jex_loc, jobs=1)
+    assert [(e.kind, e.key) for e in report.forward.metadata_changed] == [
+        ("note", LOST_NOTE.replace("-", ""))
+    ]
+    assert not report.is_empty()
@@ -0,0 +1,120 @@
+import os
+import shutil
+import tarfile
+import threading
+import time
+
+import pytest
+
+from sovereign_note import convert_boostnote_to_jex as boost2jex
+from sovereign_note import joplin, validate, watch
+
+NOTE_ID = "d70facf2-3fba-46e8-a172-02a7be3742c7"
+JOPLIN_NOTE_ID = "d70facf23fba46e8a17202a7be3742c7"
+OTHER_NOTE_ID = "9836727e-da73-4191-b4e2-81770565e494"
+
+
+def edit_note(boost_loc):
+    note_path = os.path.join(boost_loc, "notes", f"{NOTE_ID}.cson")
+    with open(note_path) as fh:
+        contents = fh.read()
+    with open(note_path, "w") as fh:
+        fh.write(contents.replace("## References", "## Edited"))
+    return os.path.join("notes", f"{NOTE_ID}.cson")
+
+
+def test_mirror_applies_edits_and_deletions(boost_copy, tmp_path):
+    jex_loc = str(tmp_path / "vault.jex")
+    mirror = watch.JexMirror(boost_copy, jex_loc)
+    mirror.build()
+
+    mirror.apply({edit_note(boost_copy)})
+    store = joplin.JoplinTarStore(jex_loc)
+    assert "## Edited" in store.get_note_by_id(JOPLIN_NOTE_ID).body
+
+    os.remove(os.path.join(boost_copy, "notes", f"{NOTE_ID}.cson"))
+    mirror.apply({os.path.join("notes", f"{NOTE_ID}.cson")})
+    names = tarfile.open(jex_loc).getnames()
+    assert f"{JOPLIN_NOTE_ID}.md" not in names
+    assert len(names) == len(set(names))
+
+
+def test_mirror_matches_converter_ids_and_validates(boost_copy, tmp_path):
+    attachment_dir = os.path.join(boost_copy, "attachments", OTHER_NOTE_ID)
+    jex_loc = str(tmp_path / "vault.jex")
+    mirror = watch.JexMirror(boost_copy, jex_loc, reproducible=True)
+    mirror.build()
+    converted_loc = str(tmp_path / "converted.jex")
+    boost2jex.main(boost_copy, converted_loc, reproducible=True)
+    assert sorted(joplin.JoplinTarStore(jex_loc).list()) == sorted(
+        joplin.JoplinTarStore(converted_loc).list()
+    )
+
+    # A copy of an attachment shares its resource
+    shutil.copy(
+        os.path.join(attachment_dir, "6ea0d43d.png"),
+        os.path.join(attachment_dir, "copy.png"),
+    )
+    mirror.apply(
+        {edit_note(boost_copy), os.path.join("attachments", OTHER_NOTE_ID, "copy.png")}
+    )
+    resources = [
+        n for n in tarfile.open(jex_loc).getnames() if n.startswith("resources/")
+    ]
+    assert len(set(resources)) == 2
+    # The edited note was appended again without being reported as a duplicate
+    report = validate.validate_jex(joplin.JoplinTarStore(jex_loc))
+    assert report.duplicate_ids == []
+
+
+def test_mirror_rescan_finds_deletions(boost_copy, tmp_path):
+    jex_loc = str(tmp_path / "vault.jex")
+    mirror = watch.JexMirror(boost_copy, jex_loc)
+    mirror.build()
+    os.remove(os.path.join(boost_copy, "notes", f"{NOTE_ID}.cson"))
+    mirror.apply({watch.RESCAN})
+    assert f"{JOPLIN_NOTE_ID}.md" not in tarfile.open(jex_loc).getnames()
+
+
+def test_inotify_overflow_requests_rescan(boost_copy, monkeypatch):
+    try:
+        watcher = watch.InotifyWatcher(boost_copy)
+    except (OSError, AttributeError, TypeError):
+        pytest.skip("inotify is unavailable")
+    try:
+        event = watch.InotifyWatcher._EVENT.pack(
+            -1, watch.InotifyWatcher.IN_Q_OVERFLOW, 0, 0
+        )
+        monkeypatch.setattr(watch.os, "read", lambda fd, n: event)
+        assert watcher._read_events() == {watch.RESCAN}
+    finally:
+        monkeypatch.undo()
+        watcher.close()
+
+
+@pytest.mark.parametrize("poll", [True, False])
+def test_watchers_report_changes(boost_copy, poll):
+    watcher = watch.make_watcher(boost_copy, poll=poll)
+    if isinstance(watcher, watch.PollingWatcher):
+        watcher.interval = 0.05
+    try:
+        assert watcher.wait(timeout=0.1) == set()
+        # Make sure the modification time changes even on coarse filesystems
+        time.sleep(0.01)
+        changed_path = edit_note(boost_copy)
+        assert changed_path in watcher.wait(timeout=5)
+    finally:
+        watcher.close()
+
+
+def test_watch_main_stops(boost_copy, tmp_path):
+    jex_loc = str(tmp_path / "vault.jex")
+    stop = threading.Event()
+    thread = threading.Thread(
+        target=watch.main, args=(boost_copy, jex_loc), kwargs={"stop": stop}
+    )
+    thread.start()
+    stop.set()
+    thread.join(timeout=10)
+    assert not thread.is_alive()
+    assert f"{JOPLIN_NOTE_ID}.md" in joplin.JoplinTarStore(jex_loc).list()